@@ -0,0 +1,12 @@
+"""
+Reproducible performance benchmarks for MyData
+
+The benchmarks generate a synthetic data directory for a folder structure,
+then scan, upload and look up its files, using a local stand-in for the
+MyTardis API (with configurable latency) and, for SCP uploads, the mock SCP
+server used by the tests.  Results are written as JSON, so that they can be
+compared across commits, e.g.
+
+    python -m benchmarks.run --folder-structure "Username / Dataset" \\
+        --files 1000 --sizes lognormal:100000 --output results.json
+"""
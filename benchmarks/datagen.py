@@ -0,0 +1,122 @@
+"""
+Generate synthetic data directories for benchmarking
+
+Each folder structure level is given folder names which the MyTardis stand-in
+can resolve, e.g. "testuser1" for "Username" or "Group1" for "User Group".
+File sizes are drawn from a seeded distribution, so the same parameters
+always generate the same tree:
+
+    fixed:SIZE          every file is SIZE bytes
+    uniform:MIN-MAX     sizes uniformly distributed between MIN and MAX bytes
+    lognormal:MEDIAN    log-normally distributed sizes with median MEDIAN bytes
+                        (many small files and a few large ones)
+"""
+import math
+import os
+import random
+
+FOLDER_STRUCTURES = [
+    "Username / Dataset",
+    "Email / Dataset",
+    "Username / Experiment / Dataset",
+    "Email / Experiment / Dataset",
+    'Username / "MyTardis" / Experiment / Dataset',
+    "User Group / Dataset",
+    "User Group / Experiment / Dataset",
+    "User Group / Instrument / Full Name / Dataset",
+    "Experiment / Dataset",
+    "Dataset",
+]
+
+# Shape parameter for log-normally distributed file sizes:
+LOGNORMAL_SIGMA = 1.5
+
+# File contents are written from a block of random bytes:
+BLOCK_SIZE = 1024 * 1024
+
+
+def parse_size_distribution(spec):
+    """
+    Parse a size distribution, e.g. "uniform:1000-5000" into a function
+    which returns a file size, given a random.Random instance
+
+    :raises ValueError: if the distribution can't be parsed
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        if kind == "fixed":
+            size = int(params)
+            return lambda rng: size
+        if kind == "uniform":
+            min_size, max_size = [int(param) for param in params.split("-")]
+            return lambda rng: rng.randint(min_size, max_size)
+        if kind == "lognormal":
+            median = float(params)
+            return lambda rng: int(
+                rng.lognormvariate(math.log(median), LOGNORMAL_SIGMA))
+    except ValueError:
+        pass
+    raise ValueError("Invalid size distribution: %s" % spec)
+
+
+def get_level_names(level, index, instrument_name):
+    """
+    Return the folder name for the index'th folder at a folder structure level
+    """
+    names = {
+        "Username": "testuser%d" % index,
+        "Email": "testuser%d@example.com" % index,
+        "User Group": "Group%d" % index,
+        "Instrument": instrument_name,
+        "Full Name": "Test User%d" % index,
+        "Experiment": "Exp%d" % index,
+        '"MyTardis"': "MyTardis",
+        "Dataset": "Dataset %03d" % index,
+    }
+    return names[level]
+
+
+def generate_data_tree(root, folder_structure, num_owners=2, num_experiments=2,
+                       num_datasets=2, num_files=10, sizes="fixed:1000",
+                       seed=0, instrument_name="Test Instrument"):
+    """
+    Generate a data directory in root for folder_structure, with num_owners
+    user or group folders, num_experiments experiment folders per owner,
+    num_datasets dataset folders per parent folder and num_files files per
+    dataset, returning the number of files and bytes written
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    rng = random.Random(seed)
+    size_distribution = parse_size_distribution(sizes)
+    block = bytes(rng.getrandbits(8) for _ in range(BLOCK_SIZE))
+    counts = {
+        "Username": num_owners,
+        "Email": num_owners,
+        "User Group": num_owners,
+        "Full Name": num_owners,
+        "Experiment": num_experiments,
+        "Dataset": num_datasets,
+    }
+    parents = [root]
+    for level in [level.strip() for level in folder_structure.split("/")]:
+        parents = [
+            os.path.join(parent, get_level_names(level, index, instrument_name))
+            for parent in parents
+            for index in range(1, counts.get(level, 1) + 1)
+        ]
+
+    total_files = 0
+    total_bytes = 0
+    for dataset_path in parents:
+        os.makedirs(dataset_path)
+        for file_num in range(1, num_files + 1):
+            size = max(0, size_distribution(rng))
+            with open(os.path.join(dataset_path, "file%05d.dat" % file_num),
+                      "wb") as data_file:
+                remaining = size
+                while remaining > 0:
+                    data_file.write(block[:min(remaining, BLOCK_SIZE)])
+                    remaining -= BLOCK_SIZE
+            total_files += 1
+            total_bytes += size
+    return total_files, total_bytes
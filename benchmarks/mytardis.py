@@ -0,0 +1,316 @@
+"""
+A local stand-in for the MyTardis API, for benchmarking
+
+It serves the API endpoints used by "mydata upload", using the mock
+responses from tests/mocks.py, and remembers the experiments, datasets
+and DataFile records created, so that files uploaded in one stage are
+found by the lookups in the next stage.  Every request is delayed by
+latency seconds, to simulate a remote server.
+
+Files uploaded via POST are read and discarded.  Files uploaded via
+staging are written by the mock SCP server to staging_path.
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlparse
+
+from tests.mocks import (
+    build_list_response,
+    EMPTY_LIST_RESPONSE,
+    MOCK_API_ENDPOINTS_RESPONSE,
+    MOCK_APPROVED_URR_RESPONSE,
+    MOCK_EXISTING_UPLOADER_RESPONSE,
+    MOCK_FACILITY_RESPONSE,
+    MOCK_INSTRUMENT_RESPONSE,
+    MOCK_UNAPPROVED_URR_RESPONSE,
+    MOCK_UPLOADER_RESPONSE,
+    MOCK_USER_RESPONSE,
+)
+
+READ_SIZE = 1024 * 1024
+
+JSON_DATA_REGEX = re.compile(
+    rb'name="json_data"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', re.DOTALL)
+
+
+class MyTardisStandIn(ThreadingHTTPServer):
+    """
+    Serves the MyTardis API endpoints used by MyData from memory
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, scp_port=None,
+                 staging_path="/tmp"):
+        super().__init__(address, MyTardisRequestHandler)
+        self.latency = latency
+        self.scp_port = scp_port
+        self.staging_path = staging_path
+        self.lock = threading.Lock()
+        self.experiments = dict()
+        self.datasets = dict()
+        self.datafiles = dict()
+        self.request_counts = Counter()
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        The base URL for MyData's mytardis_url setting
+        """
+        return "http://%s:%s" % self.server_address[:2]
+
+    def start(self):
+        """
+        Serve requests in a background thread
+        """
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="mytardis_stand_in", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop serving requests
+        """
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def get_or_create(self, records, key, record):
+        """
+        Return the record stored under key in records (a dictionary),
+        storing record (with a new ID) if there isn't one
+        """
+        with self.lock:
+            if key not in records:
+                record["id"] = len(records) + 1
+                records[key] = record
+            return records[key]
+
+
+class MyTardisRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles one request to the MyTardis stand-in
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        """
+        Don't log each request to stderr
+        """
+
+    def get_endpoint(self):
+        """
+        Return the API resource name and the query parameters
+        """
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split("/") if part]
+        endpoint = "/".join(part for part in parts[2:] if not part.isdigit())
+        query = dict(
+            (key, values[0]) for key, values in parse_qs(parsed.query).items())
+        return endpoint, parts, query
+
+    def respond(self, text="", status=200, headers=None):
+        """
+        Send a response, after the server's latency
+        """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self, keep=READ_SIZE):
+        """
+        Read the request body, returning up to its first keep bytes
+        """
+        remaining = int(self.headers.get("Content-Length", 0))
+        kept = b""
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, READ_SIZE))
+            if not chunk:
+                break
+            if len(kept) < keep:
+                kept += chunk[:keep - len(kept)]
+            remaining -= len(chunk)
+        return kept
+
+    def do_GET(self):
+        # pylint: disable=invalid-name, too-many-branches
+        """
+        Handle GET requests
+        """
+        endpoint, parts, query = self.get_endpoint()
+        self.server.request_counts["GET %s" % endpoint] += 1
+        server = self.server
+        if endpoint == "":
+            self.respond(MOCK_API_ENDPOINTS_RESPONSE)
+        elif endpoint == "user":
+            username = query.get("username") or \
+                query.get("email__iexact", "").split("@")[0]
+            if username == "testfacility":
+                self.respond(MOCK_USER_RESPONSE)
+                return
+            self.respond(build_list_response([dict(
+                id=int(re.sub(r"\D", "", username) or 0) + 1000,
+                username=username,
+                first_name="Test",
+                last_name=username,
+                email="%s@example.com" % username,
+                groups=[],
+            )]))
+        elif endpoint == "group":
+            self.respond(build_list_response([dict(
+                id=int(re.sub(r"\D", "", query["name"]) or 0) + 1000,
+                name=query["name"])]))
+        elif endpoint == "facility":
+            self.respond(MOCK_FACILITY_RESPONSE)
+        elif endpoint == "instrument":
+            self.respond(MOCK_INSTRUMENT_RESPONSE)
+        elif endpoint == "mydata_uploader":
+            self.respond(MOCK_EXISTING_UPLOADER_RESPONSE)
+        elif endpoint == "mydata_uploaderregistrationrequest":
+            if server.scp_port:
+                self.respond(
+                    Template(MOCK_APPROVED_URR_RESPONSE)
+                    .substitute(scp_port=server.scp_port)
+                    .replace("/path/to/upload/to/", server.staging_path))
+            else:
+                self.respond(MOCK_UNAPPROVED_URR_RESPONSE)
+        elif endpoint == "mydata_experiment":
+            key = (query.get("title"), query.get("user_folder_name") or None,
+                   query.get("group_folder_name") or None)
+            experiment = server.experiments.get(key)
+            self.respond(build_list_response([experiment] if experiment else []))
+        elif endpoint == "dataset":
+            dataset = server.datasets.get(
+                (query.get("experiments__id"), query.get("description")))
+            self.respond(build_list_response([dataset] if dataset else []))
+        elif endpoint == "mydata_dataset_file":
+            self.get_datafiles(query)
+        elif endpoint == "dataset_file/verify":
+            self.verify_datafile(int(parts[3]))
+        else:
+            self.respond(EMPTY_LIST_RESPONSE)
+
+    def get_datafiles(self, query):
+        """
+        Look up a DataFile record, or list a dataset's DataFile records
+        """
+        dataset_id = int(query["dataset__id"])
+        if "filename" in query:
+            datafile = self.server.datafiles.get(
+                (dataset_id, query.get("directory", ""), query["filename"]))
+            self.respond(build_list_response([datafile] if datafile else []))
+            return
+        datafiles = [
+            datafile for key, datafile in sorted(self.server.datafiles.items())
+            if key[0] == dataset_id]
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        response = json.loads(
+            build_list_response(datafiles[offset:offset + limit]))
+        response["meta"]["total_count"] = len(datafiles)
+        self.respond(json.dumps(response))
+
+    def verify_datafile(self, datafile_id):
+        """
+        Mark a DataFile uploaded via staging as verified
+        """
+        with self.server.lock:
+            for datafile in self.server.datafiles.values():
+                if datafile["id"] == datafile_id:
+                    datafile["replicas"][0]["verified"] = True
+        self.respond()
+
+    def do_POST(self):
+        # pylint: disable=invalid-name
+        """
+        Handle POST requests
+        """
+        endpoint, _, _ = self.get_endpoint()
+        self.server.request_counts["POST %s" % endpoint] += 1
+        server = self.server
+        if endpoint == "mydata_dataset_file":
+            self.create_datafile()
+            return
+        body = json.loads(self.read_body() or b"{}")
+        if endpoint == "mydata_experiment":
+            parameters = dict(
+                (parameter["name"], parameter["value"])
+                for parameter in body["parameter_sets"][0]["parameters"])
+            experiment = server.get_or_create(
+                server.experiments,
+                (body["title"], parameters.get("user_folder_name") or None,
+                 parameters.get("group_folder_name") or None),
+                dict(title=body["title"]))
+            experiment["resource_uri"] = \
+                "/api/v1/experiment/%s/" % experiment["id"]
+            self.respond(json.dumps(experiment), status=201)
+        elif endpoint == "dataset":
+            experiment_id = body["experiments"][0].rstrip("/").split("/")[-1]
+            dataset = server.get_or_create(
+                server.datasets, (experiment_id, body["description"]),
+                dict(description=body["description"]))
+            dataset["resource_uri"] = "/api/v1/dataset/%s/" % dataset["id"]
+            self.respond(json.dumps(dataset), status=201)
+        elif endpoint == "mydata_uploader":
+            self.respond(MOCK_UPLOADER_RESPONSE, status=201)
+        else:
+            self.respond(status=201)
+
+    def do_PUT(self):
+        # pylint: disable=invalid-name
+        """
+        Handle PUT requests, i.e. updating MyData's Uploader record
+        """
+        self.server.request_counts["PUT %s" % self.get_endpoint()[0]] += 1
+        self.read_body()
+        self.respond(MOCK_UPLOADER_RESPONSE)
+
+    def create_datafile(self):
+        """
+        Create a DataFile record, from a multipart POST upload (which is
+        verified immediately), or for an upload via staging
+        """
+        server = self.server
+        multipart = self.headers.get("Content-Type", "").startswith("multipart")
+        body = self.read_body()
+        if multipart:
+            body = JSON_DATA_REGEX.search(body).group(1)
+        datafile_dict = json.loads(body)
+        dataset_id = int(datafile_dict["dataset"].rstrip("/").split("/")[-1])
+        directory = datafile_dict.get("directory") or ""
+        uri = "DatasetDescription-%s/%s" % (
+            dataset_id, "/".join(
+                part for part in (directory, datafile_dict["filename"]) if part))
+        datafile = server.get_or_create(
+            server.datafiles,
+            (dataset_id, directory, datafile_dict["filename"]),
+            dict(
+                dataset=datafile_dict["dataset"],
+                directory=directory,
+                filename=datafile_dict["filename"],
+                size=datafile_dict.get("size"),
+                md5sum=datafile_dict.get("md5sum"),
+                replicas=[dict(id=1, uri=uri, verified=multipart)],
+            ))
+        headers = {"Location": "/api/v1/mydata_dataset_file/%s/" % datafile["id"]}
+        if multipart:
+            self.respond(status=201, headers=headers)
+        else:
+            self.respond(
+                "%s/%s" % (server.staging_path.rstrip("/"), uri),
+                status=201, headers=headers)
@@ -0,0 +1,294 @@
+"""
+Run a MyData benchmark and write the results as JSON
+
+Three stages are measured, each with its elapsed time, peak RSS and the
+number of MyTardis API requests made:
+
+scan: Scanning the data directory and resolving users and groups
+upload: Looking up, hashing and uploading every file (and creating
+    experiments, datasets and DataFile records)
+lookup: Looking up every file again, after they have been uploaded,
+    as a repeated "mydata upload" would
+"""
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import psutil
+
+from benchmarks.datagen import FOLDER_STRUCTURES, generate_data_tree
+from benchmarks.mytardis import MyTardisStandIn
+
+CONFIG_TEMPLATE = """[MyData]
+instrument_name = Test Instrument
+facility_name = Test Facility
+data_directory = %(data_directory)s
+contact_name = MyData Tester
+contact_email = MyData.Tester@example.com
+mytardis_url = %(mytardis_url)s
+username = testfacility
+api_key = benchmark
+folder_structure = %(folder_structure)s
+group_prefix =
+validate_folder_structure = False
+upload_invalid_user_folders = True
+ignore_old_datasets = False
+ignore_new_files = False
+max_upload_threads = %(upload_threads)s
+max_lookup_threads = %(lookup_threads)s
+max_upload_retries = 1
+uuid = 00000000001
+cache_datafile_lookups = False
+"""
+
+# How often to sample the process's memory usage:
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+class StageMonitor:
+    """
+    Measures a benchmark stage's elapsed time, peak RSS (sampled in a
+    background thread) and MyTardis API requests
+    """
+
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.stopping = threading.Event()
+        self.thread = None
+        self.start_time = None
+        self.start_counts = None
+        self.results = dict()
+
+    def sample_rss(self):
+        """
+        Record the peak RSS until the stage ends
+        """
+        while not self.stopping.is_set():
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            self.stopping.wait(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.start_counts = self.stand_in.request_counts.copy()
+        self.peak_rss = self.process.memory_info().rss
+        self.thread = threading.Thread(target=self.sample_rss, daemon=True)
+        self.thread.start()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        seconds = time.perf_counter() - self.start_time
+        self.stopping.set()
+        self.thread.join()
+        requests = self.stand_in.request_counts - self.start_counts
+        self.results.update(
+            seconds=round(seconds, 4),
+            peak_rss_bytes=self.peak_rss,
+            api_requests=sum(requests.values()),
+            api_requests_by_endpoint=dict(sorted(requests.items())),
+        )
+
+
+def get_commit():
+    """
+    Return the current git commit, if available
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def rate(count, seconds):
+    """
+    Return count per second, rounded
+    """
+    return round(count / seconds, 2) if seconds else None
+
+
+def run_stages(stand_in, upload_method_name, key_pair=None):
+    """
+    Scan, upload and look up the files in the data directory described by
+    MyData.cfg (which must be loaded after MYDATA_CONFIG_PATH is set),
+    returning the results for each stage, and MyData's own timings for
+    each step within them (see mydata.utils.instrumentation)
+    """
+    # pylint: disable=too-many-locals
+    from mydata.conf import settings
+    from mydata.models.upload import UploadMethod, UploadStatus
+    from mydata.tasks.folders import scan_folders
+    from mydata.tasks.lookups import FolderLookup
+    from mydata.tasks.uploads import upload_folder
+    from mydata.utils.instrumentation import INSTRUMENTATION
+
+    upload_method = dict(
+        post=UploadMethod.MULTIPART_POST, scp=UploadMethod.SCP
+    )[upload_method_name]
+    if key_pair:
+        settings.uploader.ssh_key_pair = key_pair
+    stages = dict()
+    folders = []
+
+    with StageMonitor(stand_in) as monitor:
+        scan_folders(
+            lambda user: None, lambda group: None, lambda exp: None,
+            folders.append)
+    num_files = sum(folder.num_files for folder in folders)
+    stages["scan"] = dict(
+        monitor.results, folders=len(folders), files=num_files,
+        files_per_second=rate(num_files, monitor.results["seconds"]))
+
+    uploads = dict(completed=0, failed=0, bytes=0)
+
+    def upload_callback(upload):
+        if upload.status == UploadStatus.COMPLETED:
+            uploads["completed"] += 1
+            uploads["bytes"] += upload.file_size
+        elif upload.status == UploadStatus.FAILED:
+            uploads["failed"] += 1
+
+    with StageMonitor(stand_in) as monitor:
+        for folder in folders:
+            asyncio.run(upload_folder(
+                folder, lambda lookup: None, upload_callback,
+                upload_method=upload_method))
+    stages["upload"] = dict(
+        monitor.results, **uploads,
+        files_per_second=rate(uploads["completed"], monitor.results["seconds"]),
+        mb_per_second=rate(uploads["bytes"] / 1000000.0,
+                           monitor.results["seconds"]))
+
+    lookups = []
+    with StageMonitor(stand_in) as monitor:
+        with ThreadPoolExecutor(
+                max_workers=settings.miscellaneous.max_lookup_threads
+        ) as executor:
+            for folder in folders:
+                asyncio.run(FolderLookup(
+                    folder, lookups.append, upload_method
+                ).lookup_datafiles_concurrently(executor))
+    stages["lookup"] = dict(
+        monitor.results, lookups=len(lookups),
+        lookups_per_second=rate(len(lookups), monitor.results["seconds"]))
+    return stages, INSTRUMENTATION.get_report()["stages"]
+
+
+@click.command()
+@click.option(
+    "--folder-structure",
+    type=click.Choice(FOLDER_STRUCTURES),
+    default="Username / Dataset",
+)
+@click.option("--owners", type=click.IntRange(min=1), default=2,
+              help="User or group folders.")
+@click.option("--experiments", type=click.IntRange(min=1), default=2,
+              help="Experiment folders per owner.")
+@click.option("--datasets", type=click.IntRange(min=1), default=2,
+              help="Dataset folders per parent folder.")
+@click.option("--files", type=click.IntRange(min=1), default=100,
+              help="Files per dataset folder.")
+@click.option("--sizes", default="lognormal:100000",
+              help="File size distribution, e.g. fixed:1000, "
+              "uniform:1000-5000 or lognormal:100000")
+@click.option("--seed", type=int, default=0)
+@click.option("--latency", type=float, default=0.0,
+              help="Seconds to delay each MyTardis API response.")
+@click.option("--upload-method", type=click.Choice(["post", "scp"]),
+              default="post")
+@click.option("--upload-threads", type=click.IntRange(min=1), default=4)
+@click.option("--lookup-threads", type=click.IntRange(min=1), default=8)
+@click.option("--output", type=click.File("w"), default="-",
+              help="File to write the JSON results to.")
+def run(folder_structure, owners, experiments, datasets, files, sizes, seed,
+        latency, upload_method, upload_threads, lookup_threads, output):
+    """
+    Run a MyData benchmark with a synthetic data directory and
+    local stand-ins for MyTardis and its staging server
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    parameters = dict(
+        folder_structure=folder_structure, owners=owners,
+        experiments=experiments, datasets=datasets, files=files, sizes=sizes,
+        seed=seed, latency=latency, upload_method=upload_method,
+        upload_threads=upload_threads, lookup_threads=lookup_threads)
+    temp_dir = tempfile.mkdtemp(prefix="mydata-benchmark-")
+    scp_server = None
+    key_pair = None
+    try:
+        data_directory = os.path.join(temp_dir, "data")
+        staging_path = os.path.join(temp_dir, "staging")
+        os.makedirs(staging_path)
+        start_time = time.perf_counter()
+        num_files, num_bytes = generate_data_tree(
+            data_directory, folder_structure, owners, experiments, datasets,
+            files, sizes, seed)
+        generated = dict(
+            files=num_files, bytes=num_bytes,
+            seconds=round(time.perf_counter() - start_time, 4))
+
+        stand_in = MyTardisStandIn(
+            ("127.0.0.1", 0), latency=latency, staging_path=staging_path)
+        stand_in.start()
+        config_path = os.path.join(temp_dir, "MyData.cfg")
+        with open(config_path, "w") as config_file:
+            config_file.write(CONFIG_TEMPLATE % dict(
+                data_directory=data_directory, mytardis_url=stand_in.url,
+                folder_structure=folder_structure,
+                upload_threads=upload_threads, lookup_threads=lookup_threads))
+        # MyData's settings are loaded from MYDATA_CONFIG_PATH when
+        # mydata.conf is first imported, so no mydata modules are
+        # imported until now:
+        os.environ["MYDATA_CONFIG_PATH"] = config_path
+        os.environ["MYDATA_DEBUG_LOG_PATH"] = temp_dir
+        try:
+            if upload_method == "scp":
+                # The mock SCP server authenticates the "MyDataTest" key pair:
+                from mydata.utils.openssh import find_or_create_key_pair
+                from tests.mock_scp_server import ThreadedSshServer
+
+                key_pair = find_or_create_key_pair("MyDataTest")
+                scp_server = ThreadedSshServer(("127.0.0.1", 0))
+                threading.Thread(
+                    target=scp_server.serve_forever, daemon=True).start()
+                stand_in.scp_port = scp_server.server_address[1]
+            # Keep MyData's progress messages out of the JSON results:
+            with contextlib.redirect_stdout(sys.stderr):
+                stages, instrumentation = run_stages(
+                    stand_in, upload_method, key_pair)
+        finally:
+            stand_in.stop()
+
+        json.dump(dict(
+            commit=get_commit(),
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            parameters=parameters,
+            generated=generated,
+            stages=stages,
+            instrumentation=instrumentation,
+        ), output, indent=2)
+        output.write("\n")
+    finally:
+        if scp_server:
+            scp_server.shutdown()
+        if key_pair:
+            key_pair.delete()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run()  # pylint: disable=no-value-for-parameter
@@ -2,35 +2,74 @@
 """
 client.py
 """
+import importlib
+
 import click
 
-from mydata.commands.config import config_cmd
-from mydata.commands.index import index_cmd
-from mydata.commands.scan import scan_cmd
-from mydata.commands.upload import upload_cmd
-from mydata.commands.version import version_cmd
+from mydata.utils.profiling import PROFILE_MODES, start_profiler
+
+# Subcommands are only imported when they are run (or listed by --help),
+# so that e.g. "mydata version" doesn't load MyData.cfg, or import the
+# modules used for uploading:
+COMMANDS = dict(
+    config="mydata.commands.config:config_cmd",
+    daemon="mydata.commands.daemon:daemon_cmd",
+    index="mydata.commands.index:index_cmd",
+    scan="mydata.commands.scan:scan_cmd",
+    upload="mydata.commands.upload:upload_cmd",
+    version="mydata.commands.version:version_cmd",
+    watch="mydata.commands.watch:watch_cmd",
+)
 
 
-@click.group()
-def entry_point():
+class LazyGroup(click.Group):
+    """
+    A command group which imports its subcommands on demand, from
+    a dictionary of "module:attribute" paths keyed by command name
+    """
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            module_name, attribute = self.lazy_commands[cmd_name].split(":")
+            module = importlib.import_module(module_name)
+            self.add_command(getattr(module, attribute), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
+@click.option(
+    "--profile",
+    type=click.Choice(PROFILE_MODES),
+    help="Profile the command with cProfile (cpu), by sampling all "
+    "threads' stacks (sample), or with tracemalloc (mem).",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="File to write the profile to.",
+)
+@click.pass_context
+def entry_point(ctx, profile, profile_output):
     """
     A command-line tool for uploading data to MyTardis, supporting the
     MyData configuration file format used by the MyData desktop application
     """
+    if profile:
+        ctx.call_on_close(start_profiler(profile, profile_output))
 
 
 def run():
     """
     Main function for command-line interface.
     """
-
-    entry_point.add_command(config_cmd)
-    entry_point.add_command(index_cmd)
-    entry_point.add_command(scan_cmd)
-    entry_point.add_command(upload_cmd)
-    entry_point.add_command(version_cmd)
-
-    entry_point()
+    entry_point()  # pylint: disable=no-value-for-parameter
 
 
 if __name__ == "__main__":
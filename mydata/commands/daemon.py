@@ -0,0 +1,97 @@
+"""
+Commands for running upload cycles in a long-lived process
+"""
+from datetime import datetime
+
+import click
+
+from mydata.commands.scan import scan
+from mydata.commands.upload import (
+    get_approved_upload_method,
+    upload_folders,
+    display_default_upload_summary,
+    display_verbose_upload_summary,
+)
+from mydata.tasks.daemon import UploadDaemon
+from mydata.tasks.uploads import get_upload_concurrency, TRANSFER_RETRY_POLICY
+from mydata.conf import settings
+from mydata.models.upload import UploadMethod
+from mydata.utils.metrics import start_metrics_exporter
+
+
+@click.command(name="daemon")
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    default=600.0,
+    help="Seconds between upload cycles.",
+)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes to upload folders in.",
+)
+def daemon_cmd(verbose, interval, processes):
+    """
+    Scan and upload files repeatedly, keeping settings and caches in memory.
+
+    Send SIGUSR1 to start a cycle immediately, SIGHUP to reload MyData.cfg
+    or SIGTERM to stop after the current cycle.
+    """
+    if verbose:
+        click.echo("\nUsing MyData configuration in: %s" % settings.config_path)
+
+    start_metrics_exporter()
+
+    if settings.miscellaneous.cache_datafile_lookups:
+        settings.initialize_verified_datafiles_cache()
+
+    upload_method = get_approved_upload_method()
+    if upload_method == UploadMethod.MULTIPART_POST:
+        click.echo("Uploads via staging haven't yet been approved.\n")
+
+    # The number of active upload threads is adjusted over the whole
+    # session, rather than starting again for each cycle:
+    concurrency = get_upload_concurrency()
+
+    def apply_reloaded_settings():
+        # The adaptive upload thread settings may have changed:
+        nonlocal concurrency
+        concurrency = get_upload_concurrency()
+        # The reloaded settings may use a different MyTardis server or
+        # upload_method, or staging may have been approved since startup:
+        nonlocal upload_method
+        try:
+            upload_method = get_approved_upload_method()
+        except SystemExit:
+            click.echo(
+                "Couldn't check the approved upload method, so the previous "
+                "one will be used.\n", err=True)
+
+    def run_cycle():
+        retry_counts = TRANSFER_RETRY_POLICY.stats.counts()
+        click.echo(
+            '%s: Scanning %s/ using the "%s" folder structure...\n'
+            % (datetime.now().isoformat(" ", "seconds"),
+               settings.data_directory.rstrip("/"), settings.folder_structure)
+        )
+        _, _, _, folders = scan()
+        lookups, uploads, datasets = upload_folders(
+            folders, False, upload_method, processes, concurrency)
+        if settings.miscellaneous.cache_datafile_lookups:
+            settings.save_verified_datafiles_cache()
+        display_default_upload_summary(
+            folders, datasets, lookups, uploads,
+            TRANSFER_RETRY_POLICY.stats.since(retry_counts))
+        if verbose >= 1:
+            display_verbose_upload_summary(lookups, uploads, verbose)
+        click.echo()
+
+    daemon = UploadDaemon(run_cycle, interval, apply_reloaded_settings)
+    daemon.install_signal_handlers()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
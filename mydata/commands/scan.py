@@ -5,6 +5,8 @@ import click
 
 from mydata.tasks.folders import scan_folders
 from mydata.conf import settings
+from mydata.utils.metrics import METRICS
+from mydata.utils.profiling import snapshot_memory
 
 
 def scan():
@@ -48,8 +50,10 @@ def scan():
 
     def found_dataset(folder):
         folders.append(folder)
+        METRICS.record_folder(folder)
 
     scan_folders(found_user, found_group, found_exp, found_dataset)
+    snapshot_memory("scan")
 
     return users, groups, exps, folders
 
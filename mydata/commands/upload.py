@@ -1,20 +1,35 @@
 """
 Commands for uploading data
 """
+import contextlib
 import sys
+import time
 import asyncio
 import click
 import requests
 
 from mydata.commands.scan import scan, display_scan_summary
-from mydata.tasks.uploads import upload_folder
+from mydata.tasks.uploads import (
+    upload_folder, get_upload_concurrency, TRANSFER_RETRY_POLICY)
+from mydata.tasks.plan import (
+    apply_plan,
+    load_plan,
+    plan_upload,
+    save_measured_throughput,
+)
+from mydata.tasks.processes import upload_folders_in_processes
 from mydata.conf import settings
 from mydata.models.lookup import LookupStatus
 from mydata.models.upload import UploadMethod, UploadStatus, UPLOAD_STATUS
+from mydata.utils.metrics import METRICS, start_metrics_exporter
+from mydata.utils.profiling import snapshot_memory
 
 
-def display_default_upload_summary(folders, datasets, lookups, uploads):
+def display_default_upload_summary(folders, datasets, lookups, uploads,
+                                   retry_stats=None):
     """Display default summary, displayed irrespective of verbosity
+
+    retry_stats defaults to the upload retry statistics for the whole run
     """
     num_files = sum([folder.num_files for folder in folders])
     num_files_uploaded = sum([folder.num_files_uploaded for folder in folders])
@@ -61,6 +76,8 @@ def display_default_upload_summary(folders, datasets, lookups, uploads):
         % (num_cache_hits, num_files)
     )
 
+    display_retry_summary(retry_stats or TRANSFER_RETRY_POLICY.stats)
+
     if lookups["unverified_no_dfos"]:
         click.echo("\nFile records on server without any DataFileObjects:")
         for lookup in lookups["unverified_no_dfos"]:
@@ -69,6 +86,32 @@ def display_default_upload_summary(folders, datasets, lookups, uploads):
             )
 
 
+def display_retry_summary(retry_stats):
+    """Display upload retry statistics, if any uploads were retried or
+    failed permanently
+    """
+    if retry_stats.retries or retry_stats.permanent_failures:
+        click.echo(
+            "%s upload retries were attempted after %s transient failures "
+            "(%.1f seconds spent backing off)."
+            % (
+                retry_stats.retries,
+                retry_stats.transient_failures,
+                retry_stats.backoff_seconds,
+            )
+        )
+    if retry_stats.permanent_failures:
+        click.echo(
+            "%s uploads failed permanently and were not retried."
+            % retry_stats.permanent_failures
+        )
+    if retry_stats.circuit_breaker_trips:
+        click.echo(
+            "Uploads were paused %s times after repeated failures "
+            "connecting to the staging host." % retry_stats.circuit_breaker_trips
+        )
+
+
 def display_verbose_upload_summary(lookups, uploads, verbosity):
     """Display extra information when running uploads with verbose option
     """
@@ -125,7 +168,11 @@ def get_approved_upload_method():
         click.echo(str(err), err=True)
         sys.exit(1)
 
-    if upload_via_staging_request.approved:
+    if upload_via_staging_request.approved and \
+            settings.advanced.upload_method == "LOCAL_COPY":
+        upload_method = UploadMethod.LOCAL_COPY
+        click.echo("Using local copy upload method.\n")
+    elif upload_via_staging_request.approved:
         upload_method = UploadMethod.SCP
         click.echo("Using SCP upload method.\n")
     else:
@@ -134,45 +181,30 @@ def get_approved_upload_method():
     return upload_method
 
 
-@click.command(name="upload")
-@click.option("-p", "--progress", is_flag=True)
-@click.option("-v", "--verbose", count=True)
-def upload_cmd(progress, verbose):
-    """
-    Upload files from structure described in MyData.cfg
-    """
-    # pylint: disable=too-many-locals, too-many-statements
-    data_directory = "%s/" % settings.data_directory.rstrip("/")
-
-    if progress and settings.advanced.upload_method != "SSH2":
-        click.echo("\nTo be able to see progress bar you have to change "
-                   "upload_method in config to SSH2")
-        return
+def get_planned_upload_method():
+    """Return the upload method to plan an upload with.
 
-    if verbose:
-        click.echo("\nUsing MyData configuration in: %s" % settings.config_path)
-
-    click.echo(
-        '\nScanning %s using the "%s" folder structure...\n'
-        % (data_directory, settings.folder_structure)
-    )
-
-    if settings.miscellaneous.cache_datafile_lookups:
-        settings.initialize_verified_datafiles_cache()
-
-    upload_method = get_approved_upload_method()
-
-    if upload_method == UploadMethod.MULTIPART_POST:
-        if not click.confirm(
-            "Uploads via staging haven't yet been approved. " "Do you want to continue?"
-        ):
-            sys.exit(1)
-        click.echo()
+    The approved upload method isn't checked, because checking it can
+    register this uploader, or request approval for uploads via staging,
+    in MyTardis, so uploads via staging are assumed to have been approved.
+    """
+    if settings.advanced.upload_method == "LOCAL_COPY":
+        return UploadMethod.LOCAL_COPY
+    return UploadMethod.SCP
 
-    users, groups, exps, folders = scan()
 
-    display_scan_summary(users, groups, exps, folders)
+def upload_folders(folders, progress, upload_method, processes=1,
+                   concurrency=None):
+    """Look up and upload the files in the scanned folders, returning
+    dictionaries of lookups and uploads by status, and of dataset IDs
+    by folder name
 
+    If the adaptive_upload_threads setting is enabled, the number of
+    active upload threads is adjusted by concurrency (from
+    get_upload_concurrency), or by a new instance shared by all of the
+    folders.  Each worker process has its own.
+    """
+    # pylint: disable=too-many-locals
     num_files = sum([folder.num_files for folder in folders])
 
     lookups = dict(
@@ -191,6 +223,7 @@ def upload_cmd(progress, verbose):
     datasets = dict()
 
     def lookup_callback(lookup):
+        METRICS.record_lookup(lookup)
         if lookup.dataset_id:
             datasets[lookup.folder_name] = lookup.dataset_id
         if lookup.status == LookupStatus.NOT_FOUND:
@@ -218,6 +251,7 @@ def upload_cmd(progress, verbose):
             )
 
     def upload_callback(upload):
+        METRICS.record_upload(upload)
         if upload.status == UploadStatus.COMPLETED:
             uploads["completed"].append(upload)
         if upload.status == UploadStatus.FAILED:
@@ -232,13 +266,140 @@ def upload_cmd(progress, verbose):
         #         flush=True,
         #     )
 
-    for folder in folders:
-        # pylint: disable=no-member
-        asyncio.run(
-            upload_folder(folder, lookup_callback, upload_callback,
-                          progress, upload_method)
+    if processes > 1 and len(folders) > 1:
+        upload_folders_in_processes(
+            folders, processes, lookup_callback, upload_callback,
+            progress, upload_method)
+    else:
+        if concurrency is None:
+            concurrency = get_upload_concurrency()
+        for folder in folders:
+            # pylint: disable=no-member
+            asyncio.run(
+                upload_folder(folder, lookup_callback, upload_callback,
+                              progress, upload_method, concurrency)
+            )
+    snapshot_memory("upload")
+
+    return lookups, uploads, datasets
+
+
+def scan_for_upload(verbose, plan=False):
+    """Scan the data directory, after checking which upload method has been
+    approved, returning the scanned folders and the upload method.
+
+    The user is asked whether to continue uploading if uploads via staging
+    haven't been approved.  If plan is True, the approved upload method
+    isn't checked (see get_planned_upload_method).
+    """
+    data_directory = "%s/" % settings.data_directory.rstrip("/")
+
+    if verbose:
+        click.echo("\nUsing MyData configuration in: %s" % settings.config_path)
+
+    click.echo(
+        '\nScanning %s using the "%s" folder structure...\n'
+        % (data_directory, settings.folder_structure)
+    )
+
+    if settings.miscellaneous.cache_datafile_lookups:
+        settings.initialize_verified_datafiles_cache()
+
+    if plan:
+        upload_method = get_planned_upload_method()
+    else:
+        upload_method = get_approved_upload_method()
+
+    if upload_method == UploadMethod.MULTIPART_POST:
+        if not click.confirm(
+            "Uploads via staging haven't yet been approved. " "Do you want to continue?"
+        ):
+            sys.exit(1)
+        click.echo()
+
+    users, groups, exps, folders = scan()
+
+    display_scan_summary(users, groups, exps, folders)
+
+    return folders, upload_method
+
+
+@click.command(name="upload")
+@click.option("-p", "--progress", is_flag=True)
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes to upload folders in.",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Write an upload plan, without uploading any files.",
+)
+@click.option(
+    "--plan-format",
+    type=click.Choice(["json", "csv"]),
+    default="json",
+    help="Format of the upload plan.",
+)
+@click.option(
+    "--plan-output",
+    type=click.File("w"),
+    default="-",
+    help="File to write the upload plan to.",
+)
+@click.option(
+    "--from-plan",
+    type=click.File("r"),
+    help="Upload only the files in a JSON upload plan.",
+)
+def upload_cmd(progress, verbose, processes, plan, plan_format, plan_output,
+               from_plan):
+    """
+    Upload files from structure described in MyData.cfg
+    """
+    # pylint: disable=too-many-arguments
+    if progress and settings.advanced.upload_method not in ("SSH2", "LOCAL_COPY"):
+        click.echo("\nTo be able to see progress bar you have to change "
+                   "upload_method in config to SSH2 or LOCAL_COPY")
+        return
+
+    if plan:
+        # Keep the plan separate from progress messages if it's
+        # written to standard output:
+        with contextlib.redirect_stdout(sys.stderr):
+            folders, upload_method = scan_for_upload(verbose, plan=True)
+            upload_plan = plan_upload(folders, upload_method)
+        if plan_format == "csv":
+            upload_plan.write_csv(plan_output)
+        else:
+            upload_plan.write_json(plan_output)
+        return
+
+    start_metrics_exporter()
+
+    folders, upload_method = scan_for_upload(verbose)
+
+    if from_plan:
+        try:
+            folders = apply_plan(folders, load_plan(from_plan))
+        except ValueError as err:
+            raise click.BadParameter(
+                str(err), param_hint="--from-plan") from err
+        click.echo(
+            "Uploading %s planned files from %s dataset folders.\n"
+            % (sum(folder.num_files for folder in folders), len(folders))
         )
 
+    start_time = time.time()
+    lookups, uploads, datasets = upload_folders(
+        folders, progress, upload_method, processes)
+    save_measured_throughput(
+        sum(upload.file_size for upload in uploads["completed"]),
+        time.time() - start_time)
+
     if settings.miscellaneous.cache_datafile_lookups:
         settings.save_verified_datafiles_cache()
 
@@ -0,0 +1,151 @@
+"""
+Commands for watching the data directory and uploading new files
+"""
+import sys
+import asyncio
+import click
+
+from mydata.commands.scan import scan, display_scan_summary
+from mydata.commands.upload import get_approved_upload_method
+from mydata.tasks.uploads import upload_folder, get_upload_concurrency
+from mydata.tasks.watch import watch_data_directory, get_quiet_period
+from mydata.utils.fswatch import get_watcher
+from mydata.conf import settings
+from mydata.models.lookup import LookupStatus
+from mydata.models.upload import UploadMethod, UploadStatus
+from mydata.utils.metrics import METRICS, start_metrics_exporter
+
+
+@click.command(name="watch")
+@click.option("-p", "--progress", is_flag=True)
+@click.option("-v", "--verbose", count=True)
+@click.option(
+    "--initial-upload/--no-initial-upload",
+    default=True,
+    help="Upload any files not already uploaded before watching for new files.",
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    help="Poll the data directory for changes, instead of using inotify.",
+)
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=1),
+    default=10.0,
+    help="Seconds between polls of the data directory.",
+)
+def watch_cmd(progress, verbose, initial_upload, poll, poll_interval):
+    """
+    Watch the data directory, uploading new files as they appear
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    data_directory = "%s/" % settings.data_directory.rstrip("/")
+
+    if progress and settings.advanced.upload_method != "SSH2":
+        click.echo("\nTo be able to see progress bar you have to change "
+                   "upload_method in config to SSH2")
+        return
+
+    if verbose:
+        click.echo("\nUsing MyData configuration in: %s" % settings.config_path)
+
+    start_metrics_exporter()
+
+    click.echo(
+        '\nScanning %s using the "%s" folder structure...\n'
+        % (data_directory, settings.folder_structure)
+    )
+
+    if settings.miscellaneous.cache_datafile_lookups:
+        settings.initialize_verified_datafiles_cache()
+
+    upload_method = get_approved_upload_method()
+
+    if upload_method == UploadMethod.MULTIPART_POST:
+        if not click.confirm(
+            "Uploads via staging haven't yet been approved. " "Do you want to continue?"
+        ):
+            sys.exit(1)
+        click.echo()
+
+    # Start watching before scanning, so that files created during the
+    # scan (or the initial upload) are uploaded once watching begins:
+    watcher = get_watcher(settings.general.data_directory, poll, poll_interval)
+    try:
+        uploads = watch_and_upload(
+            watcher, progress, verbose, initial_upload, upload_method)
+    finally:
+        watcher.close()
+
+    click.echo(
+        "\n%s files were uploaded, and %s files encountered upload errors."
+        % (uploads["completed"], uploads["failed"])
+    )
+
+
+def watch_and_upload(watcher, progress, verbose, initial_upload,
+                     upload_method):
+    """
+    Scan the data directory, then upload new files found by watcher,
+    returning counts of completed and failed uploads
+    """
+    users, groups, exps, folders = scan()
+
+    display_scan_summary(users, groups, exps, folders)
+
+    # Only counts are kept, because watching can continue indefinitely:
+    uploads = dict(completed=0, failed=0)
+
+    # The number of active upload threads is adjusted over the whole
+    # session, rather than starting again for each folder or batch:
+    concurrency = get_upload_concurrency()
+
+    def lookup_callback(lookup):
+        METRICS.record_lookup(lookup)
+        if lookup.status == LookupStatus.FAILED and verbose:
+            click.echo("%s [%s]" % (lookup.filename, lookup.message))
+
+    def upload_callback(upload):
+        METRICS.record_upload(upload)
+        if upload.status == UploadStatus.COMPLETED:
+            uploads["completed"] += 1
+        if upload.status == UploadStatus.FAILED:
+            uploads["failed"] += 1
+            if verbose:
+                click.echo("%s [%s]" % (upload.filename, upload.message))
+
+    def batch_callback(folder):
+        click.echo(
+            "%s: %s of %s new files uploaded."
+            % (folder.get_rel_path(), folder.num_files_uploaded, folder.num_files)
+        )
+
+    if initial_upload:
+        for folder in folders:
+            # pylint: disable=no-member
+            asyncio.run(
+                upload_folder(folder, lookup_callback, upload_callback,
+                              progress, upload_method, concurrency)
+            )
+        if settings.miscellaneous.cache_datafile_lookups:
+            settings.save_verified_datafiles_cache()
+        click.echo(
+            "%s files were uploaded before watching for new files."
+            % uploads["completed"]
+        )
+
+    click.echo(
+        "\nWatching %s/ for new files, which will be uploaded after %d seconds "
+        "without modification.  Press Ctrl-C to stop.\n"
+        % (settings.data_directory.rstrip("/"), get_quiet_period())
+    )
+    try:
+        watch_data_directory(
+            folders, lookup_callback, upload_callback, batch_callback,
+            progress, upload_method, watcher=watcher,
+            concurrency=concurrency)
+    except KeyboardInterrupt:
+        pass
+
+    return uploads
@@ -4,12 +4,36 @@ The global Settings instance.
 If the MYDATA_CONFIG_PATH environment variable is not set,
 MyData will determine an appropriate location for settings
 using the Python appdirs library.
+
+The settings are loaded from MyData.cfg when mydata.conf.settings
+is first accessed (e.g. by "from mydata.conf import settings"),
+rather than when this module is imported, so that commands which
+don't need settings, like "mydata version", start quickly.
 """
-# pylint: disable=invalid-name
+# pylint: disable=invalid-name,import-outside-toplevel
 import os
+import threading
+
+_lock = threading.RLock()
+
+# Declared, but not assigned, so that accessing it calls __getattr__:
+settings: "mydata.models.settings.Settings"
+
 
-from mydata.models.settings import Settings
-from mydata.models.settings.serialize import load_settings
+def __getattr__(name):
+    """
+    Construct the settings singleton on first access
+    """
+    if name != "settings":
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    with _lock:
+        if "settings" not in globals():
+            from mydata.models.settings import Settings
+            from mydata.models.settings.serialize import load_settings
 
-settings = Settings(config_path=os.environ.get("MYDATA_CONFIG_PATH"))
-load_settings()
+            # load_settings imports the settings from this module,
+            # so they must be assigned before they are loaded:
+            globals()["settings"] = Settings(
+                config_path=os.environ.get("MYDATA_CONFIG_PATH"))
+            load_settings()
+    return globals()["settings"]
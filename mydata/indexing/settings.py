@@ -1,15 +1,19 @@
 """
 mydata/indexing/settings.py
 """
+import hashlib
 import os
 import sys
 
+import appdirs
 import click
-import requests
 
 from dotenv import load_dotenv
 from requests.exceptions import HTTPError
 
+from mydata.constants import APPNAME, APPAUTHOR
+from mydata.utils.sessions import create_session
+
 load_dotenv()
 
 
@@ -22,6 +26,80 @@ def default_headers():
     }
 
 
+# Environment variables configuring the concurrency (and other performance
+# settings) of indexing, with their default values:
+PERFORMANCE_SETTINGS = dict(
+    # Threads listing directories:
+    MYTARDIS_INDEX_WALKERS=4,
+    # Threads calculating MD5 sums:
+    MYTARDIS_INDEX_HASHERS=4,
+    # Threads looking up and creating DataFile records:
+    MYTARDIS_INDEX_API_WORKERS=8,
+    # Maximum number of files being indexed at once:
+    MYTARDIS_INDEX_QUEUE_SIZE=1000,
+    # Number of DataFile records to request per page when listing
+    # a dataset's existing DataFile records:
+    MYTARDIS_INDEX_PAGE_SIZE=1000,
+)
+
+
+def get_performance_setting(name):
+    """
+    Return a performance setting from an environment variable, or its
+    default value, or None if the environment variable isn't a positive
+    integer
+    """
+    value = os.getenv(name)
+    if not value:
+        return PERFORMANCE_SETTINGS[name]
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+def get_checksum_cache_path():
+    """
+    Return the path of the persistent checksum cache from the
+    MYTARDIS_CHECKSUM_CACHE environment variable, defaulting to a file in
+    the user's cache directory, or None if MYTARDIS_CHECKSUM_CACHE is empty
+    """
+    path = os.environ.get("MYTARDIS_CHECKSUM_CACHE")
+    if path is None:
+        return os.path.join(
+            appdirs.user_cache_dir(APPNAME, APPAUTHOR), "checksums.sqlite3")
+    return path or None
+
+
+def get_checksum_algorithms():
+    """
+    Return the hashlib algorithms to calculate for each file: MD5 (which is
+    required by MyTardis), followed by any (faster) digests listed in the
+    MYTARDIS_INDEX_EXTRA_DIGESTS environment variable, e.g. "blake2b",
+    which are cached alongside MD5 for finding duplicate files
+    """
+    extra_digests = os.getenv("MYTARDIS_INDEX_EXTRA_DIGESTS") or ""
+    return ("md5",) + tuple(
+        algorithm.strip().lower() for algorithm in extra_digests.split(",")
+        if algorithm.strip() and algorithm.strip().lower() != "md5")
+
+
+def validate_performance_settings():
+    """
+    Check the optional performance and checksum settings, returning
+    a message for each invalid setting
+    """
+    msg = ""
+    for name in PERFORMANCE_SETTINGS:
+        if get_performance_setting(name) is None:
+            msg += "Set %s to a positive integer\n" % name
+    for algorithm in get_checksum_algorithms():
+        if algorithm not in hashlib.algorithms_available:
+            msg += "Unknown digest in MYTARDIS_INDEX_EXTRA_DIGESTS: %s\n" % algorithm
+    return msg
+
+
 def validate_settings():
     """
     Check settings required for indexing
@@ -42,6 +120,7 @@ def validate_settings():
         msg += "Set a MyTardis storage box path with MYTARDIS_STORAGE_BOX_PATH\n"
     if not os.getenv("MYTARDIS_SRC_PATH"):
         msg += "Set a data source path with MYTARDIS_SRC_PATH\n"
+    msg += validate_performance_settings()
 
     if msg:
         msg = "Missing parameter(s):\n" + msg.strip()
@@ -61,11 +140,12 @@ def check_credentials():
     """
     Check MyTardis credentials supplied in environment variables
     """
-    response = requests.get(
-        "%s/api/v1/user/?format=json&username=%s"
-        % (os.getenv("MYTARDIS_URL"), os.getenv("MYTARDIS_USERNAME")),
-        headers=default_headers(),
-    )
+    with create_session() as session:
+        response = session.get(
+            "%s/api/v1/user/?format=json&username=%s"
+            % (os.getenv("MYTARDIS_URL"), os.getenv("MYTARDIS_USERNAME")),
+            headers=default_headers(),
+        )
     response.raise_for_status()
     assert response.json()["meta"]["total_count"] == 1
 
@@ -2,21 +2,33 @@
 Custom logging for MyData allows logging to the Log view of MyData's
 main window, and to ~/.MyData_debug_log.txt.  Logs can be submitted
 via HTTP POST for analysis by developers / sys admins.
+
+The following environment variables configure logging:
+
+MYDATA_DEBUG_LOG_LEVEL: The log level, e.g. "DEBUG" (default: "INFO")
+MYDATA_DEBUG_LOG_PATH: The log file, or its directory
+    (default: ~/.MyData_debug_log.txt)
+MYDATA_DEBUG_LOG_MAX_BYTES: Rotate the log file when it reaches this size,
+    compressing the rotated log files with gzip (default: 0, never rotate)
+MYDATA_DEBUG_LOG_BACKUPS: The number of rotated log files to keep
+    (default: 5)
+MYDATA_LOG_BUFFER_RECORDS: The number of recent log messages kept in memory
+    for logger.get_value() (default: 10000)
 """
 # We want logger singleton to be lowercase, and we want logger.info,
 # logger.warning etc. methods to be lowercase:
 # pylint: disable=bare-except
+import atexit
+import collections
+import gzip
+import queue
 import threading
 import traceback
 import logging
+import logging.handlers
 import os
+import shutil
 import sys
-import inspect
-
-from io import StringIO
-
-import requests
-from requests.exceptions import RequestException
 
 
 class MyDataFormatter(logging.Formatter):
@@ -38,6 +50,62 @@ class MyDataFormatter(logging.Formatter):
         return super().format(record)
 
 
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the most recent capacity formatted log messages in memory,
+    so that long-running uploads don't accumulate logs without limit
+    """
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        """
+        Overridden from logging.Handler class
+        """
+        try:
+            self.records.append(self.format(record))
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def get_value(self):
+        """
+        Return the buffered log messages, one per line
+        """
+        with self.lock:
+            return "".join("%s\n" % message for message in self.records)
+
+
+def compress_rotated_log(source, dest):
+    """
+    Compress a rotated log file with gzip, for use as a
+    RotatingFileHandler's rotator
+    """
+    with open(source, "rb") as source_file:
+        with gzip.open(dest, "wb") as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+def get_log_file_handler(log_file_path):
+    """
+    Return a handler for writing to the log file, rotating it if the
+    MYDATA_DEBUG_LOG_MAX_BYTES environment variable is set
+    """
+    max_bytes = int(os.environ.get("MYDATA_DEBUG_LOG_MAX_BYTES", "0"))
+    if not max_bytes:
+        return logging.FileHandler(log_file_path)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file_path,
+        maxBytes=max_bytes,
+        backupCount=int(os.environ.get("MYDATA_DEBUG_LOG_BACKUPS", "5")),
+    )
+    file_handler.namer = lambda name: name + ".gz"
+    file_handler.rotator = compress_rotated_log
+    return file_handler
+
+
 class Logger:
     """
     Allows logger.debug(...), logger.info(...) etc. to write to MyData's
@@ -49,9 +117,12 @@ class Logger:
         self.name = name
         self.logger_object = logging.getLogger(self.name)
         self.format_string = ""
-        self.logger_output = None
-        self.stream_handler = None
+        self.buffer_handler = None
         self.file_handler = None
+        self.log_file_path = None
+        self.queue_handler = None
+        self.queue_listener = None
+        self.module_names = dict()
         self.level = logging.getLevelName(
             os.environ.get("MYDATA_DEBUG_LOG_LEVEL", "INFO").upper())
         self.configure_logger()
@@ -73,12 +144,12 @@ class Logger:
             "%(message)s"
         )
 
-        # Send all log messages to a string.
-        self.logger_output = StringIO()
-        self.stream_handler = logging.StreamHandler(stream=self.logger_output)
-        self.stream_handler.setLevel(self.level)
-        self.stream_handler.setFormatter(MyDataFormatter(self.format_string))
-        self.logger_object.addHandler(self.stream_handler)
+        # Keep recent log messages in memory.
+        self.buffer_handler = RingBufferHandler(
+            int(os.environ.get("MYDATA_LOG_BUFFER_RECORDS", "10000")))
+        self.buffer_handler.setLevel(self.level)
+        self.buffer_handler.setFormatter(MyDataFormatter(self.format_string))
+        self.logger_object.addHandler(self.buffer_handler)
 
         # Finally, send all log messages to a log file.
         if "MYDATA_DEBUG_LOG_PATH" in os.environ:
@@ -89,10 +160,53 @@ class Logger:
             log_file_path = os.path.join(
                 os.path.expanduser("~"), ".MyData_debug_log.txt"
             )
-        self.file_handler = logging.FileHandler(log_file_path)
+        self.log_file_path = log_file_path
+        self.file_handler = get_log_file_handler(log_file_path)
         self.file_handler.setLevel(self.level)
         self.file_handler.setFormatter(MyDataFormatter(self.format_string))
-        self.logger_object.addHandler(self.file_handler)
+
+        # The log file is written by a background thread, so that threads
+        # logging messages (e.g. upload workers) don't wait for disk I/O:
+        self.queue_handler = logging.handlers.QueueHandler(queue.Queue())
+        self.queue_handler.setLevel(self.level)
+        self.logger_object.addHandler(self.queue_handler)
+        self.queue_listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, self.file_handler)
+        self.queue_listener.start()
+        atexit.register(self.queue_listener.stop)
+
+    def flush(self):
+        """
+        Wait until queued log messages have been written to the log file
+        """
+        self.queue_handler.queue.join()
+        self.file_handler.flush()
+
+    def get_caller_extra(self, depth):
+        """
+        Return the module name, line number and function name of the
+        caller depth frames up the stack from this method's caller,
+        caching module names by filename.
+
+        sys._getframe is used rather than inspect.getouterframes, which
+        builds a FrameInfo object (including source code lines read from
+        disk) for every frame on the stack.
+        """
+        # pylint: disable=protected-access
+        frame = sys._getframe(depth + 1)
+        filename = frame.f_code.co_filename
+        module_name = self.module_names.get(filename)
+        if module_name is None:
+            if hasattr(sys, "frozen"):
+                module_name = os.path.basename(filename)
+            else:
+                module_name = os.path.relpath(filename, self.app_root_dir)
+            self.module_names[filename] = module_name
+        return {
+            "module_name": module_name,
+            "line_number": frame.f_lineno,
+            "function_name": frame.f_code.co_name,
+        }
 
     def debug(self, message):
         """
@@ -100,41 +214,13 @@ class Logger:
         """
         if self.level > logging.DEBUG:
             return
-        frame = inspect.currentframe()
-        outer_frames = inspect.getouterframes(frame)[1]
-        if hasattr(sys, "frozen"):
-            try:
-                module_name = os.path.basename(outer_frames[1])
-            except:
-                module_name = outer_frames[1]
-        else:
-            module_name = os.path.relpath(outer_frames[1], self.app_root_dir)
-        extra = {
-            "module_name": module_name,
-            "line_number": outer_frames[2],
-            "function_name": outer_frames[3],
-        }
-        self.logger_object.debug(message, extra=extra)
+        self.logger_object.debug(message, extra=self.get_caller_extra(1))
 
     def error(self, message):
         """
         Log a message with level logging.ERROR
         """
-        frame = inspect.currentframe()
-        outer_frames = inspect.getouterframes(frame)[1]
-        if hasattr(sys, "frozen"):
-            try:
-                module_name = os.path.basename(outer_frames[1])
-            except:
-                module_name = outer_frames[1]
-        else:
-            module_name = os.path.relpath(outer_frames[1], self.app_root_dir)
-        extra = {
-            "module_name": module_name,
-            "line_number": outer_frames[2],
-            "function_name": outer_frames[3],
-        }
-        self.logger_object.error(message, extra=extra)
+        self.logger_object.error(message, extra=self.get_caller_extra(1))
 
     def warning(self, message):
         """
@@ -142,21 +228,7 @@ class Logger:
         """
         if self.level > logging.WARNING:
             return
-        frame = inspect.currentframe()
-        outer_frames = inspect.getouterframes(frame)[1]
-        if hasattr(sys, "frozen"):
-            try:
-                module_name = os.path.basename(outer_frames[1])
-            except:
-                module_name = outer_frames[1]
-        else:
-            module_name = os.path.relpath(outer_frames[1], self.app_root_dir)
-        extra = {
-            "module_name": module_name,
-            "line_number": outer_frames[2],
-            "function_name": outer_frames[3],
-        }
-        self.logger_object.warning(message, extra=extra)
+        self.logger_object.warning(message, extra=self.get_caller_extra(1))
 
     def info(self, message):
         """
@@ -164,41 +236,13 @@ class Logger:
         """
         if self.level > logging.INFO:
             return
-        frame = inspect.currentframe()
-        outer_frames = inspect.getouterframes(frame)[1]
-        if hasattr(sys, "frozen"):
-            try:
-                module_name = os.path.basename(outer_frames[1])
-            except:
-                module_name = outer_frames[1]
-        else:
-            module_name = os.path.relpath(outer_frames[1], self.app_root_dir)
-        extra = {
-            "module_name": module_name,
-            "line_number": outer_frames[2],
-            "function_name": outer_frames[3],
-        }
-        self.logger_object.info(message, extra=extra)
+        self.logger_object.info(message, extra=self.get_caller_extra(1))
 
     def exception(self, message):
         """
         Log a message and traceback for an exception
         """
-        frame = inspect.currentframe()
-        outer_frames = inspect.getouterframes(frame)[1]
-        if hasattr(sys, "frozen"):
-            try:
-                module_name = os.path.basename(outer_frames[1])
-            except:
-                module_name = outer_frames[1]
-        else:
-            module_name = os.path.relpath(outer_frames[1], self.app_root_dir)
-        extra = {
-            "module_name": module_name,
-            "line_number": outer_frames[2],
-            "function_name": outer_frames[3],
-        }
-        self.logger_object.exception(message, extra=extra)
+        self.logger_object.exception(message, extra=self.get_caller_extra(1))
 
     def testrun(self, message):
         # pylint: disable=no-self-use
@@ -209,10 +253,9 @@ class Logger:
 
     def get_value(self):
         """
-        Return all logs sent to StringIO handler
+        Return the recent logs kept in memory
         """
-        self.stream_handler.flush()
-        return self.logger_output.getvalue()
+        return self.buffer_handler.get_value()
 
 
 logger = Logger("MyData")  # pylint: disable=invalid-name
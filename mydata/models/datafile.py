@@ -5,14 +5,17 @@ Model class for MyTardis API v1's DataFileResource.
 import io
 import json
 import urllib.parse
+from datetime import datetime
 
-import requests
 from requests_toolbelt.multipart import encoder
 
 from ..conf import settings
 from ..logs import logger
-from ..utils.exceptions import MultipleObjectsReturned
+from ..utils.exceptions import MultipleObjectsReturned, UserAborted
+from ..utils.instrumentation import INSTRUMENTATION
 from ..utils.retries import requests_retry_session
+from ..utils.sessions import API_SESSION_POOL
+from ..utils.throttle import BANDWIDTH_LIMITER
 from .replica import Replica
 
 
@@ -97,6 +100,7 @@ class DataFile:
         return DataFile(dataset=None, datafile_dict=datafile_dict)
 
     @staticmethod
+    @INSTRUMENTATION.timed("verify")
     def verify(datafile_id):
         """
         Verify a datafile via the MyTardis API.
@@ -117,6 +121,7 @@ class DataFile:
         return True
 
     @staticmethod
+    @INSTRUMENTATION.timed("create_datafile_for_staging_upload")
     def create_datafile_for_staging_upload(datafile_dict):
         """
         Create a DataFile record and return a temporary URL to upload
@@ -124,41 +129,91 @@ class DataFile:
         """
         url = "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url
         datafile_json = json.dumps(datafile_dict)
-        response = requests.post(
+        response = API_SESSION_POOL.post(
             headers=settings.default_headers, url=url, data=datafile_json.encode()
         )
         return response
 
     @staticmethod
-    def upload_datafile_with_post(datafile_path, datafile_dict, upload):
+    def upload_datafile_with_post(
+        datafile_path, datafile_dict, upload, progress_callback=None
+    ):
         """
         Upload a file to the MyTardis API via POST, creating a new
         DataFile record.
+
+        The multipart body is streamed from the file in blocks of
+        post_read_size bytes, over this thread's pooled session.
+        After each block, the upload's progress is updated and
+        progress_callback (if supplied) is called with the number
+        of bytes sent in that block.
+
+        :raises UserAborted: if the upload is canceled
         """
         url = "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url
         # pylint: disable=consider-using-with
         upload.buffered_reader = io.open(datafile_path, "rb")
-
-        encoded = encoder.MultipartEncoder(
-            fields={
-                "json_data": json.dumps(datafile_dict),
-                "attached_file": (
-                    upload.filename,
-                    upload.buffered_reader,
-                    "application/octet-stream",
-                ),
-            }
-        )
-        # Workaround for issue with httplib's hard-coded read size
-        # of 8192 bytes which can lead to slow uploads, see:
-        # http://toolbelt.readthedocs.io/en/latest/uploading-data.html
-        # https://github.com/requests/toolbelt/issues/75
-        multipart_encoder_read_method = encoded.read
-        encoded.read = lambda size: multipart_encoder_read_method(1024 * 1024)
-
-        multipart = encoder.MultipartEncoderMonitor(encoded)
-
-        headers = settings.default_headers
-        headers["Content-Type"] = multipart.content_type
-        response = requests.post(url, data=multipart, headers=headers)
+        upload.start_time = datetime.now()
+        try:
+            encoded = encoder.MultipartEncoder(
+                fields={
+                    "json_data": json.dumps(datafile_dict),
+                    "attached_file": (
+                        upload.filename,
+                        upload.buffered_reader,
+                        "application/octet-stream",
+                    ),
+                }
+            )
+            multipart = PostUploadMonitor(
+                encoded, upload, settings.miscellaneous.post_read_size,
+                progress_callback)
+
+            headers = dict(settings.default_headers)
+            headers["Content-Type"] = multipart.content_type
+            response = API_SESSION_POOL.post(
+                url, data=multipart, headers=headers
+            )
+        finally:
+            upload.buffered_reader.close()
         return response
+
+
+class PostUploadMonitor(encoder.MultipartEncoderMonitor):
+    """
+    Streams a multipart-encoded POST upload in blocks of read_size bytes,
+    limiting bandwidth and updating the upload's progress after each block
+
+    httplib's hard-coded read size of 8192 bytes can lead to slow uploads,
+    so the size requested by httplib is ignored, see:
+    http://toolbelt.readthedocs.io/en/latest/uploading-data.html
+    https://github.com/requests/toolbelt/issues/75
+    """
+
+    def __init__(self, multipart_encoder, upload, read_size,
+                 progress_callback=None):
+        super().__init__(multipart_encoder, self.update_progress)
+        self.upload = upload
+        self.read_size = read_size
+        self.progress_callback = progress_callback
+        self.file_size = upload.file_size
+        # Bytes of multipart headers and JSON data before the file's content:
+        self.overhead = self.len - self.file_size
+
+    def read(self, size=-1):
+        if self.upload.canceled:
+            raise UserAborted("Upload of %s was canceled." % self.upload.filename)
+        block = super().read(BANDWIDTH_LIMITER.chunk_size(self.read_size))
+        BANDWIDTH_LIMITER.consume(len(block))
+        return block
+
+    def update_progress(self, monitor):
+        """
+        Update the upload's progress after reading a block
+        """
+        bytes_uploaded = max(
+            0, min(self.file_size, monitor.bytes_read - self.overhead))
+        if self.progress_callback:
+            self.progress_callback(bytes_uploaded - self.upload.bytes_uploaded)
+        self.upload.bytes_uploaded = bytes_uploaded
+        self.upload.set_latest_time(datetime.now())
@@ -1,10 +1,8 @@
 """
 Model class for MyTardis API v1's FacilityResource.
 """
-
-import requests
-
 from ..conf import settings
+from ..utils.sessions import API_SESSION_POOL
 from .group import Group
 
 
@@ -42,7 +40,7 @@ class Facility:
         """
         facilities = []
         url = "%s/api/v1/facility/?format=json" % settings.general.mytardis_url
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = API_SESSION_POOL.get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         facilities_dict = response.json()
         for facility_dict in facilities_dict["objects"]:
@@ -12,8 +12,10 @@ from fnmatch import fnmatch
 
 from ..conf import settings
 from ..logs import logger
+from ..utils.instrumentation import INSTRUMENTATION
 
 from .localfile import LocalFile
+from .settings.snapshot import SettingsSnapshot
 
 
 # pylint: disable=too-many-instance-attributes
@@ -33,7 +35,13 @@ class Folder:
         owner,
         group=None,
         is_exp_files_folder=False,
+        settings_snapshot=None,
     ):
+        # pylint: disable=too-many-arguments
+
+        # The settings used for scanning and uploading this folder's files,
+        # which scan_folders takes once and passes to each folder:
+        self.settings_snapshot = settings_snapshot or SettingsSnapshot(settings)
 
         self.data_view_fields = dict(
             name=name,
@@ -62,45 +70,16 @@ class Folder:
         self.num_files_uploaded = 0
         self.num_cache_hits = 0
 
+    @INSTRUMENTATION.timed("populate_local_files")
     def populate_local_files(self):
         """
         Populate data file paths within folder object
         """
-        if self.is_exp_files_folder:
-            absolute_folder_path = self.location
-        else:
-            absolute_folder_path = os.path.join(self.location, self.name)
+        absolute_folder_path = self.get_absolute_path()
 
         for dirname, _, files in os.walk(absolute_folder_path):
             for filename in sorted(files):
-                if (
-                    settings.filters.use_includes_file
-                    and not settings.filters.use_excludes_file
-                ):
-                    if not Folder.matches_includes(filename):
-                        logger.debug("Ignoring %s, not matching includes." % filename)
-                        continue
-                elif (
-                    not settings.filters.use_includes_file
-                    and settings.filters.use_excludes_file
-                ):
-                    if Folder.matches_excludes(filename):
-                        logger.debug("Ignoring %s, matching excludes." % filename)
-                        continue
-                elif (
-                    settings.filters.use_includes_file
-                    and settings.filters.use_excludes_file
-                ):
-                    if Folder.matches_excludes(
-                        filename
-                    ) and not Folder.matches_includes(filename):
-                        logger.debug(
-                            "Ignoring %s, matching excludes "
-                            "and not matching includes." % filename
-                        )
-                        continue
-                if settings.filters.ignore_symlinks and \
-                        os.path.islink(os.path.join(dirname, filename)):
+                if self.is_ignored(dirname, filename):
                     continue
                 self.local_files.append(
                     LocalFile(
@@ -114,6 +93,70 @@ class Folder:
         self.convert_subdirs_to_mytardis_format()
         self.data_view_fields["status"] = "0 of %d files uploaded" % self.num_files
 
+    def set_local_files(self, filepaths):
+        """
+        Replace this folder's data file paths with filepaths, e.g. with
+        the new files found by "mydata watch", skipping any files which
+        no longer exist or which would be ignored by populate_local_files
+        """
+        absolute_folder_path = self.get_absolute_path()
+
+        self.local_files = []
+        for filepath in sorted(filepaths):
+            dirname, filename = os.path.split(filepath)
+            if self.is_exp_files_folder and dirname != absolute_folder_path:
+                continue
+            if not os.path.isfile(filepath) or self.is_ignored(
+                    dirname, filename):
+                continue
+            self.local_files.append(
+                LocalFile(
+                    filepath=filepath,
+                    directory=os.path.relpath(dirname, absolute_folder_path),
+                    uploaded=False,
+                )
+            )
+        self.convert_subdirs_to_mytardis_format()
+        self.num_files_uploaded = 0
+        self.num_cache_hits = 0
+        self.data_view_fields["status"] = "0 of %d files uploaded" % self.num_files
+
+    def get_absolute_path(self):
+        """
+        Return the absolute path of the directory containing this
+        folder's data files
+        """
+        if self.is_exp_files_folder:
+            return self.location
+        return os.path.join(self.location, self.name)
+
+    def is_ignored(self, dirname, filename):
+        """
+        Return True if the file should be ignored, according to the
+        includes / excludes files and the ignore symlinks setting
+        """
+        snapshot = self.settings_snapshot
+        if snapshot.use_includes_file and not snapshot.use_excludes_file:
+            if not snapshot.matches_includes(filename):
+                logger.debug("Ignoring %s, not matching includes." % filename)
+                return True
+        elif not snapshot.use_includes_file and snapshot.use_excludes_file:
+            if snapshot.matches_excludes(filename):
+                logger.debug("Ignoring %s, matching excludes." % filename)
+                return True
+        elif snapshot.use_includes_file and snapshot.use_excludes_file:
+            if snapshot.matches_excludes(
+                filename
+            ) and not snapshot.matches_includes(filename):
+                logger.debug(
+                    "Ignoring %s, matching excludes "
+                    "and not matching includes." % filename
+                )
+                return True
+        return bool(
+            snapshot.ignore_symlinks
+            and os.path.islink(os.path.join(dirname, filename)))
+
     def convert_subdirs_to_mytardis_format(self):
         """
         When we write a subdirectory path into the directory field of a
@@ -155,7 +198,8 @@ class Folder:
         which is os.path.join(self.location, self.name)
         """
         return os.path.relpath(
-            self.get_datafile_path(datafile_index), settings.general.data_directory
+            self.get_datafile_path(datafile_index),
+            self.settings_snapshot.data_directory,
         )
 
     def get_datafile_directory(self, datafile_index):
@@ -294,10 +338,10 @@ class Folder:
         modified too recently and might require further local modifications
         before its upload.
         """
-        if settings.filters.ignore_new_files:
+        if self.settings_snapshot.ignore_new_files:
             absolute_file_path = self.get_datafile_path(datafile_index)
             too_new = (time.time() - os.path.getmtime(absolute_file_path)) <= (
-                settings.filters.ignore_new_files_minutes * 60
+                self.settings_snapshot.ignore_new_files_minutes * 60
             )
         else:
             too_new = False
@@ -4,11 +4,10 @@ Model class for MyTardis API v1's InstrumentResource.
 import json
 import urllib.parse
 
-import requests
-
 from ..conf import settings
 from ..logs import logger
 from ..utils.exceptions import DuplicateKey
+from ..utils.sessions import API_SESSION_POOL
 from .facility import Facility
 
 
@@ -41,7 +40,7 @@ class Instrument:
         instrument_dict = {"facility": facility.resource_uri, "name": name}
         data = json.dumps(instrument_dict)
         headers = settings.default_headers
-        response = requests.post(headers=headers, url=url, data=data.encode())
+        response = API_SESSION_POOL.post(headers=headers, url=url, data=data.encode())
         response.raise_for_status()
         instrument_dict = response.json()
         return Instrument(name=name, instrument_dict=instrument_dict)
@@ -58,7 +57,7 @@ class Instrument:
             facility.facility_id,
             urllib.parse.quote(name.encode("utf-8")),
         )
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = API_SESSION_POOL.get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         instruments_dict = response.json()
         num_instruments_found = instruments_dict["meta"]["total_count"]
@@ -111,6 +110,6 @@ class Instrument:
         uploader_dict = {"name": name}
         data = json.dumps(uploader_dict)
         headers = settings.default_headers
-        response = requests.put(headers=headers, url=url, data=data.encode())
+        response = API_SESSION_POOL.put(headers=headers, url=url, data=data.encode())
         response.raise_for_status()
         logger.info("Renaming instrument succeeded.")
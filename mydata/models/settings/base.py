@@ -32,3 +32,44 @@ class BaseSettings:
         """
         for field in self.fields:
             self.set_default_for_field(field)
+
+
+class ConfigField:
+    """
+    Property for a field saved in MyData.cfg, whose value is kept in the
+    settings model's mydata_config dictionary.  Integer and float values
+    are converted when they are read, because they can be set from
+    strings, e.g. by settings["upload_chunk_size"] = "1024".
+    """
+
+    def __init__(self, name, field_type):
+        self.name = name
+        self.field_type = field_type
+        self.__doc__ = "The %s setting (%s)" % (name, field_type.__name__)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.mydata_config[self.name]
+        if self.field_type in (int, float):
+            return self.field_type(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.mydata_config[self.name] = value
+
+
+def config_fields(fields):
+    """
+    Class decorator adding a ConfigField to a settings model class for
+    each field in fields, a dictionary of name -> (type, default value),
+    unless the class already defines the field as a property
+    """
+
+    def add_fields(settings_class):
+        for name, (field_type, _) in fields.items():
+            if name not in vars(settings_class):
+                setattr(settings_class, name, ConfigField(name, field_type))
+        return settings_class
+
+    return add_fields
@@ -0,0 +1,147 @@
+"""
+Cache settings validation results, so that repeated runs with unchanged
+settings don't repeat the MyTardis URL, credentials, facility and instrument
+checks.  Checks of the data directory's structure aren't cached, because
+it can change without any change to the settings.
+
+Each result is keyed by a SHA-256 hash of the settings it depends on, so
+changing any of those settings invalidates it, and it expires after a TTL.
+Only successful checks are cached.
+
+The following environment variables configure the cache:
+
+MYDATA_VALIDATION_CACHE: The cache file, or an empty string to disable
+    caching (default: validation-cache.json in the user's cache directory)
+MYDATA_VALIDATION_CACHE_TTL: The number of seconds for which results are
+    reused (default: 3600)
+"""
+# pylint: disable=import-outside-toplevel
+import hashlib
+import json
+import os
+import threading
+import time
+
+import appdirs
+
+from ...constants import APPNAME, APPAUTHOR
+from ...logs import logger
+
+DEFAULT_TTL = 3600
+
+# The settings which each cached result depends on:
+CACHED_CHECKS = dict(
+    mytardis=[
+        "mytardis_url",
+        "username",
+        "api_key",
+        "facility_name",
+        "instrument_name",
+    ],
+)
+
+
+def get_cache_path():
+    """
+    Return the path of the validation cache from the MYDATA_VALIDATION_CACHE
+    environment variable, defaulting to a file in the user's cache directory,
+    or None if MYDATA_VALIDATION_CACHE is empty
+    """
+    path = os.environ.get("MYDATA_VALIDATION_CACHE")
+    if path is None:
+        return os.path.join(
+            appdirs.user_cache_dir(APPNAME, APPAUTHOR), "validation-cache.json")
+    return path or None
+
+
+def get_ttl():
+    """
+    Return the number of seconds for which cached results are reused
+    """
+    try:
+        return float(os.environ.get("MYDATA_VALIDATION_CACHE_TTL", DEFAULT_TTL))
+    except ValueError:
+        logger.warning(
+            "Invalid MYDATA_VALIDATION_CACHE_TTL: %s"
+            % os.environ["MYDATA_VALIDATION_CACHE_TTL"])
+        return DEFAULT_TTL
+
+
+class ValidationCache:
+    """
+    Validation results stored in a JSON file, keyed by hashes of settings
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(check):
+        """
+        Return a hash of the check's name and the settings it depends on,
+        so that credentials aren't stored in the cache
+        """
+        from ...conf import settings
+
+        values = [check] + [settings[field] for field in CACHED_CHECKS[check]]
+        return hashlib.sha256(
+            json.dumps(values, default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def load(path):
+        """
+        Return the cached results, or an empty dictionary if the
+        cache file doesn't exist or can't be read
+        """
+        try:
+            with open(path, encoding="utf-8") as cache_file:
+                results = json.load(cache_file)
+            return results if isinstance(results, dict) else dict()
+        except (OSError, ValueError):
+            return dict()
+
+    def get(self, check):
+        """
+        Return the cached result of a check for the current settings,
+        or None if it hasn't been cached, or has expired
+        """
+        path = get_cache_path()
+        ttl = get_ttl()
+        if not path or ttl <= 0:
+            return None
+        with self.lock:
+            entry = self.load(path).get(self.get_key(check))
+        if not isinstance(entry, dict) or \
+                time.time() - entry.get("time", 0) >= ttl:
+            return None
+        logger.debug("Using cached settings validation result for %s" % check)
+        return entry.get("result")
+
+    def put(self, check, result):
+        """
+        Cache the result of a check for the current settings,
+        discarding any expired results
+        """
+        path = get_cache_path()
+        ttl = get_ttl()
+        if not path or ttl <= 0:
+            return
+        now = time.time()
+        with self.lock:
+            results = dict(
+                (key, entry) for key, entry in self.load(path).items()
+                if isinstance(entry, dict) and now - entry.get("time", 0) < ttl)
+            results[self.get_key(check)] = dict(time=now, result=result)
+            temp_path = "%s.%s.tmp" % (path, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                with open(temp_path, "w", encoding="utf-8") as cache_file:
+                    json.dump(results, cache_file)
+                os.replace(temp_path, path)
+            except OSError as err:
+                logger.warning(
+                    "Couldn't save settings validation cache to %s: %s"
+                    % (path, err))
+
+
+VALIDATION_CACHE = ValidationCache()
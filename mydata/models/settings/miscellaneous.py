@@ -9,15 +9,75 @@ the main settings model module (model.py) to prevent cyclic imports.
 """
 import sys
 
-from .base import BaseSettings
-
-
+from .base import BaseSettings, config_fields
+
+# The type and default value of each field saved in MyData.cfg.  This is
+# used to read the fields from MyData.cfg, to save them, and to declare
+# them in settings snapshots.
+FIELDS = dict(
+    # This MyData instance's unique ID:
+    uuid=(str, None),
+    # Delay (in seconds) after a successful upload before verification
+    # is requested:
+    verification_delay=(float, 3.0),
+    # SSH cipher for SCP uploads:
+    cipher=(str, "aes128-ctr"),
+    # Cache local paths and dataset IDs of datafiles which have been found
+    # to be verified on MyTardis:
+    cache_datafile_lookups=(bool, True),
+    # Timeout (in seconds) for HTTP responses and SSH connections:
+    connection_timeout=(float, 10.0),
+    # Resume partial uploads found on the staging server (SSH2 only),
+    # after comparing this many bytes at the end of the partial upload:
+    resume_uploads=(bool, True),
+    resume_verify_bytes=(int, 1024 * 1024),
+    # Exponential backoff (in seconds) between upload retries:
+    retry_backoff_base=(float, 1.0),
+    retry_backoff_max=(float, 60.0),
+    # Consecutive transient failures after which uploads to a staging
+    # host pause (0 to disable), and for how long (in seconds):
+    circuit_breaker_threshold=(int, 5),
+    circuit_breaker_timeout=(float, 60.0),
+    # Files at least this size (in bytes, 0 to disable) are uploaded in
+    # this many ranges in parallel by the SSH2 upload method:
+    parallel_transfer_threshold=(int, 1024 * 1024 * 1024),
+    parallel_transfer_streams=(int, 4),
+    # Adjust the number of active upload threads between this minimum and
+    # max_upload_threads, to maximize throughput:
+    adaptive_upload_threads=(bool, False),
+    min_upload_threads=(int, 1),
+    # Upload bandwidth limit (in MB/s, 0 for unlimited), and time-of-day
+    # limits, e.g. "08:00-18:00=20, 18:00-08:00=0":
+    bandwidth_limit=(float, 0.0),
+    bandwidth_schedule=(str, ""),
+    # Size (in bytes) of the chunks sent by the SSH2 and LOCAL_COPY upload
+    # methods, and of the blocks read by the HTTP POST upload method:
+    upload_chunk_size=(int, 32 * 1024 * 1024),
+    post_read_size=(int, 1024 * 1024),
+    # Numbers of threads for looking up files and for calculating MD5
+    # checksums:
+    max_lookup_threads=(int, 8),
+    max_hash_threads=(int, 2),
+    # Local mount point of the staging area, octal file mode ("" to leave
+    # it unchanged), fsync policy ("none", "file" or "directory") and
+    # checksum verification for the LOCAL_COPY upload method:
+    local_copy_mount=(str, ""),
+    local_copy_file_mode=(str, "660"),
+    local_copy_fsync=(str, "file"),
+    local_copy_verify=(bool, False),
+)
+
+
+@config_fields(FIELDS)
 class MiscellaneousSettings(BaseSettings):
     """
     Model class for settings not displayed in the settings dialog of the
     MyData GUI but accessible in MyData.cfg.  The MyData CLI retains the
     MyData GUI code's separation of settings in General / Advanced / Miscellaneous etc.
     even though it doesn't have a Settings Dialog.
+
+    Each field in FIELDS can be read and set as a property, e.g.
+    settings.miscellaneous.upload_chunk_size.
     """
 
     def __init__(self):
@@ -26,53 +86,10 @@ class MiscellaneousSettings(BaseSettings):
         # Saved in MyData.cfg:
         self.mydata_config = dict()
 
-        self.fields = [
-            "uuid",
-            "verification_delay",
-            "cipher",
-            "cache_datafile_lookups",
-            "connection_timeout",
-        ]
+        self.fields = list(FIELDS)
 
         self.default = dict(
-            uuid=None,
-            verification_delay=3.0,
-            cipher="aes128-ctr",
-            cache_datafile_lookups=True,
-            connection_timeout=10.0,
-        )
-
-    @property
-    def uuid(self):
-        """
-        Get this MyData instance's unique ID
-        """
-        return self.mydata_config["uuid"]
-
-    @uuid.setter
-    def uuid(self, uuid):
-        """
-        Set this MyData instance's unique ID
-        """
-        self.mydata_config["uuid"] = uuid
-
-    @property
-    def verification_delay(self):
-        """
-        Upon a successful upload, MyData will request verification
-        after a short delay, defaulting to 3 seconds:
-
-        :return: the delay in seconds
-        :rtype: float
-        """
-        return self.mydata_config["verification_delay"]
-
-    @property
-    def cipher(self):
-        """
-        SSH Cipher for SCP uploads.
-        """
-        return self.mydata_config["cipher"]
+            (field, default) for field, (_, default) in FIELDS.items())
 
     @property
     def cipher_options(self):
@@ -81,42 +98,6 @@ class MiscellaneousSettings(BaseSettings):
         """
         return ["-c", self.mydata_config["cipher"]]
 
-    @property
-    def cache_datafile_lookups(self):
-        """
-        Returns True if MyData will cache local paths and dataset IDs of
-        datafiles which have been previously found to be verified on MyTardis.
-        """
-        return self.mydata_config["cache_datafile_lookups"]
-
-    @cache_datafile_lookups.setter
-    def cache_datafile_lookups(self, cache_datafile_lookups):
-        """
-        Set this to True if MyData should cache local paths and dataset IDs of
-        datafiles which have been previously found to be verified on MyTardis.
-        """
-        self.mydata_config["cache_datafile_lookups"] = cache_datafile_lookups
-
-    @property
-    def connection_timeout(self):
-        """
-        Timeout (in seconds) used for HTTP responses and SSH connections
-
-        :return: the timeout in seconds
-        :rtype: float
-        """
-        return self.mydata_config["connection_timeout"]
-
-    @connection_timeout.setter
-    def connection_timeout(self, connection_timeout):
-        """
-        Timeout (in seconds) used for HTTP responses and SSH connections
-
-        :param connection_timeout: the timeout in seconds
-        :type connection_timeout: float
-        """
-        self.mydata_config["connection_timeout"] = connection_timeout
-
     def set_default_for_field(self, field):
         """
         Set default value for one field.
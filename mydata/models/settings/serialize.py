@@ -17,6 +17,7 @@ import os
 from configparser import ConfigParser
 
 from ...logs import logger
+from .miscellaneous import FIELDS as MISCELLANEOUS_FIELDS
 
 
 def load_settings(config_path=None):
@@ -181,33 +182,21 @@ def load_miscellaneous_settings(config_parser):
     from ...conf import settings
 
     config_file_section = "MyData"
-    fields = [
-        "uuid",
-        "cipher",
-        "verification_delay",
-        "cache_datafile_lookups",
-        "connection_timeout",
-    ]
-    for field in fields:
-        if config_parser.has_option(config_file_section, field):
-            settings[field] = config_parser.get(config_file_section, field)
-    boolean_fields = ["cache_datafile_lookups"]
-    for field in boolean_fields:
-        if config_parser.has_option(config_file_section, field):
-            settings[field] = config_parser.getboolean(config_file_section, field)
-    float_fields = [
-        "verification_delay",
-        "connection_timeout",
-    ]
-    for field in float_fields:
+    getters = {
+        bool: config_parser.getboolean,
+        int: config_parser.getint,
+        float: config_parser.getfloat,
+        str: config_parser.get,
+    }
+    for field, (field_type, default) in MISCELLANEOUS_FIELDS.items():
         if config_parser.has_option(config_file_section, field):
             try:
-                settings[field] = config_parser.getfloat(config_file_section, field)
+                settings[field] = getters[field_type](config_file_section, field)
             except ValueError:
                 logger.warning(
                     "Couldn't read value for %s, using default instead." % field
                 )
-                settings[field] = settings.miscellaneous.default[field]
+                settings[field] = default
 
 
 def save_settings_to_disk(config_path=None):
@@ -254,13 +243,8 @@ def save_settings_to_disk(config_path=None):
             "max_upload_retries",
             "upload_method",
             "validate_folder_structure",
-            "cipher",
-            "uuid",
-            "verification_delay",
-            "cache_datafile_lookups",
             "upload_invalid_user_or_group_folders",
-            "connection_timeout",
-        ]
+        ] + list(MISCELLANEOUS_FIELDS)
         settings_list = []
         for field in fields:
             value = settings[field]
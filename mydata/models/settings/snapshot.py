@@ -0,0 +1,181 @@
+"""
+A frozen snapshot of the settings, taken once per scan, for the per-file
+loops of scanning, lookups and uploads, and for worker processes.
+
+Reading the global settings goes through Settings.__getattr__ or
+__getitem__, which search each model's fields, and through property
+chains like settings.filters.use_includes_file.  A snapshot's fields are
+plain slots, its includes and excludes files are read and compiled into
+regular expressions once, and it can be pickled, unlike the global
+settings, so it can be passed to worker processes.
+"""
+import os
+import re
+from fnmatch import translate
+
+from .advanced import AdvancedSettings
+from .filters import FiltersSettings
+from .general import GeneralSettings
+from .miscellaneous import MiscellaneousSettings, FIELDS as MISCELLANEOUS_FIELDS
+
+# The fields saved in MyData.cfg:
+FIELDS = tuple(
+    field
+    for model_class in (
+        GeneralSettings, FiltersSettings, AdvancedSettings, MiscellaneousSettings)
+    for field in model_class().fields)
+
+# Values derived from the fields when the snapshot is taken:
+DERIVED_FIELDS = (
+    "config_path",
+    "ignore_old_datasets_interval_seconds",
+    "ignore_new_datasets_interval_seconds",
+    "includes_pattern",
+    "excludes_pattern",
+)
+
+
+def compile_patterns(includes_or_excludes_file):
+    """
+    Compile the globs in an includes or excludes file into one regular
+    expression, or return None if the file contains no globs.
+
+    Like fnmatch.fnmatch, the globs (and the filenames they are matched
+    against) are normalized with os.path.normcase, so they are case
+    insensitive on Windows.
+    """
+    globs = []
+    with open(includes_or_excludes_file, "r", encoding="utf-8") as patterns_file:
+        for glob in patterns_file.readlines():
+            glob = glob.strip()
+            # Lines starting with '#' or ';' will be ignored:
+            if glob and not glob.startswith((";", "#")):
+                globs.append(translate(os.path.normcase(glob)))
+    if not globs:
+        return None
+    return re.compile("|".join(globs))
+
+
+def matches_pattern(pattern, filename):
+    """
+    Return True if filename matches a pattern from compile_patterns
+    """
+    return pattern is not None and \
+        pattern.match(os.path.normcase(filename)) is not None
+
+
+class SettingsSnapshot:
+    """
+    A frozen copy of the settings, whose fields can be read as attributes
+    (e.g. snapshot.ignore_symlinks) or by name (e.g. snapshot["cipher"])
+    """
+
+    __slots__ = FIELDS + DERIVED_FIELDS
+
+    # Each field is declared here, so that the snapshot's attributes can
+    # be checked by linters.  These must match FIELDS and DERIVED_FIELDS.
+    # The miscellaneous settings are declared from their table of types,
+    # below the class.
+
+    # General settings:
+    instrument_name: str
+    facility_name: str
+    contact_name: str
+    contact_email: str
+    data_directory: str
+    mytardis_url: str
+    username: str
+    api_key: str
+
+    # Filters settings:
+    user_filter: str
+    dataset_filter: str
+    experiment_filter: str
+    ignore_old_datasets: bool
+    ignore_interval_number: int
+    ignore_interval_unit: str
+    ignore_new_datasets: bool
+    ignore_new_interval_number: int
+    ignore_new_interval_unit: str
+    ignore_new_files: bool
+    ignore_new_files_minutes: int
+    ignore_symlinks: bool
+    use_includes_file: bool
+    includes_file: str
+    use_excludes_file: bool
+    excludes_file: str
+
+    # Advanced settings:
+    folder_structure: str
+    group_prefix: str
+    validate_folder_structure: bool
+    max_upload_threads: int
+    max_upload_retries: int
+    upload_invalid_user_or_group_folders: bool
+    upload_method: str
+
+    # Derived values:
+    config_path: str
+    ignore_old_datasets_interval_seconds: int
+    ignore_new_datasets_interval_seconds: int
+    includes_pattern: "re.Pattern"
+    excludes_pattern: "re.Pattern"
+
+    def __init__(self, settings):
+        values = dict((field, settings[field]) for field in FIELDS)
+        values.update(
+            config_path=settings.config_path,
+            ignore_old_datasets_interval_seconds=(
+                settings.filters.ignore_old_datasets_interval_seconds),
+            ignore_new_datasets_interval_seconds=(
+                settings.filters.ignore_new_datasets_interval_seconds),
+            includes_pattern=compile_patterns(values["includes_file"])
+            if values["use_includes_file"] else None,
+            excludes_pattern=compile_patterns(values["excludes_file"])
+            if values["use_excludes_file"] else None,
+        )
+        self.__setstate__(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings snapshots can't be modified")
+
+    def __delattr__(self, name):
+        raise AttributeError("Settings snapshots can't be modified")
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def matches_includes(self, filename):
+        """
+        Return True if filename matches a glob in the includes file
+        """
+        return matches_pattern(self.includes_pattern, filename)
+
+    def matches_excludes(self, filename):
+        """
+        Return True if filename matches a glob in the excludes file
+        """
+        return matches_pattern(self.excludes_pattern, filename)
+
+    def apply(self, settings):
+        """
+        Copy the snapshot's fields into settings, e.g. so that a worker
+        process uses the same settings as its parent process, including
+        any which were changed after MyData.cfg was loaded
+        """
+        settings.config_path = self.config_path
+        for field in FIELDS:
+            settings[field] = getattr(self, field)
+
+
+SettingsSnapshot.__annotations__.update(
+    (field, field_type) for field, (field_type, _) in MISCELLANEOUS_FIELDS.items())
@@ -19,12 +19,19 @@ from ...logs import logger
 from ...threads.flags import FLAGS
 from ...utils.exceptions import InvalidSettings
 from ...utils.exceptions import UserAborted
+from ...utils.sessions import API_SESSION_POOL
 from ..facility import Facility
+from .cache import VALIDATION_CACHE
 
 
 def validate_settings(set_status_message=None):
     """
     Validate settings (an instance of Settings)
+
+    The MyTardis checks are skipped if they have been cached for the
+    current settings, see mydata.models.settings.cache.  The folder
+    structure is always checked, because the data directory can change
+    without any change to the settings.
     """
     from ...conf import settings
 
@@ -48,14 +55,16 @@ def validate_settings(set_status_message=None):
         if settings.advanced.validate_folder_structure:
             dataset_count = check_structure_and_count_datasets(set_status_message)
         raise_exception_if_user_aborted(set_status_message)
-        check_mytardis_url(set_status_message)
-        raise_exception_if_user_aborted(set_status_message)
-        check_mytardis_credentials(set_status_message)
-        raise_exception_if_user_aborted(set_status_message)
-        check_facility(set_status_message)
-        raise_exception_if_user_aborted(set_status_message)
-        check_instrument(set_status_message)
-        raise_exception_if_user_aborted(set_status_message)
+        if not VALIDATION_CACHE.get("mytardis"):
+            check_mytardis_url(set_status_message)
+            raise_exception_if_user_aborted(set_status_message)
+            check_mytardis_credentials(set_status_message)
+            raise_exception_if_user_aborted(set_status_message)
+            check_facility(set_status_message)
+            raise_exception_if_user_aborted(set_status_message)
+            check_instrument(set_status_message)
+            raise_exception_if_user_aborted(set_status_message)
+            VALIDATION_CACHE.put("mytardis", True)
         check_contact_email_and_email_folders(set_status_message)
         raise_exception_if_user_aborted(set_status_message)
         message = "Settings validation - succeeded!"
@@ -279,7 +288,7 @@ def check_mytardis_url(set_status_message=None):
         logger.debug(message)
         if set_status_message:
             set_status_message(message)
-        response = requests.get(
+        response = API_SESSION_POOL.get(
             settings.general.mytardis_api_url,
             timeout=settings.miscellaneous.connection_timeout,
         )
@@ -383,7 +392,7 @@ def check_mytardis_credentials(set_status_message=None):
         + "/api/v1/user/?format=json&username="
         + settings.general.username
     )
-    response = requests.get(headers=settings.default_headers, url=url)
+    response = API_SESSION_POOL.get(headers=settings.default_headers, url=url)
     if response.status_code < 200 or response.status_code >= 300:
         message = (
             "Your MyTardis credentials are invalid.\n\n"
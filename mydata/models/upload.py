@@ -44,6 +44,12 @@ class UploadMethod:
     LOCAL_COPY = 3  # includes copying to mounted file share
 
 
+# Upload methods which upload files to a staging area, to be verified
+# (and moved to permanent storage) by MyTardis:
+STAGING_UPLOAD_METHODS = (
+    UploadMethod.SCP, UploadMethod.SFTP, UploadMethod.LOCAL_COPY)
+
+
 def add_uploader_info(datafile_dict):
     """
     To identify the approved storage box for the upload, the
@@ -78,6 +84,9 @@ class Upload:
         self.filesize_string = ""
 
         self.bytes_uploaded = 0
+        # Bytes found on staging from a previous partial upload, which
+        # didn't need to be sent again:
+        self.bytes_resumed = 0
         self.status = UploadStatus.NOT_STARTED
         self.message = ""
         self.speed = ""
@@ -85,6 +94,9 @@ class Upload:
         self._file_size = 0  # File size long integer in bytes
         self.canceled = False
         self.retries = 0
+        # False if the upload failed before a transfer was attempted,
+        # e.g. because the file was too new or had been deleted:
+        self.transfer_started = False
 
         # Only used with UploadMethod.HTTP_POST:
         self.buffered_reader = None
@@ -111,7 +123,7 @@ class Upload:
             elapsed_time = self.latest_time - self.start_time
             if elapsed_time.total_seconds():
                 speed_mbs = (
-                    float(self.bytes_uploaded)
+                    float(self.bytes_uploaded - self.bytes_resumed)
                     / 1000000.0
                     / elapsed_time.total_seconds()
                 )
@@ -78,7 +78,6 @@ import uuid
 import urllib.parse
 
 import psutil
-import requests
 import netifaces
 
 from .. import __version__ as VERSION
@@ -92,6 +91,7 @@ from ..utils.exceptions import (
 )
 from ..utils import bytes_to_human
 from ..utils import mydata_install_location
+from ..utils.sessions import API_SESSION_POOL
 from .storage import StorageBox
 
 
@@ -174,7 +174,7 @@ class Uploader:
             + "&uuid="
             + urllib.parse.quote(settings.miscellaneous.uuid)
         )
-        response = requests.get(
+        response = API_SESSION_POOL.get(
             headers=settings.default_headers,
             url=url,
             timeout=settings.miscellaneous.connection_timeout,
@@ -225,14 +225,14 @@ class Uploader:
         data = json.dumps(uploader_dict, indent=4)
         logger.debug(data)
         if num_existing_uploader_records > 0:
-            response = requests.put(
+            response = API_SESSION_POOL.put(
                 headers=settings.default_headers,
                 url=url,
                 data=data.encode(),
                 timeout=settings.miscellaneous.connection_timeout,
             )
         else:
-            response = requests.post(
+            response = API_SESSION_POOL.post(
                 headers=settings.default_headers,
                 url=url,
                 data=data.encode(),
@@ -284,7 +284,7 @@ class Uploader:
         )
         logger.debug(url)
         headers = settings.default_headers
-        response = requests.get(headers=headers, url=url)
+        response = API_SESSION_POOL.get(headers=headers, url=url)
         response.raise_for_status()
         logger.debug(response.text)
         uploaders_dict = response.json()
@@ -319,7 +319,7 @@ class Uploader:
             "requester_key_fingerprint": self.ssh_key_pair.fingerprint,
         }
         data = json.dumps(urr_dict)
-        response = requests.post(
+        response = API_SESSION_POOL.post(
             headers=settings.default_headers, url=url, data=data.encode()
         )
         response.raise_for_status()
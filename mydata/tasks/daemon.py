@@ -0,0 +1,113 @@
+"""
+mydata/tasks/daemon.py
+
+Run upload cycles repeatedly in one long-lived process, so that settings,
+the verified datafiles cache, resolved MyTardis records, MyTardis API
+sessions and SSH sessions stay in memory between cycles, instead of being
+reloaded, looked up or reconnected by each "mydata upload" invocation.
+
+A cycle runs every interval seconds, or immediately when the process
+receives SIGUSR1.  SIGHUP reloads MyData.cfg and clears the cached
+MyTardis records before the next cycle.  SIGTERM stops the daemon after
+the current cycle.
+"""
+import signal
+import threading
+import traceback
+
+from ..conf import settings
+from ..logs import logger
+from ..models.settings.serialize import load_settings
+from ..threads.flags import FLAGS
+from ..utils.resolution import RESOLUTION_CACHE
+from ..utils.sessions import API_SESSION_POOL
+from ..utils.upload import SSH_SESSION_POOL
+
+
+class UploadDaemon:
+    """
+    Calls run_cycle every interval seconds (or when triggered) until stopped
+
+    If supplied, on_reload is called after settings are reloaded, e.g. to
+    check which upload method has been approved with the new settings.
+    """
+
+    def __init__(self, run_cycle, interval, on_reload=None):
+        self.run_cycle = run_cycle
+        self.interval = interval
+        self.on_reload = on_reload
+        self.num_cycles = 0
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.reload_requested = False
+
+    def trigger(self, *_):
+        """
+        Run the next cycle now, e.g. when SIGUSR1 is received
+        """
+        self.wakeup.set()
+
+    def reload(self, *_):
+        """
+        Reload settings and clear cached records before the next cycle,
+        e.g. when SIGHUP is received
+        """
+        self.reload_requested = True
+        self.wakeup.set()
+
+    def stop(self, *_):
+        """
+        Stop after the current cycle, e.g. when SIGTERM is received
+        """
+        self.stopping = True
+        self.wakeup.set()
+
+    def install_signal_handlers(self):
+        """
+        Handle SIGUSR1, SIGHUP and SIGTERM, where available
+        """
+        handlers = dict(
+            SIGUSR1=self.trigger, SIGHUP=self.reload, SIGTERM=self.stop)
+        for signal_name, handler in handlers.items():
+            if hasattr(signal, signal_name):
+                signal.signal(getattr(signal, signal_name), handler)
+
+    def reload_settings(self):
+        """
+        Reload MyData.cfg and forget cached records and sessions
+        """
+        logger.info("Reloading settings from %s" % settings.config_path)
+        load_settings()
+        RESOLUTION_CACHE.clear()
+        API_SESSION_POOL.close()
+        SSH_SESSION_POOL.close()
+        if settings.miscellaneous.cache_datafile_lookups:
+            settings.initialize_verified_datafiles_cache()
+        self.reload_requested = False
+        if self.on_reload:
+            self.on_reload()
+
+    def run(self, max_cycles=None):
+        """
+        Run cycles until stopped, or until max_cycles have run.
+
+        Errors from one cycle are logged, rather than stopping the daemon.
+        """
+        RESOLUTION_CACHE.enabled = True
+        SSH_SESSION_POOL.enabled = True
+        try:
+            while not self.stopping and not FLAGS.should_abort:
+                if self.reload_requested:
+                    self.reload_settings()
+                try:
+                    self.run_cycle()
+                except Exception:  # pylint: disable=broad-except
+                    logger.error(traceback.format_exc())
+                self.num_cycles += 1
+                if max_cycles and self.num_cycles >= max_cycles:
+                    break
+                self.wakeup.wait(self.interval)
+                self.wakeup.clear()
+        finally:
+            API_SESSION_POOL.close()
+            SSH_SESSION_POOL.close()
@@ -2,6 +2,7 @@
 mydata/tasks/folders.py
 """
 import datetime
+import functools
 import os
 import warnings
 from datetime import datetime
@@ -11,11 +12,15 @@ from ..events.stop import raise_exception_if_user_aborted
 from ..logs import logger
 from ..models.folder import Folder
 from ..models.group import Group
+from ..models.settings.snapshot import SettingsSnapshot
 from ..models.user import User
 from ..conf import settings
 from ..utils.exceptions import InvalidFolderStructure
+from ..utils.instrumentation import INSTRUMENTATION
+from ..utils.resolution import RESOLUTION_CACHE
 
 
+@INSTRUMENTATION.timed("scan_folders")
 def scan_folders(found_user_cb, found_group_cb, found_exp_folder_cb, found_dataset_cb):
     """
     Scan dataset folders.
@@ -29,26 +34,38 @@ def scan_folders(found_user_cb, found_group_cb, found_exp_folder_cb, found_datas
 
     For the experiment folder callback, the callback function
     should accept a string specifying the experiment folder name.
+
+    The settings are snapshotted once, and the snapshot is passed to each
+    dataset folder, for scanning its files, and looking up and uploading them.
     """
-    data_dir = settings.general.data_directory
+    settings_snapshot = SettingsSnapshot(settings)
+    data_dir = settings_snapshot.data_directory
     default_owner = settings.general.default_owner
-    folder_structure = settings.advanced.folder_structure
+    folder_structure = settings_snapshot.folder_structure
     logger.debug("FoldersModel.scan_folders(): Scanning " + data_dir + "...")
     if folder_structure.startswith("Username") or folder_structure.startswith("Email"):
-        scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb)
+        scan_for_user_folders(
+            found_user_cb, found_exp_folder_cb, found_dataset_cb,
+            settings_snapshot=settings_snapshot)
     elif folder_structure.startswith("User Group"):
-        scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb)
+        scan_for_group_folders(
+            found_group_cb, found_exp_folder_cb, found_dataset_cb,
+            settings_snapshot=settings_snapshot)
     elif folder_structure.startswith("Experiment"):
         scan_for_experiment_folders(
-            found_exp_folder_cb, found_dataset_cb, data_dir, default_owner
+            found_exp_folder_cb, found_dataset_cb, data_dir, default_owner,
+            settings_snapshot=settings_snapshot
         )
     elif folder_structure.startswith("Dataset"):
-        scan_for_dataset_folders(found_dataset_cb, data_dir, default_owner)
+        scan_for_dataset_folders(
+            found_dataset_cb, data_dir, default_owner,
+            settings_snapshot=settings_snapshot)
     else:
         raise InvalidFolderStructure("Unknown folder structure.")
 
 
-def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
+def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb,
+                          settings_snapshot=None):
     """
     Scan for user folders.
     """
@@ -61,7 +78,9 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
         logger.debug(
             "Found folder assumed to be %s: %s" % (user_folder_type(), user_folder_name)
         )
-        user = User.get_user_for_folder(user_folder_name.strip())
+        user = RESOLUTION_CACHE.get_or_resolve(
+            "user", user_folder_name,
+            functools.partial(User.get_user_for_folder, user_folder_name.strip()))
         raise_exception_if_user_aborted()
         if not user:
             message = "Didn't find a MyTardis user record for folder " '"%s" in %s' % (
@@ -88,7 +107,8 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
         logger.debug("Folder structure: " + folder_structure)
         if folder_structure in ("Username / Dataset", "Email / Dataset"):
             scan_for_dataset_folders(
-                found_dataset_cb, user_folder_path, user, user_folder_name
+                found_dataset_cb, user_folder_path, user, user_folder_name,
+                settings_snapshot=settings_snapshot,
             )
         elif folder_structure in (
             "Username / Experiment / Dataset",
@@ -100,6 +120,7 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
                 user_folder_path,
                 user,
                 user_folder_name,
+                settings_snapshot=settings_snapshot,
             )
         elif folder_structure == 'Username / "MyTardis" / Experiment / Dataset':
             user_folder_contents = os.listdir(user_folder_path)
@@ -118,11 +139,13 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
                 mytardis_folder_path,
                 user,
                 user_folder_name,
+                settings_snapshot=settings_snapshot,
             )
         raise_exception_if_user_aborted()
 
 
-def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb):
+def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb,
+                           settings_snapshot=None):
     """
     Scan for group folders.
     """
@@ -133,7 +156,10 @@ def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb
     for group_folder_name in group_folder_names(settings.general.data_directory):
         raise_exception_if_user_aborted()
         logger.debug("Found folder assumed to be user group name: " + group_folder_name)
-        group = Group.get_group_for_folder(group_folder_name.strip())
+        group = RESOLUTION_CACHE.get_or_resolve(
+            "group", group_folder_name,
+            functools.partial(
+                Group.get_group_for_folder, group_folder_name.strip()))
         if not group:
             message = (
                 "Didn't find a MyTardis user group record for "
@@ -157,7 +183,9 @@ def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb
         )
         default_owner = settings.general.default_owner
         if folder_structure == "User Group / Instrument / Full Name / Dataset":
-            import_group_folders(found_dataset_cb, group_folder_path, group)
+            import_group_folders(
+                found_dataset_cb, group_folder_path, group,
+                settings_snapshot=settings_snapshot)
         elif folder_structure == "User Group / Experiment / Dataset":
             scan_for_experiment_folders(
                 found_exp_folder_cb,
@@ -166,6 +194,7 @@ def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb
                 default_owner,
                 group=group,
                 group_folder_name=group_folder_name,
+                settings_snapshot=settings_snapshot,
             )
         elif folder_structure == "User Group / Dataset":
             scan_for_dataset_folders(
@@ -174,6 +203,7 @@ def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb
                 owner=default_owner,
                 group=group,
                 group_folder_name=group_folder_name,
+                settings_snapshot=settings_snapshot,
             )
         else:
             raise InvalidFolderStructure("Unknown folder structure.")
@@ -188,6 +218,7 @@ def scan_for_dataset_folders(
     user_folder_name=None,
     group=None,
     group_folder_name=None,
+    settings_snapshot=None,
 ):
     """
     Scan for dataset folders.
@@ -212,6 +243,7 @@ def scan_for_dataset_folders(
             group_folder_name=group_folder_name,
             owner=owner,
             group=group,
+            settings_snapshot=settings_snapshot,
         )
         raise_exception_if_user_aborted()
         folder.set_created_date()
@@ -227,6 +259,7 @@ def scan_for_experiment_folders(
     user_folder_name=None,
     group=None,
     group_folder_name=None,
+    settings_snapshot=None,
 ):
     """
     Scans for experiment folders.
@@ -259,6 +292,7 @@ def scan_for_experiment_folders(
                 group_folder_name=group_folder_name,
                 owner=owner,
                 group=group,
+                settings_snapshot=settings_snapshot,
             )
             raise_exception_if_user_aborted()
             if (
@@ -291,6 +325,7 @@ def scan_for_experiment_folders(
                 owner=owner,
                 group=group,
                 is_exp_files_folder=True,
+                settings_snapshot=settings_snapshot,
             )
             raise_exception_if_user_aborted()
             folder.experiment_title = exp_folder_name
@@ -299,7 +334,8 @@ def scan_for_experiment_folders(
         found_exp_folder_cb(exp_folder_name)
 
 
-def import_group_folders(found_dataset_cb, group_folder_path, group):
+def import_group_folders(found_dataset_cb, group_folder_path, group,
+                         settings_snapshot=None):
     """
     Imports folders structured according to the
     "User Group / Instrument / Researcher's Name / Dataset"
@@ -355,6 +391,7 @@ def import_group_folders(found_dataset_cb, group_folder_path, group):
                 group_folder_name=group_folder_name,
                 owner=owner,
                 group=group,
+                settings_snapshot=settings_snapshot,
             )
             raise_exception_if_user_aborted()
             folder.set_created_date()
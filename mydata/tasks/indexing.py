@@ -7,20 +7,48 @@ by mydata.commands.index.index_cmd to index files in a specified folder.
 Unlike the Multipart POST and SCP via Staging upload methods, the indexing
 doesn't use the settings in MyData.cfg.  Instead it expects its required
 settings to provided as environment variables or in a .env file.
+
+Files are indexed in a pipeline: directories are listed by a pool of
+walker threads, DataFile lookups and creations are run by a pool of API
+worker threads, and MD5 sums are calculated by a pool of hashing threads.
+The number of files in the pipeline is limited by MYTARDIS_INDEX_QUEUE_SIZE,
+and each file's results are reported in the order the files were found.
 """
+import functools
 import json
 import mimetypes
 import os
-import re
-import subprocess
-import sys
+import threading
 
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import quote
 
+import requests
+
+from ..indexing.settings import (
+    get_performance_setting,
+    get_checksum_algorithms,
+    get_checksum_cache_path,
+)
+from ..utils.checksums import ChecksumCache, ChecksumService
+from ..utils.listing import iter_datafile_records
 from ..utils.retries import requests_retry_session
 from ..indexing.models.lookup import Lookup, LookupStatus
 from ..indexing.models.datafile import DataFileCreation, DataFileCreationStatus
 
+# Each thread reuses its own requests session:
+THREAD_LOCAL = threading.local()
+
+# A file found within a dataset folder, with its path relative to the
+# dataset folder (directory) and to the storage box (uri):
+DatafileTask = namedtuple(
+    "DatafileTask", ["filename", "directory", "filepath", "uri"])
+
+# The results of indexing one file, and the messages to display for it:
+IndexingResult = namedtuple(
+    "IndexingResult", ["lookup", "datafile_creation", "messages"])
+
 HEADERS = {
     "Accept": "application/json",
     "Content-Type": "application/json",
@@ -69,6 +97,30 @@ def lookup_or_create_dataset(dataset_folder_name):
     return dataset_id
 
 
+def get_session():
+    """
+    Get this thread's requests session (which retries after server errors),
+    creating it if necessary
+    """
+    session = getattr(THREAD_LOCAL, "session", None)
+    if session is None:
+        session = requests_retry_session()
+        THREAD_LOCAL.session = session
+    return session
+
+
+def get_lookup_status(datafile_dict):
+    """Return the LookupStatus for a DataFile record from the MyTardis API.
+    """
+    dfos = datafile_dict["replicas"]
+    if not dfos:
+        return LookupStatus.FOUND_UNVERIFIED_NO_DFOS
+    verified = any(dfo["verified"] for dfo in dfos)
+    if verified:
+        return LookupStatus.FOUND_VERIFIED
+    return LookupStatus.FOUND_UNVERIFIED
+
+
 def lookup_datafile(dataset_id, filename, directory):
     """Query MyTardis API for a matching DataFile record.
     """
@@ -76,7 +128,7 @@ def lookup_datafile(dataset_id, filename, directory):
         "%s/api/v1/dataset_file/?format=json&dataset__id=%s&filename=%s&directory=%s"
         % (os.getenv("MYTARDIS_URL"), dataset_id, quote(filename), quote(directory),)
     )
-    response = requests_retry_session().get(df_lookup_url, headers=HEADERS)
+    response = get_session().get(df_lookup_url, headers=HEADERS)
     if not response.ok:
         return Lookup(dataset_id, directory, filename, LookupStatus.FAILED)
     datafiles_dict = response.json()
@@ -84,29 +136,95 @@ def lookup_datafile(dataset_id, filename, directory):
     matches = datafiles_dict["meta"]["total_count"]
     if not matches:
         return Lookup(dataset_id, directory, filename, LookupStatus.NOT_FOUND)
-    dfos = datafiles_dict["objects"][0]["replicas"]
-    if not dfos:
-        return Lookup(
-            dataset_id, directory, filename, LookupStatus.FOUND_UNVERIFIED_NO_DFOS
+    return Lookup(
+        dataset_id, directory, filename,
+        get_lookup_status(datafiles_dict["objects"][0]))
+
+
+class DatafileIndex:
+    """
+    The DataFile records of one dataset, keyed by directory and filename,
+    so that lookups can be resolved locally instead of querying the MyTardis
+    API for each file
+    """
+
+    def __init__(self, dataset_id):
+        self.dataset_id = dataset_id
+        self.statuses = dict()
+
+    def add(self, datafile_dicts):
+        """
+        Add DataFile records from the dataset's DataFile listing
+        """
+        for datafile_dict in datafile_dicts:
+            directory = (datafile_dict["directory"] or "").strip("/")
+            self.statuses[(directory, datafile_dict["filename"])] = \
+                get_lookup_status(datafile_dict)
+
+    def lookup(self, filename, directory):
+        """
+        Return a Lookup for a file, just like lookup_datafile
+        """
+        status = self.statuses.get((directory, filename), LookupStatus.NOT_FOUND)
+        return Lookup(self.dataset_id, directory, filename, status)
+
+
+def list_dataset_datafiles(dataset_id, executor=None):
+    """List a dataset's DataFile records, returning a DatafileIndex, or None
+    if the listing failed, in which case each file should be looked up with
+    lookup_datafile instead.
+
+    Records are requested in pages of MYTARDIS_INDEX_PAGE_SIZE records.  After
+    the first page, the remaining pages are requested concurrently by the
+    executor's threads (if an executor is supplied).
+    """
+    datafile_index = DatafileIndex(dataset_id)
+    try:
+        datafile_index.add(
+            iter_datafile_records(
+                "%s/api/v1/dataset_file/" % os.getenv("MYTARDIS_URL"),
+                HEADERS,
+                get_session,
+                dataset_id,
+                get_performance_setting("MYTARDIS_INDEX_PAGE_SIZE"),
+                executor,
+            )
         )
-    verified = any(dfo["verified"] for dfo in dfos)
-    if verified:
-        return Lookup(dataset_id, directory, filename, LookupStatus.FOUND_VERIFIED)
-    return Lookup(dataset_id, directory, filename, LookupStatus.FOUND_UNVERIFIED)
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        print(
+            "Couldn't list existing DataFile records, "
+            "so looking up files individually.\n"
+        )
+        return None
+    return datafile_index
 
 
-def create_datafile(dataset_id, filename, directory, filepath, uri):
-    """Create DataFile record via MyTardis API.
+def get_datafile_attributes(filepath, checksum_service=None):
+    """Return the size, MIME type and MD5 sum of a file.
+
+    If a ChecksumService is supplied, it is used to calculate the MD5 sum
+    (along with any extra digests), so that cached checksums can be used.
     """
     size = os.path.getsize(filepath)
-    print("size: %s" % size)
     mimetype = mimetypes.guess_type(filepath, strict=False)[0]
     if not mimetype:
         mimetype = "application/octet-stream"
-    print("mimetype: %s" % mimetype)
-    md5sum = calculate_md5sum(filepath)
-    print("md5sum: %s" % md5sum)
-    print()
+    if checksum_service:
+        md5sum = checksum_service.md5sum(filepath)
+    else:
+        md5sum = calculate_md5sum(filepath)
+    return size, mimetype, md5sum
+
+
+def create_datafile(dataset_id, filename, directory, filepath, uri,
+                    attributes=None):
+    """Create DataFile record via MyTardis API.
+
+    attributes should be the file's (size, mimetype, md5sum) from
+    get_datafile_attributes, which will be called if they aren't supplied.
+    """
+    # pylint: disable=too-many-arguments
+    size, mimetype, md5sum = attributes or get_datafile_attributes(filepath)
 
     datafile_post_data = {
         "dataset": "/api/v1/dataset/%s/" % dataset_id,
@@ -124,7 +242,7 @@ def create_datafile(dataset_id, filename, directory, filepath, uri):
         ],
     }
 
-    response = requests_retry_session().post(
+    response = get_session().post(
         "%s/api/v1/dataset_file/" % os.getenv("MYTARDIS_URL"),
         data=json.dumps(datafile_post_data),
         headers=HEADERS,
@@ -144,6 +262,171 @@ def create_datafile(dataset_id, filename, directory, filepath, uri):
     )
 
 
+def list_directory(dirname):
+    """List a directory's files and subdirectories, sorted by name.
+
+    Like os.walk, symbolic links to directories aren't followed.
+    """
+    filenames = []
+    subdirs = []
+    with os.scandir(dirname) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            else:
+                filenames.append(entry.name)
+    return sorted(filenames), sorted(subdirs)
+
+
+def walk_dataset_folder(dataset_root_dir, executor):
+    """Yield a DatafileTask for each file in a dataset folder.
+
+    Directories are listed concurrently by the executor's threads, ahead of
+    the files being yielded, which are yielded in the same (top-down) order
+    as os.walk would find them.
+    """
+    storage_box_path = os.getenv("MYTARDIS_STORAGE_BOX_PATH")
+    src_path = os.getenv("MYTARDIS_SRC_PATH")
+    pending = deque([(dataset_root_dir, executor.submit(list_directory, dataset_root_dir))])
+    while pending:
+        dirname, listing = pending.popleft()
+        filenames, subdirs = listing.result()
+        pending.extendleft(
+            (subdir, executor.submit(list_directory, subdir))
+            for subdir in reversed(subdirs))
+        relpath = os.path.relpath(dirname, storage_box_path)
+        directory = os.path.relpath(dirname, dataset_root_dir)
+        if directory == ".":
+            directory = ""
+        for filename in filenames:
+            uri = os.path.join(relpath, filename)
+            yield DatafileTask(
+                filename, directory, os.path.join(src_path, uri), uri)
+
+
+class IndexingPipeline:
+    """
+    Indexes one dataset's files, looking up and creating DataFile records
+    in the api_executor's threads and calculating MD5 sums in the
+    hash_executor's threads.
+
+    Each stage submits the next stage for a file when it completes, so no
+    thread waits for another stage, and submit returns a Future which
+    completes with the file's IndexingResult.
+
+    MD5 sums are calculated by the checksum_service (if supplied), and
+    lookups are resolved using the datafile_index (if supplied), rather
+    than querying the MyTardis API for each file.
+    """
+
+    def __init__(self, dataset_id, api_executor, hash_executor,
+                 checksum_service=None, datafile_index=None):
+        # pylint: disable=too-many-arguments
+        self.dataset_id = dataset_id
+        self.api_executor = api_executor
+        self.hash_executor = hash_executor
+        self.checksum_service = checksum_service
+        self.datafile_index = datafile_index
+
+    def submit(self, task):
+        """
+        Start indexing a file, returning a Future for its IndexingResult
+        """
+        result = Future()
+        if self.datafile_index:
+            lookup = Future()
+            lookup.set_result(
+                self.datafile_index.lookup(task.filename, task.directory))
+        else:
+            lookup = self.api_executor.submit(
+                lookup_datafile, self.dataset_id, task.filename, task.directory)
+        self.then(result, lookup, functools.partial(self.looked_up, task, result))
+        return result
+
+    @staticmethod
+    def then(result, future, callback):
+        """
+        Call callback with future's result when it completes, passing any
+        exception on to the result future instead
+        """
+        def done(future):
+            try:
+                callback(future.result())
+            except Exception as err:  # pylint: disable=broad-except
+                result.set_exception(err)
+
+        future.add_done_callback(done)
+
+    def looked_up(self, task, result, lookup):
+        """
+        Finish indexing a file which has been found (or couldn't be
+        looked up), or calculate its MD5 sum so that it can be created
+        """
+        messages = ["File path: %s" % task.filepath]
+        if lookup.status == LookupStatus.FAILED:
+            messages += [
+                "Failed to check for existing DataFile record on MyTardis.  "
+                "Skipping for now.",
+                "",
+            ]
+            result.set_result(IndexingResult(lookup, None, messages))
+            return
+        if lookup.status in (
+            LookupStatus.FOUND_VERIFIED,
+            LookupStatus.FOUND_UNVERIFIED,
+        ):
+            messages += [
+                "DataFile record was found, so we won't create another "
+                "record for this file.",
+                "",
+            ]
+            result.set_result(IndexingResult(lookup, None, messages))
+            return
+        assert lookup.status in (
+            LookupStatus.NOT_FOUND,
+            LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
+        )
+        self.then(
+            result,
+            self.hash_executor.submit(
+                get_datafile_attributes, task.filepath, self.checksum_service),
+            functools.partial(self.hashed, task, result, lookup, messages))
+
+    def hashed(self, task, result, lookup, messages, attributes):
+        """
+        Create a DataFile record for a file whose MD5 sum has been calculated
+        """
+        # pylint: disable=too-many-arguments
+        messages += [
+            "size: %s" % attributes[0],
+            "mimetype: %s" % attributes[1],
+            "md5sum: %s" % attributes[2],
+            "",
+        ]
+        self.then(
+            result,
+            self.api_executor.submit(
+                create_datafile, self.dataset_id, task.filename, task.directory,
+                task.filepath, task.uri, attributes),
+            functools.partial(self.created, result, lookup, messages))
+
+    @staticmethod
+    def created(result, lookup, messages, datafile_creation):
+        """
+        Finish indexing a file whose DataFile record has been created
+        """
+        if datafile_creation.status == DataFileCreationStatus.FAILED:
+            messages += ["Failed to create DataFile record.  Skipping for now.", ""]
+        else:
+            messages += [
+                "Created DataFile record: %s" % datafile_creation.resource_uri,
+                "",
+                "",
+            ]
+        result.set_result(IndexingResult(lookup, datafile_creation, messages))
+
+
 def scan_folder_and_upload(
     dataset_folder_name, lookup_callback, datafile_creation_callback
 ):
@@ -154,70 +437,81 @@ def scan_folder_and_upload(
 
     datafile_creation_callback should be a function which will be called after each
     DataFile creation.
+
+    The callbacks are called from this thread, in the order in which the
+    files were found, although the files are indexed concurrently.
     """
+    # pylint: disable=too-many-locals
     dataset_id = lookup_or_create_dataset(dataset_folder_name)
     dataset_root_dir = "%s/%s/" % (
         os.getenv("MYTARDIS_STORAGE_BOX_PATH"),
         dataset_folder_name,
     )
-    for dirname, _, files in os.walk(dataset_root_dir):
-        relpath = os.path.relpath(dirname, os.getenv("MYTARDIS_STORAGE_BOX_PATH"))
-        for filename in sorted(files):
-            uri = os.path.join(relpath, filename)
-            filepath = os.path.join(os.getenv("MYTARDIS_SRC_PATH"), uri)
-            print("File path: %s" % filepath)
-            directory = os.path.relpath(dirname, dataset_root_dir)
-            if directory == ".":
-                directory = ""
-
-            lookup = lookup_datafile(dataset_id, filename, directory)
-            if lookup.status == LookupStatus.FAILED:
-                print(
-                    "Failed to check for existing DataFile record on MyTardis.  Skipping for now."
-                )
-                print()
-                lookup_callback(lookup)
-                continue
-            if lookup.status in (
-                LookupStatus.FOUND_VERIFIED,
-                LookupStatus.FOUND_UNVERIFIED,
-            ):
-                print(
-                    "DataFile record was found, so we won't create another record for this file."
-                )
-                print()
-                lookup_callback(lookup)
-                continue
-            assert lookup.status in (
-                LookupStatus.NOT_FOUND,
-                LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
-            )
-            lookup_callback(lookup)
 
-            datafile_creation = create_datafile(
-                dataset_id, filename, directory, filepath, uri
-            )
-            if datafile_creation.status == DataFileCreationStatus.FAILED:
-                print("Failed to create DataFile record.  Skipping for now.")
-                print()
-                datafile_creation_callback(datafile_creation)
-                continue
+    def report(result):
+        for message in result.messages:
+            print(message)
+        lookup_callback(result.lookup)
+        if result.datafile_creation:
+            datafile_creation_callback(result.datafile_creation)
+
+    checksum_cache_path = get_checksum_cache_path()
+    checksum_cache = ChecksumCache(checksum_cache_path) if checksum_cache_path else None
+    checksum_service = ChecksumService(checksum_cache, get_checksum_algorithms())
 
-            print("Created DataFile record: %s" % datafile_creation.resource_uri)
-            print()
-            print()
-            datafile_creation_callback(datafile_creation)
+    queue_size = get_performance_setting("MYTARDIS_INDEX_QUEUE_SIZE")
+    with ThreadPoolExecutor(
+        get_performance_setting("MYTARDIS_INDEX_WALKERS"),
+        thread_name_prefix="IndexWalker",
+    ) as walk_executor, ThreadPoolExecutor(
+        get_performance_setting("MYTARDIS_INDEX_API_WORKERS"),
+        thread_name_prefix="IndexApiWorker",
+    ) as api_executor, ThreadPoolExecutor(
+        get_performance_setting("MYTARDIS_INDEX_HASHERS"),
+        thread_name_prefix="IndexHasher",
+    ) as hash_executor:
+        datafile_index = list_dataset_datafiles(dataset_id, api_executor)
+        pipeline = IndexingPipeline(
+            dataset_id, api_executor, hash_executor, checksum_service,
+            datafile_index)
+        pending = deque()
+        try:
+            for task in walk_dataset_folder(dataset_root_dir, walk_executor):
+                pending.append(pipeline.submit(task))
+                if len(pending) >= queue_size:
+                    report(pending.popleft().result())
+            while pending:
+                report(pending.popleft().result())
+            if checksum_cache:
+                report_duplicates(
+                    checksum_cache, checksum_service.algorithms,
+                    os.path.join(
+                        os.getenv("MYTARDIS_SRC_PATH"), dataset_folder_name))
+        finally:
+            if checksum_cache:
+                # Wait for any hashing still in progress (after an error):
+                hash_executor.shutdown()
+                checksum_cache.close()
+
+
+def report_duplicates(checksum_cache, algorithms, src_dir):
+    """Print groups of duplicate files in a dataset's source directory.
+
+    Duplicates are found using the first extra digest listed in
+    MYTARDIS_INDEX_EXTRA_DIGESTS (if any), from the checksums cached for
+    files which have been hashed when creating their DataFile records.
+    """
+    if len(algorithms) < 2:
+        return
+    for paths in checksum_cache.duplicates(algorithms[1], src_dir):
+        print("Duplicate files (same size and %s digest):" % algorithms[1])
+        for path in paths:
+            print("    %s" % path)
+        print("")
 
 
 def calculate_md5sum(filepath):
     """
-    Calculate MD5 sum for filepath
+    Calculate MD5 sum for filepath (in-process, without using the checksum cache)
     """
-    md5sum_binary = ["md5sum"]
-    if sys.platform == "darwin":
-        md5sum_binary = ["md5", "-r"]
-    with subprocess.Popen(
-        [*md5sum_binary, filepath], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-    ) as proc:
-        stdout, _ = proc.communicate()
-    return re.match(r"\w+", stdout.decode()).group(0)
+    return ChecksumService().md5sum(filepath)
@@ -1,15 +1,41 @@
 """
 mydata/tasks/lookups.py
 """
+import asyncio
 import os
 
 import requests.exceptions
 
 from ..models.datafile import DataFile
 from ..models.lookup import Lookup, LookupStatus
-from ..models.upload import UploadMethod
+from ..models.upload import STAGING_UPLOAD_METHODS
 from ..conf import settings
 from ..threads.locks import LOCKS
+from ..utils.instrumentation import INSTRUMENTATION
+
+# The lookup statuses of files which need to be uploaded:
+UPLOAD_LOOKUP_STATUSES = (
+    LookupStatus.NOT_FOUND,
+    LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
+    LookupStatus.FOUND_UNVERIFIED_ON_STAGING,
+)
+
+
+def get_lookup_status(existing_datafile, upload_method):
+    """
+    Return the LookupStatus for a file whose DataFile record (or None) was
+    found on MyTardis.  This is also used by "mydata upload --plan", so that
+    it plans to upload the same files as an upload would.
+    """
+    if not existing_datafile:
+        return LookupStatus.NOT_FOUND
+    if existing_datafile.replicas and existing_datafile.replicas[0].verified:
+        return LookupStatus.FOUND_VERIFIED
+    if not existing_datafile.replicas:
+        return LookupStatus.FOUND_UNVERIFIED_NO_DFOS
+    if upload_method in STAGING_UPLOAD_METHODS:
+        return LookupStatus.FOUND_UNVERIFIED_ON_STAGING
+    return LookupStatus.FOUND_UNVERIFIED_UNSTAGED
 
 
 class FolderLookup:
@@ -33,6 +59,19 @@ class FolderLookup:
             lookup_runnable = LookupRunnable(self, dfi)
             lookup_runnable.lookup_datafile()
 
+    async def lookup_datafiles_concurrently(self, executor):
+        """Look up a folder's files on MyTardis, using the threads in
+        executor (a concurrent.futures.Executor), so that lookups don't
+        block the event loop.  The lookup_done_cb callback is called
+        from those threads.
+        """
+        loop = asyncio.get_running_loop()  # pylint: disable=no-member
+        await asyncio.gather(*[
+            loop.run_in_executor(
+                executor, LookupRunnable(self, dfi).lookup_datafile)
+            for dfi in range(0, self.folder.num_files)
+        ])
+
 
 class LookupRunnable:
     """Methods for looking up files on a MyTardis server
@@ -49,6 +88,7 @@ class LookupRunnable:
         self.folder_lookup = folder_lookup
         self.dfi = dfi
 
+    @INSTRUMENTATION.timed("lookup_datafile")
     def lookup_datafile(self):
         """Look up a single file on the MyTardis server and determine whether
         it is verified.
@@ -66,10 +106,11 @@ class LookupRunnable:
             lookup.message = "Looking for matching file in verified files cache..."
             cache_key = "%s,%s" % (folder.dataset.dataset_id, datafile_path)
             if (
-                settings.miscellaneous.cache_datafile_lookups
+                folder.settings_snapshot.cache_datafile_lookups
                 and cache_key in settings.verified_datafiles_cache
             ):
-                folder.num_cache_hits += 1
+                with LOCKS.update_counts:  # pylint: disable=no-member
+                    folder.num_cache_hits += 1
                 folder.set_datafile_uploaded(self.dfi, True)
                 lookup.status = LookupStatus.FOUND_VERIFIED
                 self.folder_lookup.lookup_done_cb(lookup)
@@ -105,11 +146,12 @@ class LookupRunnable:
         """Check if existing DataFile is verified
         """
         lookup.message = "Found datafile on MyTardis server."
-        if not existing_datafile.replicas or not existing_datafile.replicas[0].verified:
-            self.handle_existing_unverified_datafile(lookup, existing_datafile)
-        else:
-            lookup.status = LookupStatus.FOUND_VERIFIED
+        lookup.status = get_lookup_status(
+            existing_datafile, self.folder_lookup.upload_method)
+        if lookup.status == LookupStatus.FOUND_VERIFIED:
             self.handle_existing_verified_datafile(lookup)
+        else:
+            self.handle_existing_unverified_datafile(lookup, existing_datafile)
 
     def handle_existing_verified_datafile(self, lookup):
         """Found existing verified file on server
@@ -117,7 +159,7 @@ class LookupRunnable:
         folder = self.folder_lookup.folder
         datafile_path = os.path.join(lookup.subdirectory, lookup.filename)
         cache_key = "%s,%s" % (folder.dataset.dataset_id, datafile_path)
-        if settings.miscellaneous.cache_datafile_lookups:
+        if folder.settings_snapshot.cache_datafile_lookups:
             with LOCKS.update_cache:  # pylint: disable=no-member
                 settings.verified_datafiles_cache[cache_key] = True
         folder.set_datafile_uploaded(lookup.datafile_index, True)
@@ -131,24 +173,20 @@ class LookupRunnable:
         """
         lookup.message = "Found unverified datafile record on MyTardis."
 
-        if self.folder_lookup.upload_method == UploadMethod.SCP:
+        if self.folder_lookup.upload_method in STAGING_UPLOAD_METHODS:
             self.handle_unverified_file_on_staging(lookup, existing_datafile)
         else:
             self.handle_unverified_unstaged_upload(lookup, existing_datafile)
 
     def handle_unverified_file_on_staging(self, lookup, existing_datafile):
         """
-        Re-upload file (resuming partial uploads is not supported).
+        Re-upload file.  With the SSH2 upload method, a partial upload
+        found on staging will be resumed rather than restarted.
         """
         folder = self.folder_lookup.folder
         lookup.message = "Found unverified file while using upload-via-staging."
         lookup.existing_unverified_datafile = existing_datafile
-        if existing_datafile.replicas:
-            folder.set_datafile_uploaded(lookup.datafile_index, False)
-            lookup.status = LookupStatus.FOUND_UNVERIFIED_ON_STAGING
-        else:
-            folder.set_datafile_uploaded(lookup.datafile_index, False)
-            lookup.status = LookupStatus.FOUND_UNVERIFIED_NO_DFOS
+        folder.set_datafile_uploaded(lookup.datafile_index, False)
         self.folder_lookup.lookup_done_cb(lookup)
 
     def handle_unverified_unstaged_upload(self, lookup, existing_datafile):
@@ -163,11 +201,9 @@ class LookupRunnable:
         # If there's an existing DFO, we probably just need to wait until
         # MyTardis verifies the file, but if there are no DFOs, MyData
         # should not mark this file as uploaded:
-        if existing_datafile.replicas:
+        if lookup.status == LookupStatus.FOUND_UNVERIFIED_UNSTAGED:
             folder.set_datafile_uploaded(lookup.datafile_index, True)
-            lookup.status = LookupStatus.FOUND_UNVERIFIED_UNSTAGED
             DataFile.verify(existing_datafile.id)
         else:
             folder.set_datafile_uploaded(lookup.datafile_index, False)
-            lookup.status = LookupStatus.FOUND_UNVERIFIED_NO_DFOS
         self.folder_lookup.lookup_done_cb(lookup)
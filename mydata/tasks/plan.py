@@ -0,0 +1,341 @@
+"""
+mydata/tasks/plan.py
+
+Plan an upload without transferring any files or creating any MyTardis
+records ("mydata upload --plan"), reporting which experiments and datasets
+would be created, and how many files (and bytes) would be uploaded from each
+dataset folder, with an estimated transfer time.
+
+Each existing dataset's DataFile records are listed a page at a time, rather
+than being looked up one file at a time, and files found in the verified
+datafiles cache aren't looked up at all.
+
+A plan saved as JSON can be passed to "mydata upload --from-plan", which then
+uploads only the planned files, without looking up the others again.
+"""
+import csv
+import functools
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+
+from ..conf import settings
+from ..logs import logger
+from ..models.datafile import DataFile
+from ..models.dataset import Dataset
+from ..models.experiment import Experiment
+from ..utils.listing import iter_datafile_records
+from ..utils.resolution import RESOLUTION_CACHE
+from ..utils.retries import requests_retry_session
+from ..utils.throttle import BANDWIDTH_LIMITER
+from .lookups import get_lookup_status, UPLOAD_LOOKUP_STATUSES
+
+# Number of DataFile records to request per page when listing a dataset:
+PAGE_SIZE = 1000
+
+# Upload runs transferring less than this aren't used to measure throughput,
+# because per-file overheads dominate their transfer times:
+MIN_MEASURED_BYTES = 10 * 1000 * 1000
+
+CSV_FIELDS = [
+    "user_folder_name",
+    "group_folder_name",
+    "experiment_title",
+    "experiment_id",
+    "dataset_folder",
+    "dataset_id",
+    "num_files",
+    "num_files_to_upload",
+    "num_bytes_to_upload",
+    "estimated_seconds",
+]
+
+
+class DatasetPlan:
+    """
+    The files which would be uploaded from one dataset folder, and whether
+    its experiment and dataset records would need to be created
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, folder):
+        self.user_folder_name = folder.user_folder_name
+        self.group_folder_name = folder.group_folder_name
+        self.experiment_title = folder.experiment_title
+        self.dataset_folder = folder.get_rel_path()
+        self.experiment_id = None
+        self.dataset_id = None
+        self.num_files = folder.num_files
+        self.files = []
+        self.num_bytes = 0
+
+    def add_file(self, folder, datafile_index):
+        """
+        Add a file (identified by its index in folder) to be uploaded
+        """
+        self.files.append(
+            os.path.join(
+                folder.get_datafile_directory(datafile_index),
+                folder.get_datafile_name(datafile_index)))
+        self.num_bytes += folder.get_datafile_size(datafile_index)
+
+    def to_dict(self, throughput):
+        """
+        Return the dataset plan as a dictionary which can be serialized
+        as JSON, estimating the transfer time from throughput (in bytes
+        per second), if known
+        """
+        return dict(
+            user_folder_name=self.user_folder_name,
+            group_folder_name=self.group_folder_name,
+            experiment_title=self.experiment_title,
+            experiment_id=self.experiment_id,
+            dataset_folder=self.dataset_folder,
+            dataset_id=self.dataset_id,
+            num_files=self.num_files,
+            num_files_to_upload=len(self.files),
+            num_bytes_to_upload=self.num_bytes,
+            estimated_seconds=estimate_seconds(self.num_bytes, throughput),
+            files=self.files,
+        )
+
+
+class UploadPlan:
+    """
+    The dataset plans for all scanned folders, which can be saved as JSON
+    or CSV, and loaded again by "mydata upload --from-plan"
+    """
+
+    def __init__(self, datasets, throughput=None):
+        self.datasets = datasets
+        self.throughput = throughput
+
+    def to_dict(self):
+        """
+        Return the plan as a dictionary which can be serialized as JSON
+        """
+        datasets = [
+            dataset_plan.to_dict(self.throughput)
+            for dataset_plan in self.datasets]
+        num_bytes = sum(dataset["num_bytes_to_upload"] for dataset in datasets)
+        return dict(
+            created=datetime.now().isoformat(),
+            mytardis_url=settings.general.mytardis_url,
+            data_directory=settings.general.data_directory,
+            throughput=self.throughput,
+            totals=dict(
+                num_datasets=len(datasets),
+                num_experiments_to_create=len(set(
+                    (dataset["user_folder_name"], dataset["group_folder_name"],
+                     dataset["experiment_title"])
+                    for dataset in datasets if not dataset["experiment_id"])),
+                num_datasets_to_create=len(
+                    [dataset for dataset in datasets
+                     if not dataset["dataset_id"]]),
+                num_files=sum(dataset["num_files"] for dataset in datasets),
+                num_files_to_upload=sum(
+                    dataset["num_files_to_upload"] for dataset in datasets),
+                num_bytes_to_upload=num_bytes,
+                estimated_seconds=estimate_seconds(num_bytes, self.throughput),
+            ),
+            datasets=datasets,
+        )
+
+    def write_json(self, stream):
+        """
+        Write the plan to stream as JSON
+        """
+        json.dump(self.to_dict(), stream, indent=2)
+        stream.write("\n")
+
+    def write_csv(self, stream):
+        """
+        Write the plan to stream as CSV, with one row per dataset folder
+        (without the lists of files to upload)
+        """
+        writer = csv.DictWriter(stream, CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for dataset in self.to_dict()["datasets"]:
+            writer.writerow(dataset)
+
+
+def estimate_seconds(num_bytes, throughput):
+    """
+    Return the estimated time to upload num_bytes at throughput bytes per
+    second, or None if the throughput isn't known
+    """
+    if not throughput:
+        return None
+    return round(num_bytes / throughput, 1)
+
+
+def get_throughput_path():
+    """
+    The location of the upload throughput measured by the last "mydata upload"
+    to the MyTardis server, stored alongside MyData.cfg
+    """
+    parsed = urlparse(settings.general.mytardis_url)
+    return os.path.join(
+        os.path.dirname(settings.config_path),
+        "upload-throughput-%s-%s.json" % (parsed.scheme, parsed.netloc),
+    )
+
+
+def save_measured_throughput(num_bytes, seconds):
+    """
+    Save the throughput measured by an upload run which uploaded num_bytes
+    in seconds, unless too few bytes were uploaded to measure it reliably
+    """
+    if num_bytes < MIN_MEASURED_BYTES or seconds <= 0:
+        return
+    try:
+        with open(get_throughput_path(), "w", encoding="utf-8") as throughput_file:
+            json.dump(
+                dict(throughput=num_bytes / seconds,
+                     measured=datetime.now().isoformat()),
+                throughput_file)
+    except (IOError, OSError):
+        logger.warning("Couldn't save measured upload throughput.")
+        logger.warning(traceback.format_exc())
+
+
+def get_planning_throughput():
+    """
+    Return the throughput (in bytes per second) for estimating transfer
+    times: the throughput measured by the last upload run, limited by the
+    current bandwidth limit.  Return None if neither is known.
+    """
+    throughput = None
+    try:
+        with open(get_throughput_path(), encoding="utf-8") as throughput_file:
+            throughput = json.load(throughput_file)["throughput"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    rate_limit = BANDWIDTH_LIMITER.current_rate()
+    if rate_limit and (not throughput or rate_limit < throughput):
+        return rate_limit
+    return throughput
+
+
+def list_dataset_datafiles(dataset_id):
+    """
+    Return a dataset's DataFile records (as DataFile instances), keyed by
+    directory and filename, or None if they couldn't be listed
+    """
+    datafiles = dict()
+    try:
+        for datafile_dict in iter_datafile_records(
+                "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url,
+                settings.default_headers, requests_retry_session, dataset_id,
+                PAGE_SIZE):
+            datafile = DataFile(dataset=None, datafile_dict=datafile_dict)
+            directory = (datafile.directory or "").strip("/")
+            datafiles[(directory, datafile.filename)] = datafile
+        return datafiles
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        logger.warning(
+            "Couldn't list DataFile records for dataset ID %s" % dataset_id)
+        return None
+
+
+def plan_folder(folder, upload_method):
+    """
+    Plan the upload of one dataset folder, without creating any records
+    """
+    plan = DatasetPlan(folder)
+    folder.experiment = RESOLUTION_CACHE.get_or_resolve(
+        "experiment",
+        (folder.user_folder_name, folder.group_folder_name,
+         folder.experiment_title),
+        functools.partial(Experiment.get_exp_for_folder, folder))
+    folder.dataset = None
+    if folder.experiment:
+        plan.experiment_id = folder.experiment.exp_id
+        folder.dataset = RESOLUTION_CACHE.get_or_resolve(
+            "dataset",
+            (folder.experiment.id, folder.get_rel_path()),
+            functools.partial(Dataset.get_dataset, folder))
+    if not folder.dataset:
+        for datafile_index in range(folder.num_files):
+            plan.add_file(folder, datafile_index)
+        return plan
+
+    plan.dataset_id = folder.dataset.dataset_id
+    uncached = []
+    for datafile_index in range(folder.num_files):
+        cache_key = "%s,%s" % (
+            plan.dataset_id,
+            os.path.join(folder.get_datafile_directory(datafile_index),
+                         folder.get_datafile_name(datafile_index)))
+        if not settings.miscellaneous.cache_datafile_lookups or \
+                cache_key not in settings.verified_datafiles_cache:
+            uncached.append(datafile_index)
+    datafiles = list_dataset_datafiles(plan.dataset_id) if uncached else None
+    for datafile_index in uncached:
+        directory = folder.get_datafile_directory(datafile_index)
+        filename = folder.get_datafile_name(datafile_index)
+        if datafiles is None:
+            datafile = DataFile.get_datafile(
+                dataset=folder.dataset, filename=filename, directory=directory)
+        else:
+            datafile = datafiles.get((directory.strip("/"), filename))
+        if get_lookup_status(datafile, upload_method) in \
+                UPLOAD_LOOKUP_STATUSES:
+            plan.add_file(folder, datafile_index)
+    return plan
+
+
+def plan_upload(folders, upload_method):
+    """
+    Plan the upload of the scanned folders, planning up to
+    max_lookup_threads folders concurrently, and return an UploadPlan
+    """
+    with ThreadPoolExecutor(
+            max_workers=max(1, settings.miscellaneous.max_lookup_threads)
+    ) as executor:
+        datasets = list(executor.map(
+            functools.partial(plan_folder, upload_method=upload_method),
+            folders))
+    return UploadPlan(datasets, get_planning_throughput())
+
+
+def load_plan(plan_file):
+    """
+    Load a plan saved as JSON by "mydata upload --plan", returning a
+    dictionary of the files to upload (relative to each dataset folder),
+    keyed by dataset folder (relative to the data directory)
+
+    :raises ValueError: if plan_file doesn't contain a JSON plan
+    """
+    try:
+        plan = json.load(plan_file)
+        return dict(
+            (dataset["dataset_folder"], dataset["files"])
+            for dataset in plan["datasets"])
+    except (KeyError, TypeError) as err:
+        raise ValueError("Invalid upload plan: missing %s" % err) from err
+
+
+def apply_plan(folders, planned_files):
+    """
+    Restrict the scanned folders to the files in the plan (loaded with
+    load_plan), returning the folders with files to upload.  Folders which
+    weren't in the plan, e.g. because they were created after it, are left
+    for the next upload.
+    """
+    planned_folders = []
+    for folder in folders:
+        files = planned_files.get(folder.get_rel_path())
+        if not files:
+            continue
+        folder.set_local_files(
+            [os.path.join(folder.get_absolute_path(), path) for path in files])
+        if folder.num_files:
+            planned_folders.append(folder)
+    return planned_folders
@@ -0,0 +1,157 @@
+"""
+mydata/tasks/processes.py
+
+Upload folders in several worker processes, so that SSH encryption,
+MD5 hashing and chunk handling can use more than one CPU core.
+
+Each worker process loads MyData.cfg itself, then applies a snapshot of
+the parent process's settings, so that any settings changed after
+MyData.cfg was loaded are the same in the workers, and opens its own
+connections.  Lookup and upload results are returned to the parent
+process as small picklable objects, so that the parent can display
+the upload summary and update the verified datafiles cache.  Each
+worker's stage timings, API request latencies and retry counts are
+also returned, and added to the parent's, for the run report and metrics.
+"""
+import asyncio
+import copy
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from ..conf import settings
+from ..models.settings.snapshot import SettingsSnapshot
+from ..models.upload import UploadStatus
+from ..utils.instrumentation import INSTRUMENTATION
+from .uploads import (
+    upload_folder, get_upload_concurrency, TRANSFER_RETRY_POLICY)
+
+# The attributes of mydata.models.upload.Upload used in upload summaries:
+UploadResult = namedtuple(
+    "UploadResult",
+    ["filename", "message", "status", "file_size", "bytes_uploaded",
+     "bytes_resumed"])
+
+
+def shard_folders(folders, num_shards):
+    """
+    Split folders into num_shards lists of folder indices with
+    similar total file sizes, assigning the largest folders first
+    """
+    def folder_size(folder):
+        return sum(
+            folder.get_datafile_size(dfi) for dfi in range(folder.num_files))
+
+    sizes = [folder_size(folder) for folder in folders]
+    shards = [[] for _ in range(num_shards)]
+    shard_sizes = [0] * num_shards
+    for folder_index in sorted(
+            range(len(folders)), key=lambda index: sizes[index], reverse=True):
+        shard_index = shard_sizes.index(min(shard_sizes))
+        shards[shard_index].append(folder_index)
+        shard_sizes[shard_index] += sizes[folder_index]
+    return [sorted(shard) for shard in shards if shard]
+
+
+def upload_folders_in_worker(folders, progress, upload_method,
+                             settings_snapshot):
+    """
+    Upload folders in a worker process, returning picklable results
+    """
+    settings_snapshot.apply(settings)
+    if settings.miscellaneous.cache_datafile_lookups:
+        settings.initialize_verified_datafiles_cache()
+    # A worker process can be reused for another shard, so only this
+    # shard's timings and retries are returned:
+    INSTRUMENTATION.reset()
+    retry_counts = TRANSFER_RETRY_POLICY.stats.counts()
+
+    lookups = []
+    uploads = []
+
+    def lookup_callback(lookup):
+        lookup = copy.copy(lookup)
+        lookup.existing_unverified_datafile = None
+        lookups.append(lookup)
+
+    def upload_callback(upload):
+        if upload.status in (UploadStatus.COMPLETED, UploadStatus.FAILED):
+            uploads.append(
+                UploadResult(upload.filename, upload.message, upload.status,
+                             upload.file_size, upload.bytes_uploaded,
+                             upload.bytes_resumed))
+
+    concurrency = get_upload_concurrency()
+    for folder in folders:
+        # pylint: disable=no-member
+        asyncio.run(
+            upload_folder(folder, lookup_callback, upload_callback,
+                          progress, upload_method, concurrency)
+        )
+
+    return dict(
+        lookups=lookups,
+        uploads=uploads,
+        folders=[
+            ([local_file.uploaded for local_file in folder.local_files],
+             folder.num_cache_hits)
+            for folder in folders
+        ],
+        verified_datafiles_cache=settings.verified_datafiles_cache,
+        retry_stats=TRANSFER_RETRY_POLICY.stats.since(retry_counts).counts(),
+        instrumentation=INSTRUMENTATION.snapshot(),
+    )
+
+
+def upload_folders_in_processes(folders, num_processes, lookup_callback,
+                                upload_callback, progress=False,
+                                upload_method=None):
+    """
+    Upload folders in num_processes worker processes.
+
+    The results from each worker process are passed to the lookup_callback
+    and upload_callback functions in the parent process, and are used to
+    update the folders' upload counts, the verified datafiles cache and
+    the upload retry statistics, as if the uploads had run in this process.
+    """
+    # pylint: disable=too-many-arguments
+    shards = shard_folders(folders, num_processes)
+    settings_snapshot = SettingsSnapshot(settings)
+    # Worker processes are spawned rather than forked, because forking
+    # a process with running threads isn't safe:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+            max_workers=len(shards), mp_context=context) as executor:
+        futures = [
+            executor.submit(
+                upload_folders_in_worker,
+                [folders[folder_index] for folder_index in shard],
+                progress, upload_method, settings_snapshot)
+            for shard in shards
+        ]
+        for shard, future in zip(shards, futures):
+            merge_worker_results(
+                [folders[folder_index] for folder_index in shard],
+                future.result(), lookup_callback, upload_callback)
+
+
+def merge_worker_results(folders, results, lookup_callback, upload_callback):
+    """
+    Merge the results from one worker process into this process's folders,
+    verified datafiles cache, retry statistics and instrumentation, passing
+    each lookup and upload result to the callbacks
+    """
+    for folder, (uploaded, num_cache_hits) in zip(folders, results["folders"]):
+        for datafile_index, datafile_uploaded in enumerate(uploaded):
+            if datafile_uploaded:
+                folder.set_datafile_uploaded(datafile_index, True)
+        folder.num_cache_hits += num_cache_hits
+    for lookup in results["lookups"]:
+        lookup_callback(lookup)
+    for upload in results["uploads"]:
+        upload_callback(upload)
+    settings.verified_datafiles_cache.update(
+        results["verified_datafiles_cache"])
+    for counter, value in results["retry_stats"].items():
+        TRANSFER_RETRY_POLICY.stats.increment(counter, value)
+    INSTRUMENTATION.merge(results["instrumentation"])
@@ -6,27 +6,62 @@ import os
 import traceback
 import asyncio
 import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from http.client import responses
 import click
-import inflect
+import requests
+from tqdm import tqdm
 
 from ..models.dataset import Dataset
 from ..models.experiment import Experiment
 from ..models.lookup import LookupStatus
-from .lookups import FolderLookup
+from .lookups import FolderLookup, UPLOAD_LOOKUP_STATUSES
 from ..models.datafile import DataFile
 from ..models.upload import Upload, UploadStatus, UploadMethod
+from ..models.upload import STAGING_UPLOAD_METHODS
 from ..models.upload import add_uploader_info
 from ..conf import settings
+from ..events.stop import should_cancel_upload
 from ..utils.exceptions import StorageBoxAttributeNotFound, SshException
+from ..utils.exceptions import LocalCopyException
+from ..utils.exceptions import UserAborted
+from ..utils.retries import TransferRetryPolicy, FailureType
+from ..utils.concurrency import AdaptiveConcurrency
+from ..utils.instrumentation import INSTRUMENTATION
+from ..utils.localcopy import copy_file_local
+from ..utils.metrics import METRICS
 from ..utils.openssh import upload_with_scp
+from ..utils.resolution import RESOLUTION_CACHE
 from ..utils.upload import upload_file_ssh
 from ..logs import logger
 
+# Shared by all upload workers, so that backoff and circuit breakers
+# apply per staging host rather than per file:
+TRANSFER_RETRY_POLICY = TransferRetryPolicy(settings)
+METRICS.retry_stats = TRANSFER_RETRY_POLICY.stats
+
+
+def get_upload_concurrency():
+    """
+    Return an AdaptiveConcurrency instance for adjusting the number of
+    active upload workers, or None if the adaptive_upload_threads setting
+    isn't enabled.
+
+    One instance should be shared by all of the folders uploaded in a run
+    (or by "mydata daemon" and "mydata watch" sessions), so that the limit
+    isn't reset to min_upload_threads for each folder.
+    """
+    if not settings.miscellaneous.adaptive_upload_threads:
+        return None
+    return AdaptiveConcurrency(
+        settings.miscellaneous.min_upload_threads,
+        settings.advanced.max_upload_threads)
+
 
 async def upload_folder(folder, lookup_callback, upload_callback,
-                        progress=False, upload_method=UploadMethod.SCP):
+                        progress=False, upload_method=UploadMethod.SCP,
+                        concurrency=None):
     """
     Create required MyTardis records and upload
     any files not already uploaded.
@@ -42,91 +77,229 @@ async def upload_folder(folder, lookup_callback, upload_callback,
     upload_method (if specified) should be a value from the
     mydata.models.upload.UploadMethod enumerated data type.
     If not specified, the SCP upload method is used.
+
+    Files are looked up, hashed and uploaded in a pipeline, with a
+    separate thread pool for each stage, sized by the max_lookup_threads,
+    max_hash_threads and max_upload_threads settings, so that blocking
+    lookups and hashing don't hold up uploads.  The lookup and upload
+    callbacks are called from these threads.
+
+    If the adaptive_upload_threads setting is enabled, the number of
+    active upload workers is adjusted between min_upload_threads and
+    max_upload_threads, according to the measured throughput, by
+    concurrency (from get_upload_concurrency), or by a new instance for
+    this folder if concurrency isn't supplied.
     """
-    folder.experiment = Experiment.get_or_create_exp_for_folder(folder)
-    folder.dataset = Dataset.create_dataset_if_necessary(folder)
+    # pylint: disable=too-many-locals
+    folder.experiment = RESOLUTION_CACHE.get_or_resolve(
+        "experiment",
+        (folder.user_folder_name, folder.group_folder_name,
+         folder.experiment_title),
+        functools.partial(Experiment.get_or_create_exp_for_folder, folder))
+    folder.dataset = RESOLUTION_CACHE.get_or_resolve(
+        "dataset",
+        (folder.experiment.id if folder.experiment else None,
+         folder.get_rel_path()),
+        functools.partial(Dataset.create_dataset_if_necessary, folder))
+
+    if upload_method in STAGING_UPLOAD_METHODS:
+        RESOLUTION_CACHE.get_or_resolve(
+            "staging_access", settings.miscellaneous.uuid,
+            settings.uploader.request_staging_access)
 
-    if upload_method in (UploadMethod.SCP, UploadMethod.SFTP):
-        settings.uploader.request_staging_access()
+    num_threads = settings.advanced.max_upload_threads
+    num_hash_threads = max(1, settings.miscellaneous.max_hash_threads)
+    if concurrency is None:
+        concurrency = get_upload_concurrency()
 
-    def lookup_cb(lookup):
-        lookup_callback(lookup)
-        if lookup.status in (
-            LookupStatus.NOT_FOUND,
-            LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
-            LookupStatus.FOUND_UNVERIFIED_ON_STAGING,
-        ):
-            queue.put_nowait((folder, lookup, upload_callback,
-                              progress, upload_method))
+    loop = asyncio.get_running_loop()  # pylint: disable=no-member
 
-    num_threads = settings.advanced.max_upload_threads
+    def upload_cb(upload):
+        if concurrency:
+            concurrency.record_upload(upload)
+        upload_callback(upload)
 
-    # Create a queue
-    queue = asyncio.Queue()
+    def lookup_cb(lookup):
+        # Called from a lookup thread:
+        lookup_callback(lookup)
+        if lookup.status in UPLOAD_LOOKUP_STATUSES:
+            loop.call_soon_threadsafe(
+                hash_queue.put_nowait, (folder, lookup, upload_cb))
+
+    # Create queues
+    hash_queue = asyncio.Queue()
+    upload_queue = asyncio.Queue()
+    METRICS.track_queue("hash", hash_queue)
+    METRICS.track_queue("upload", upload_queue)
+
+    executors = dict(
+        lookup=ThreadPoolExecutor(
+            max_workers=max(1, settings.miscellaneous.max_lookup_threads),
+            thread_name_prefix="lookup"),
+        hash=ThreadPoolExecutor(
+            max_workers=num_hash_threads, thread_name_prefix="hash"),
+        upload=ThreadPoolExecutor(
+            max_workers=num_threads, thread_name_prefix="upload"),
+    )
 
     # Create workers
     workers = []
+    for _ in range(num_hash_threads):
+        # pylint: disable=no-member
+        workers.append(
+            asyncio.create_task(
+                hash_file_worker(hash_queue, upload_queue, executors["hash"])
+            )
+        )
     for i in range(num_threads):
         # pylint: disable=no-member
         workers.append(
             asyncio.create_task(
-                upload_file_worker(f"worker-{i}", queue)
+                upload_file_worker(
+                    f"worker-{i}", upload_queue, executors["upload"],
+                    progress, upload_method, concurrency)
             )
         )
 
-    # Start lookup and upload
-    FolderLookup(folder, lookup_cb, upload_method).lookup_datafiles()
-
-    if num_threads > 1:
-        click.echo("\n\nUploading in %s %s..." % (
-            num_threads,
-            inflect.engine().plural("thread", num_threads)))
-
-    # Wait for queue to complete
-    await queue.join()
-
-    # Shutdown workers
-    for worker in workers:
-        worker.cancel()
-
-    # Wait for workers shutdown
-    await asyncio.gather(*workers, return_exceptions=True)
-
-
-def run_in_executor(func):
+    try:
+        # Start lookups, which will start hashing and uploads
+        await FolderLookup(
+            folder, lookup_cb, upload_method
+        ).lookup_datafiles_concurrently(executors["lookup"])
+
+        if concurrency and num_threads > concurrency.min_workers:
+            click.echo("\n\nUploading in %s to %s threads..." % (
+                concurrency.min_workers, num_threads))
+        elif num_threads > 1:
+            import inflect  # slow to import, so only imported when needed
+            click.echo("\n\nUploading in %s %s..." % (
+                num_threads,
+                inflect.engine().plural("thread", num_threads)))
+
+        # Wait for queues to complete
+        await hash_queue.join()
+        await upload_queue.join()
+    finally:
+        # Shutdown workers
+        for worker in workers:
+            worker.cancel()
+
+        # Wait for workers shutdown
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+
+        METRICS.track_queue("hash", None)
+        METRICS.track_queue("upload", None)
+
+
+async def hash_file_worker(hash_queue, upload_queue, executor):
     """
-    Run function in async wrapper
+    File hashing worker, preparing files for the upload workers
     """
-    @functools.wraps(func)
-    def runner(*args, **kwargs):
-        # pylint: disable=no-member
-        loop = asyncio.get_running_loop()
-        return loop.run_in_executor(None, lambda: func(*args, **kwargs))
-    return runner
-
-
-async def upload_file_worker(name, queue):
+    loop = asyncio.get_running_loop()  # pylint: disable=no-member
+    while True:
+        folder, lookup, upload_callback = await hash_queue.get()
+        try:
+            with METRICS.in_flight("hash"):
+                prepared = await loop.run_in_executor(
+                    executor, prepare_upload, folder, lookup, upload_callback)
+            if prepared:
+                upload, datafile_dict = prepared
+                upload_queue.put_nowait(
+                    (folder, lookup, upload, datafile_dict, upload_callback))
+        except Exception as err:  # pylint: disable=broad-except
+            fail_upload_after_error(folder, lookup, None, err, upload_callback)
+        finally:
+            hash_queue.task_done()
+
+
+async def upload_file_worker(name, queue, executor, progress=False,
+                             upload_method=UploadMethod.SCP, concurrency=None):
     """
     File upload worker
+
+    If concurrency (an AdaptiveConcurrency instance) is supplied, the
+    worker waits while it isn't one of the allowed active workers.
     """
     thread_num = int(name.split("-")[-1])
+    loop = asyncio.get_running_loop()  # pylint: disable=no-member
     while True:
-        (folder, lookup, upload_callback,
-         progress, upload_method) = await queue.get()
-        await upload_file(folder, lookup, upload_callback,
-                          progress, thread_num, upload_method)
-        queue.task_done()
+        while concurrency and not concurrency.is_active(thread_num):
+            await asyncio.sleep(0.1)
+        item = await queue.get()
+        if concurrency and not concurrency.is_active(thread_num):
+            # The limit was lowered while this worker was waiting for
+            # a file, so leave the file for an active worker:
+            queue.put_nowait(item)
+            queue.task_done()
+            continue
+        folder, lookup, upload, datafile_dict, upload_callback = item
+        try:
+            with METRICS.in_flight("upload"):
+                await loop.run_in_executor(
+                    executor,
+                    functools.partial(
+                        transfer_file, folder, lookup, upload, datafile_dict,
+                        upload_callback, progress, thread_num, upload_method))
+        except Exception as err:  # pylint: disable=broad-except
+            fail_upload_after_error(
+                folder, lookup, upload, err, upload_callback)
+        finally:
+            queue.task_done()
+
+
+def fail_upload_after_error(folder, lookup, upload, err, upload_callback):
+    """
+    Mark an upload as failed after an unexpected error in a hashing or
+    upload worker, and call upload_callback, so that it is counted like
+    any other failed upload.  If the error was raised before the Upload
+    instance was returned by prepare_upload, upload is None, and a new one
+    is created.  Nothing is done if the upload had already been finalized,
+    e.g. if the error was raised by upload_callback.
+    """
+    error_traceback = traceback.format_exc()
+    logger.error(error_traceback)
+    try:
+        if upload is None:
+            upload = Upload(folder, lookup.datafile_index)
+        elif upload.status not in (
+                UploadStatus.NOT_STARTED, UploadStatus.IN_PROGRESS):
+            return
+        upload.traceback = error_traceback
+        finalize_upload(
+            folder,
+            upload,
+            success=False,
+            message="Upload failed: %s" % str(err),
+            upload_callback=upload_callback,
+        )
+    except Exception:  # pylint: disable=broad-except
+        logger.error(traceback.format_exc())
 
 
-@run_in_executor
 def upload_file(folder, lookup, upload_callback,
                 progress=False, thread_num=0,
                 upload_method=UploadMethod.SCP):
     """
     Upload file
     """
-    # pylint: disable=too-many-locals
+    prepared = prepare_upload(folder, lookup, upload_callback)
+    if prepared:
+        upload, datafile_dict = prepared
+        transfer_file(folder, lookup, upload, datafile_dict, upload_callback,
+                      progress, thread_num, upload_method)
 
+
+def prepare_upload(folder, lookup, upload_callback):
+    """
+    Check whether a file can be uploaded, and if so, define the JSON
+    data for its DataFile record, including its MD5 checksum
+
+    Returns an (upload, datafile_dict) tuple, or None if the file
+    won't be uploaded, in which case upload_callback has been called.
+    """
     upload = Upload(folder, lookup.datafile_index)
 
     datafile_path = folder.get_datafile_path(upload.datafile_index)
@@ -135,31 +308,31 @@ def upload_file(folder, lookup, upload_callback,
             check_if_file_is_too_new(folder, upload) or \
             check_if_file_is_symlink(folder, upload):
         upload_callback(upload)
-        return
+        return None
 
     upload.message = "Defining JSON data for POST..."
     datafile_dict = construct_datafile_post_body(folder, upload)
+    return upload, datafile_dict
+
+
+def transfer_file(folder, lookup, upload, datafile_dict, upload_callback,
+                  progress=False, thread_num=0,
+                  upload_method=UploadMethod.SCP):
+    """
+    Transfer file, after prepare_upload
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    datafile_path = folder.get_datafile_path(upload.datafile_index)
+    upload.transfer_started = True
 
     if upload_method == UploadMethod.MULTIPART_POST:
-        response = DataFile.upload_datafile_with_post(
-            datafile_path, datafile_dict, upload
-        )
-        message = None
-        if not response.ok:
-            message = "Upload failed with HTTP %s - %s" % (
-                response.status_code,
-                responses[response.status_code],
-            )
-        finalize_upload(
-            folder,
-            upload,
-            success=response.ok,
-            message=message,
-            upload_callback=upload_callback,
-        )
+        with INSTRUMENTATION.timer("upload_via_post", upload.file_size) as timer:
+            upload_via_post(folder, datafile_path, datafile_dict, upload,
+                            upload_callback, progress, thread_num)
+            timer.error = upload.status != UploadStatus.COMPLETED
         return
 
-    if upload_method == UploadMethod.SCP:
+    if upload_method in (UploadMethod.SCP, UploadMethod.LOCAL_COPY):
         datafile_dict = add_uploader_info(datafile_dict)
         df_post_response = None
         if not lookup.existing_unverified_datafile:
@@ -184,18 +357,31 @@ def upload_file(folder, lookup, upload_callback,
         upload.datafile_id = get_datafile_id(lookup, df_post_response)
 
         try:
-            upload_via_scp_with_retries(
-                datafile_path,
-                username,
-                host,
-                port,
-                remote_file_path,
-                upload,
-                upload_callback,
-                progress,
-                thread_num
-            )
-        except SshException as err:
+            if upload_method == UploadMethod.LOCAL_COPY:
+                copy_to_staging_with_retries(
+                    datafile_path,
+                    location,
+                    remote_file_path,
+                    datafile_dict["md5sum"],
+                    upload,
+                    progress,
+                    thread_num
+                )
+            else:
+                upload_via_scp_with_retries(
+                    datafile_path,
+                    username,
+                    host,
+                    port,
+                    remote_file_path,
+                    upload,
+                    upload_callback,
+                    progress,
+                    thread_num,
+                    resume=(lookup.status ==
+                            LookupStatus.FOUND_UNVERIFIED_ON_STAGING)
+                )
+        except (SshException, LocalCopyException) as err:
             logger.error(traceback.format_exc())
             finalize_upload(
                 folder,
@@ -225,7 +411,56 @@ def upload_file(folder, lookup, upload_callback,
             )
         return
 
-    raise NotImplementedError("upload_file received unimplemented upload method")
+    raise NotImplementedError("transfer_file received unimplemented upload method")
+
+
+def upload_via_post(folder, datafile_path, datafile_dict, upload,
+                    upload_callback, progress=False, thread_num=0):
+    """
+    Upload file via multipart POST to the MyTardis API
+    """
+    progress_bar = None
+    if progress:
+        progress_bar = tqdm(
+            position=thread_num,
+            total=upload.file_size,
+            desc=upload.get_relative_path_to_upload(),
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024
+        )
+    try:
+        response = DataFile.upload_datafile_with_post(
+            datafile_path, datafile_dict, upload,
+            progress_bar.update if progress_bar else None
+        )
+    except (requests.exceptions.RequestException, UserAborted,
+            OSError, ValueError) as err:
+        logger.error(traceback.format_exc())
+        finalize_upload(
+            folder,
+            upload,
+            success=False,
+            message="Upload failed: %s" % str(err),
+            upload_callback=upload_callback,
+        )
+        return
+    finally:
+        if progress_bar:
+            progress_bar.close()
+    message = None
+    if not response.ok:
+        message = "Upload failed with HTTP %s - %s" % (
+            response.status_code,
+            responses[response.status_code],
+        )
+    finalize_upload(
+        folder,
+        upload,
+        success=response.ok,
+        message=message,
+        upload_callback=upload_callback,
+    )
 
 
 def finalize_upload(folder, upload, success, message=None, upload_callback=None):
@@ -259,7 +494,9 @@ def construct_datafile_post_body(folder, upload):
     upload.file_size = folder.get_datafile_size(upload.datafile_index)
 
     upload.message = "Calculating MD5 checksum..."
-    md5sum = folder.calculate_md5_sum(upload.datafile_index, canceled_cb=None)
+    with INSTRUMENTATION.timer("calculate_md5_sum", upload.file_size):
+        md5sum = folder.calculate_md5_sum(
+            upload.datafile_index, canceled_cb=None)
 
     upload.message = "Checking MIME type..."
     mime_type = mimetypes.guess_type(datafile_path)[0]
@@ -283,7 +520,7 @@ def construct_datafile_post_body(folder, upload):
 
 def get_sbox_attrs(upload):
     """Get the relevant StorageBoxAttributes and StorageBoxOptions
-    for SCP uploads
+    for uploads via staging
     """
     upload_to_staging_request = settings.uploader.upload_to_staging_request
     try:
@@ -314,41 +551,122 @@ def check_if_all_bytes_uploaded(upload):
 
 def upload_via_scp_with_retries(
     datafile_path, username, host, port, remote_file_path, upload,
-    upload_callback, progress, thread_num  # pylint: disable=unused-argument
+    upload_callback, progress, thread_num,  # pylint: disable=unused-argument
+    resume=False
 ):
     """
     Upload via SCP with retries
+
+    Transient failures (e.g. timeouts) are retried after an exponential
+    backoff delay with jitter, up to max_upload_retries times.  Permanent
+    failures (e.g. permission denied) are not retried.
+
+    With the SSH2 upload method, a partial upload found on staging is
+    resumed if resume is True (e.g. for a file with an unverified DataFile
+    record on staging), or when retrying a failed attempt.
     """
+    host_key = "%s:%s" % (host, port)
+
+    def canceled_cb():
+        return should_cancel_upload(upload)
+
     while True:
         # Upload retries loop:
+        TRANSFER_RETRY_POLICY.wait_for_circuit(host_key, canceled_cb)
         try:
             if settings.advanced.upload_method == "SSH2":
-                upload_file_ssh(
-                    (host, int(port)),
-                    [username, settings.uploader.ssh_key_pair.private_key_path],
+                with INSTRUMENTATION.timer("upload_file_ssh", upload.file_size):
+                    upload_file_ssh(
+                        (host, int(port)),
+                        [username,
+                         settings.uploader.ssh_key_pair.private_key_path],
+                        datafile_path,
+                        remote_file_path,
+                        upload,
+                        progress,
+                        thread_num,
+                        resume or upload.retries > 0)
+            else:
+                with INSTRUMENTATION.timer("upload_with_scp", upload.file_size):
+                    upload_with_scp(
+                        datafile_path,
+                        username,
+                        settings.uploader.ssh_key_pair.private_key_path,
+                        host,
+                        port,
+                        remote_file_path,
+                        upload)
+            TRANSFER_RETRY_POLICY.record_success(host_key)
+            # Break out of upload retries loop.
+            break
+        except SshException as err:
+            # includes the ScpException subclass
+            upload.traceback = traceback.format_exc()
+            failure_type = TRANSFER_RETRY_POLICY.record_failure(host_key, err)
+            if failure_type == FailureType.PERMANENT:
+                logger.warning(
+                    "Not retrying upload for %s after permanent failure: %s"
+                    % (datafile_path, str(err)))
+                raise
+            if upload.retries < settings.advanced.max_upload_retries \
+                    and not canceled_cb():
+                logger.warning(str(err))
+                upload.retries += 1
+                TRANSFER_RETRY_POLICY.wait_before_retry(
+                    host_key, upload.retries, canceled_cb)
+                logger.debug("Retrying upload for " + datafile_path)
+                continue
+            raise
+
+
+def copy_to_staging_with_retries(
+    datafile_path, location, remote_file_path, md5sum, upload, progress,
+    thread_num
+):
+    """
+    Copy to the locally mounted staging area with retries
+
+    Transient failures (e.g. a stale NFS file handle) are retried in the
+    same way as SCP uploads, with one circuit breaker for the storage box
+    location.
+    """
+    # pylint: disable=too-many-arguments
+    host_key = "local:%s" % location
+
+    def canceled_cb():
+        return should_cancel_upload(upload)
+
+    while True:
+        # Copy retries loop:
+        TRANSFER_RETRY_POLICY.wait_for_circuit(host_key, canceled_cb)
+        try:
+            with INSTRUMENTATION.timer("copy_file_local", upload.file_size):
+                copy_file_local(
                     datafile_path,
+                    location,
                     remote_file_path,
+                    md5sum,
                     upload,
                     progress,
                     thread_num)
-            else:
-                upload_with_scp(
-                    datafile_path,
-                    username,
-                    settings.uploader.ssh_key_pair.private_key_path,
-                    host,
-                    port,
-                    remote_file_path,
-                    upload)
-            # Break out of upload retries loop.
+            TRANSFER_RETRY_POLICY.record_success(host_key)
+            # Break out of copy retries loop.
             break
-        except SshException as err:
-            # includes the ScpException subclass
+        except LocalCopyException as err:
             upload.traceback = traceback.format_exc()
-            if upload.retries < settings.advanced.max_upload_retries:
+            failure_type = TRANSFER_RETRY_POLICY.record_failure(host_key, err)
+            if failure_type == FailureType.PERMANENT:
+                logger.warning(
+                    "Not retrying copy for %s after permanent failure: %s"
+                    % (datafile_path, str(err)))
+                raise
+            if upload.retries < settings.advanced.max_upload_retries \
+                    and not canceled_cb():
                 logger.warning(str(err))
                 upload.retries += 1
-                logger.debug("Restarting upload for " + datafile_path)
+                TRANSFER_RETRY_POLICY.wait_before_retry(
+                    host_key, upload.retries, canceled_cb)
+                logger.debug("Retrying copy for " + datafile_path)
                 continue
             raise
 
@@ -385,7 +703,7 @@ def check_if_file_is_symlink(folder, upload):
     """
     Check if we ignore symlinks and the file is a symlink
     """
-    if settings.filters.ignore_symlinks:
+    if folder.settings_snapshot.ignore_symlinks:
         absolute_file_path = folder.get_datafile_path(upload.datafile_index)
         if os.path.islink(absolute_file_path):
             upload.message = "Not uploading file, ignoring symlinks."
@@ -0,0 +1,288 @@
+"""
+mydata/tasks/watch.py
+
+Watch the data directory for new and modified files, uploading them
+in small batches as they appear, rather than rescanning the whole
+data directory as "mydata upload" does.
+
+Each changed file is mapped to the dataset folder containing it,
+using the dataset folders found by an initial scan of the data
+directory.  Files which aren't within any known dataset folder
+(e.g. in a newly created dataset folder) trigger a rescan.
+"""
+import asyncio
+import copy
+import os
+import time
+
+from ..conf import settings
+from ..logs import logger
+from ..models.lookup import LookupStatus
+from ..models.upload import UploadStatus
+from ..threads.flags import FLAGS
+from ..utils.fswatch import get_watcher
+from ..utils.resolution import RESOLUTION_CACHE
+from ..utils.sessions import API_SESSION_POOL
+from ..utils.upload import SSH_SESSION_POOL
+from .folders import scan_folders
+from .uploads import upload_folder, get_upload_concurrency
+
+# How long to wait after a file's last modification before uploading
+# it, if the ignore_new_files filter isn't enabled:
+DEFAULT_SETTLE_SECONDS = 5.0
+
+# How long to wait before trying again to upload a file whose lookup or
+# upload failed (in addition to the quiet period):
+FAILED_RETRY_SECONDS = 60.0
+
+
+def get_quiet_period():
+    """
+    Return how many seconds a file must remain unmodified before it can be
+    uploaded.  This is at least ignore_new_files_minutes (if enabled), so
+    that watched files aren't skipped for being too new to upload.
+    """
+    quiet_period = DEFAULT_SETTLE_SECONDS
+    if settings.filters.ignore_new_files:
+        quiet_period = max(
+            quiet_period, settings.filters.ignore_new_files_minutes * 60)
+    return quiet_period
+
+
+class DatasetFolderMap:
+    """
+    Maps file paths to the dataset folders containing them
+    """
+
+    def __init__(self, folders=()):
+        self.dataset_folders = dict()
+        self.exp_files_folders = dict()
+        for folder in folders:
+            self.add(folder)
+
+    def add(self, folder):
+        """
+        Add a folder found by scan_folders
+        """
+        path = os.path.normpath(folder.get_absolute_path())
+        if folder.is_exp_files_folder:
+            self.exp_files_folders[path] = folder
+        else:
+            self.dataset_folders[path] = folder
+
+    def folders(self):
+        """
+        Return all of the folders
+        """
+        return list(self.dataset_folders.values()) + list(
+            self.exp_files_folders.values())
+
+    def find(self, filepath):
+        """
+        Return the folder containing filepath, or None
+        """
+        dirname = os.path.dirname(os.path.normpath(filepath))
+        # Experiment files folders only contain the files in the
+        # top level of an experiment folder:
+        if dirname in self.exp_files_folders:
+            return self.exp_files_folders[dirname]
+        while dirname not in self.dataset_folders:
+            parent = os.path.dirname(dirname)
+            if parent == dirname:
+                return None
+            dirname = parent
+        return self.dataset_folders[dirname]
+
+
+def scan_dataset_folders():
+    """
+    Scan the data directory, returning a DatasetFolderMap
+    """
+    folder_map = DatasetFolderMap()
+    scan_folders(lambda user: None, lambda group: None,
+                 lambda exp_folder_name: None, folder_map.add)
+    return folder_map
+
+
+class PendingFiles:
+    """
+    Files which have changed, waiting until they haven't been modified
+    for quiet_period seconds, so that partially written files aren't
+    uploaded
+    """
+
+    def __init__(self, quiet_period):
+        self.quiet_period = quiet_period
+        self.last_changed = dict()
+
+    def __len__(self):
+        return len(self.last_changed)
+
+    def add(self, paths, now=None):
+        """
+        Record that files have changed (at now, which can be in the
+        future, to delay uploading them)
+        """
+        now = now or time.time()
+        for path in paths:
+            self.last_changed[path] = now
+
+    def pop_ready(self, now=None):
+        """
+        Remove and return the paths of files which haven't changed
+        for quiet_period seconds.  Files which no longer exist are
+        discarded.
+        """
+        now = now or time.time()
+        ready = []
+        for path, last_changed in list(self.last_changed.items()):
+            try:
+                last_changed = max(last_changed, os.path.getmtime(path))
+            except OSError:
+                del self.last_changed[path]
+                continue
+            if now - last_changed >= self.quiet_period:
+                ready.append(path)
+                del self.last_changed[path]
+        return ready
+
+
+def get_batches(folder_map, paths, rescan_callback):
+    """
+    Group paths by the dataset folders containing them, returning a list
+    of folders whose local files are just the changed files.
+
+    If any paths aren't within a known dataset folder, rescan_callback is
+    called to return an updated DatasetFolderMap (at most once).
+
+    Returns the (possibly updated) folder map and the list of folders.
+    """
+    paths_by_folder = dict()
+    unknown_paths = []
+    for path in paths:
+        folder = folder_map.find(path)
+        if folder:
+            paths_by_folder.setdefault(id(folder), (folder, []))[1].append(path)
+        else:
+            unknown_paths.append(path)
+    if unknown_paths:
+        folder_map = rescan_callback()
+        for path in unknown_paths:
+            folder = folder_map.find(path)
+            if folder:
+                paths_by_folder.setdefault(
+                    id(folder), (folder, []))[1].append(path)
+            else:
+                logger.debug("Ignoring %s, not in a dataset folder." % path)
+
+    batches = []
+    for folder, folder_paths in paths_by_folder.values():
+        batch = copy.copy(folder)
+        batch.data_view_fields = dict(folder.data_view_fields)
+        batch.set_local_files(folder_paths)
+        if batch.num_files:
+            batches.append(batch)
+    return folder_map, batches
+
+
+def record_failures(callback, folder, failed_status, failed_paths):
+    """
+    Wrap a lookup or upload callback for a batch of files from folder,
+    appending the path of each file whose lookup or upload has the
+    failed_status to failed_paths
+    """
+
+    def record(lookup_or_upload):
+        if lookup_or_upload.status == failed_status:
+            failed_paths.append(
+                folder.get_datafile_path(lookup_or_upload.datafile_index))
+        callback(lookup_or_upload)
+
+    return record
+
+
+def watch_data_directory(folders, lookup_callback, upload_callback,
+                         batch_callback=None, progress=False,
+                         upload_method=None, polling=False,
+                         poll_interval=10.0, should_stop=None,
+                         watcher=None, concurrency=None):
+    """
+    Watch the data directory, uploading new and modified files within the
+    dataset folders (initially those in folders, from a previous scan),
+    until FLAGS.should_abort is set or should_stop() returns True.
+
+    The lookup_callback and upload_callback functions are passed to
+    upload_folder, and batch_callback (if specified) is called with each
+    folder after its batch of changed files has been uploaded.
+
+    inotify is used to watch the data directory on Linux, unless polling
+    is True, in which case the data directory is polled every
+    poll_interval seconds.  A watcher from get_watcher can be supplied
+    instead (and closed by the caller), e.g. one created before folders
+    were scanned, so that files created during the scan (and any initial
+    upload) aren't missed.
+
+    Files whose lookups or uploads fail are tried again after
+    FAILED_RETRY_SECONDS, even if they aren't modified again.
+
+    One AdaptiveConcurrency instance (concurrency, or one from
+    get_upload_concurrency) is used for every batch, so that the number
+    of active upload threads isn't reset for each batch.
+
+    MyTardis records resolved for each folder and SSH sessions are kept
+    for later batches, as in "mydata daemon".
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    folder_map = DatasetFolderMap(folders)
+    pending = PendingFiles(get_quiet_period())
+    if concurrency is None:
+        concurrency = get_upload_concurrency()
+    own_watcher = watcher is None
+    if own_watcher:
+        watcher = get_watcher(
+            settings.general.data_directory, polling, poll_interval)
+
+    RESOLUTION_CACHE.enabled = True
+    SSH_SESSION_POOL.enabled = True
+
+    def rescan():
+        logger.debug("Rescanning %s" % settings.general.data_directory)
+        return scan_dataset_folders()
+
+    try:
+        while not FLAGS.should_abort and not (should_stop and should_stop()):
+            events = watcher.read_events(timeout=1.0)
+            pending.add(events.paths)
+            if events.rescan:
+                # Some events were missed, so look up every file again:
+                folder_map = rescan()
+                pending.add(
+                    local_file.filepath
+                    for folder in folder_map.folders()
+                    for local_file in folder.local_files)
+            ready = pending.pop_ready()
+            if not ready:
+                continue
+            folder_map, batches = get_batches(folder_map, ready, rescan)
+            for batch in batches:
+                failed_paths = []
+                # pylint: disable=no-member
+                asyncio.run(
+                    upload_folder(
+                        batch,
+                        record_failures(lookup_callback, batch,
+                                        LookupStatus.FAILED, failed_paths),
+                        record_failures(upload_callback, batch,
+                                        UploadStatus.FAILED, failed_paths),
+                        progress, upload_method, concurrency))
+                pending.add(
+                    failed_paths, now=time.time() + FAILED_RETRY_SECONDS)
+                if settings.miscellaneous.cache_datafile_lookups:
+                    settings.save_verified_datafiles_cache()
+                if batch_callback:
+                    batch_callback(batch)
+    finally:
+        if own_watcher:
+            watcher.close()
+        API_SESSION_POOL.close()
+        SSH_SESSION_POOL.close()
@@ -9,6 +9,7 @@ LOCK_NAMES = [
     "request_staging_access",
     "update_cache",
     "close_cache",
+    "update_counts",
 ]
 
 
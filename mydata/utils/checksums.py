@@ -0,0 +1,195 @@
+"""
+Calculate file checksums in-process, using large sequential reads, and
+cache them persistently, so that unchanged files aren't hashed again.
+
+hashlib releases the GIL while hashing large buffers, so checksums can be
+calculated concurrently in a thread pool.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+
+# Read files in large chunks which are a multiple of the page size:
+READ_SIZE = 8 * 1024 * 1024
+
+# How many new checksums to cache before committing them:
+COMMIT_INTERVAL = 1000
+
+# Each hashing thread reuses its own read buffer:
+THREAD_LOCAL = threading.local()
+
+
+def advise(file_descriptor, advice_name):
+    """
+    Give the kernel a hint about how a file will be read, if posix_fadvise
+    is available, e.g. "POSIX_FADV_SEQUENTIAL" to increase read-ahead
+    """
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(file_descriptor, 0, 0, getattr(os, advice_name))
+        except OSError:
+            pass
+
+
+def get_read_buffer():
+    """
+    Get this thread's read buffer, creating it if necessary, so that a
+    new buffer isn't allocated for each (possibly small) file
+    """
+    buffer = getattr(THREAD_LOCAL, "buffer", None)
+    if buffer is None:
+        buffer = bytearray(READ_SIZE)
+        THREAD_LOCAL.buffer = buffer
+    return buffer
+
+
+def calculate_checksums(filepath, algorithms=("md5",)):
+    """
+    Return a dictionary mapping each hashlib algorithm name to the file's
+    hex digest, reading the file once
+    """
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    buffer = get_read_buffer()
+    view = memoryview(buffer)
+    with open(filepath, "rb", buffering=0) as file_object:
+        advise(file_object.fileno(), "POSIX_FADV_SEQUENTIAL")
+        while True:
+            num_bytes = file_object.readinto(buffer)
+            if not num_bytes:
+                break
+            for hash_object in hashes:
+                hash_object.update(view[:num_bytes])
+        # The file won't be read again soon, so don't let it
+        # push more useful data out of the page cache:
+        advise(file_object.fileno(), "POSIX_FADV_DONTNEED")
+    return dict(
+        (algorithm, hash_object.hexdigest())
+        for algorithm, hash_object in zip(algorithms, hashes))
+
+
+def is_unchanged(path, size, mtime_ns):
+    """
+    Return True if the file exists with the given size and modification time
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == size and stat.st_mtime_ns == mtime_ns
+
+
+class ChecksumCache:
+    """
+    A persistent (SQLite) cache of checksums, keyed by each file's path,
+    size and modification time, so that a file's cached checksums are
+    ignored once it has been modified
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.num_uncommitted = 0
+        with self.lock:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS checksums ("
+                "path TEXT, algorithm TEXT, size INTEGER, mtime_ns INTEGER, "
+                "digest TEXT, PRIMARY KEY (path, algorithm))")
+            self.connection.commit()
+
+    def get(self, path, stat, algorithm):
+        """
+        Return the cached digest for the file, or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT digest FROM checksums WHERE path = ? AND algorithm = ? "
+                "AND size = ? AND mtime_ns = ?",
+                (path, algorithm, stat.st_size, stat.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def put(self, path, stat, digests):
+        """
+        Cache a file's digests (a dictionary keyed by algorithm name)
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)",
+                [(path, algorithm, stat.st_size, stat.st_mtime_ns, digest)
+                 for algorithm, digest in digests.items()])
+            self.num_uncommitted += 1
+            if self.num_uncommitted >= COMMIT_INTERVAL:
+                self.connection.commit()
+                self.num_uncommitted = 0
+
+    def duplicates(self, algorithm, directory):
+        """
+        Return lists of paths of cached files in directory (or its
+        subdirectories) with the same size and digest, ignoring files which
+        have been modified or removed since they were cached
+        """
+        prefix = os.path.join(os.path.abspath(directory), "")
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT size, digest, path, mtime_ns FROM checksums "
+                "WHERE algorithm = ? AND substr(path, 1, ?) = ? "
+                "ORDER BY size, digest, path",
+                (algorithm, len(prefix), prefix)).fetchall()
+        groups = dict()
+        for size, digest, path, mtime_ns in rows:
+            groups.setdefault((size, digest), []).append((path, mtime_ns))
+        duplicates = []
+        for (size, _), files in groups.items():
+            if len(files) > 1:
+                paths = [
+                    path for path, mtime_ns in files
+                    if is_unchanged(path, size, mtime_ns)]
+                if len(paths) > 1:
+                    duplicates.append(paths)
+        return duplicates
+
+    def close(self):
+        """
+        Commit any new checksums and close the cache
+        """
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class ChecksumService:
+    """
+    Calculates checksums for the requested algorithms (MD5 first), using
+    cached checksums for files which haven't changed since they were cached
+    """
+
+    def __init__(self, cache=None, algorithms=("md5",)):
+        self.cache = cache
+        self.algorithms = tuple(algorithms)
+
+    def checksums(self, filepath):
+        """
+        Return a dictionary mapping each algorithm name to the file's
+        hex digest
+        """
+        path = os.path.abspath(filepath)
+        if not self.cache:
+            return calculate_checksums(path, self.algorithms)
+        stat = os.stat(path)
+        digests = dict(
+            (algorithm, self.cache.get(path, stat, algorithm))
+            for algorithm in self.algorithms)
+        if all(digests.values()):
+            return digests
+        digests = calculate_checksums(path, self.algorithms)
+        self.cache.put(path, stat, digests)
+        return digests
+
+    def md5sum(self, filepath):
+        """
+        Return the file's MD5 sum
+        """
+        return self.checksums(filepath)["md5"]
@@ -0,0 +1,119 @@
+"""
+Adaptive control of the number of active upload workers
+"""
+import threading
+import time
+
+from ..models.upload import UploadStatus
+
+
+class AdaptiveConcurrency:
+    """
+    Adjusts the number of active upload workers AIMD-style (additive
+    increase, multiplicative decrease), to find the concurrency which
+    maximizes throughput for the current network link and disk.
+
+    Completed uploads are recorded as they finish (from the upload
+    threads).  After each adjustment interval, the aggregate throughput
+    for the interval is compared with the previous interval's:
+
+    - If throughput improved, one more worker is allowed.
+    - If throughput dropped, or the mean time taken per file rose
+      while throughput didn't improve, or any transfers failed, the
+      number of workers is halved.  Files which weren't transferred
+      (e.g. because they were still being written) don't count as
+      failures.
+    - Otherwise, the number of workers is left as it is.
+
+    Upload workers whose number is greater than or equal to the
+    current limit wait instead of taking files from the queue, and a
+    worker which takes a file after the limit is lowered puts it back.
+    One instance can be shared by successive folders, so that the limit
+    carries over from one folder to the next.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, min_workers, max_workers, interval=5.0,
+                 tolerance=0.05):
+        self.min_workers = max(1, min(min_workers, max_workers))
+        self.max_workers = max_workers
+        self.interval = interval
+        self.tolerance = tolerance
+        self.limit = self.min_workers
+        self.lock = threading.Lock()
+
+        self.interval_start = time.time()
+        self.interval_bytes = 0
+        self.interval_seconds = 0.0
+        self.interval_files = 0
+        self.interval_failures = 0
+        self.previous_throughput = None
+        self.previous_latency = None
+
+    def is_active(self, worker_num):
+        """
+        Return True if the worker numbered worker_num (from 0) may
+        take another file from the queue
+        """
+        return worker_num < self.limit
+
+    def record_upload(self, upload):
+        """
+        Record a finished upload (an instance of
+        mydata.models.upload.Upload), adjusting the limit if the
+        interval has elapsed
+        """
+        with self.lock:
+            if upload.status == UploadStatus.FAILED:
+                if upload.transfer_started:
+                    self.interval_failures += 1
+            elif upload.status == UploadStatus.COMPLETED and \
+                    upload.start_time and upload.latest_time:
+                self.interval_bytes += \
+                    upload.bytes_uploaded - upload.bytes_resumed
+                self.interval_seconds += \
+                    (upload.latest_time - upload.start_time).total_seconds()
+                self.interval_files += 1
+            now = time.time()
+            if now - self.interval_start >= self.interval:
+                self.adjust(now)
+
+    def adjust(self, now):
+        """
+        Adjust the limit at the end of an interval.  Called with the
+        lock held.
+        """
+        elapsed = now - self.interval_start
+        if self.interval_failures:
+            self.decrease()
+        elif self.interval_files:
+            throughput = self.interval_bytes / elapsed
+            latency = self.interval_seconds / self.interval_files
+            if self.previous_throughput is None or \
+                    throughput > self.previous_throughput * (1 + self.tolerance):
+                self.increase()
+            elif throughput < self.previous_throughput * (1 - self.tolerance):
+                self.decrease()
+            elif latency > self.previous_latency * (1 + self.tolerance):
+                self.decrease()
+            self.previous_throughput = throughput
+            self.previous_latency = latency
+
+        self.interval_start = now
+        self.interval_bytes = 0
+        self.interval_seconds = 0.0
+        self.interval_files = 0
+        self.interval_failures = 0
+
+    def increase(self):
+        """
+        Allow one more worker
+        """
+        self.limit = min(self.max_workers, self.limit + 1)
+
+    def decrease(self):
+        """
+        Halve the number of workers allowed
+        """
+        self.limit = max(self.min_workers, self.limit // 2)
@@ -36,6 +36,12 @@ class ScpException(SshException):
         self.returncode = returncode
 
 
+class LocalCopyException(Exception):
+    """
+    Exception raised when copying a file to a locally mounted staging area.
+    """
+
+
 class NoActiveNetworkInterface(Exception):
     """
     No active network interface exception.
@@ -0,0 +1,225 @@
+"""
+Watch a directory tree for new and modified files, using inotify
+on Linux, or by polling on other platforms (or if inotify fails).
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import namedtuple
+
+from ..logs import logger
+
+# Paths of new or modified files, and whether the watcher may have
+# missed events (e.g. after an inotify queue overflow), in which case
+# the whole tree should be rescanned:
+WatchEvents = namedtuple("WatchEvents", ["paths", "rescan"])
+
+# inotify event masks, from <sys/inotify.h>:
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def files_in_tree(root):
+    """
+    Return the paths of all files within root
+    """
+    paths = []
+    for dirname, _, files in os.walk(root):
+        paths.extend(os.path.join(dirname, filename) for filename in files)
+    return paths
+
+
+class InotifyWatcher:
+    """
+    Watches a directory tree using Linux's inotify API (via ctypes).
+
+    inotify watches aren't recursive, so a watch is added for each
+    directory in the tree, including directories created later.
+
+    A watch follows its directory if the directory is moved, so the
+    watches for a moved (or renamed) directory and its subdirectories
+    are removed, and added again with their new paths if the directory
+    was moved within the tree.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        libc_path = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_path, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watch_paths = dict()
+        self.add_watches(root)
+
+    def add_watch(self, path):
+        """
+        Watch one directory
+        """
+        watch_descriptor = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), WATCH_MASK)
+        if watch_descriptor < 0:
+            err = ctypes.get_errno()
+            logger.warning(
+                "Couldn't watch %s: %s" % (path, os.strerror(err)))
+            return
+        self.watch_paths[watch_descriptor] = path
+
+    def add_watches(self, root):
+        """
+        Watch a directory and all of its subdirectories
+        """
+        for dirname, _, _ in os.walk(root):
+            self.add_watch(dirname)
+
+    def remove_watches(self, root):
+        """
+        Stop watching a directory and all of its subdirectories
+        """
+        prefix = os.path.join(root, "")
+        for watch_descriptor, dirname in list(self.watch_paths.items()):
+            if dirname == root or dirname.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, watch_descriptor)
+                del self.watch_paths[watch_descriptor]
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for events, returning WatchEvents
+        """
+        paths = set()
+        rescan = False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return WatchEvents(paths, rescan)
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return WatchEvents(paths, rescan)
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            watch_descriptor, mask, _, name_length = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(
+                data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            if mask & IN_IGNORED:
+                self.watch_paths.pop(watch_descriptor, None)
+                continue
+            dirname = self.watch_paths.get(watch_descriptor)
+            if dirname is None:
+                continue
+            if mask & IN_MOVE_SELF:
+                # Directories moved from a watched directory have already
+                # been handled by its IN_MOVED_FROM event, so this is e.g.
+                # the root directory:
+                logger.warning(
+                    "%s was moved, so it's no longer watched." % dirname)
+                self.remove_watches(dirname)
+                continue
+            if not name:
+                continue
+            path = os.path.join(dirname, name)
+            if mask & IN_ISDIR:
+                if mask & IN_MOVED_FROM:
+                    # Its watches would still report its old path:
+                    self.remove_watches(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have been created (or moved in) before
+                    # the new directory's watch was added:
+                    self.add_watches(path)
+                    paths.update(files_in_tree(path))
+            elif not mask & IN_MOVED_FROM:
+                paths.add(path)
+        return WatchEvents(paths, rescan)
+
+    def close(self):
+        """
+        Stop watching
+        """
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Watches a directory tree by comparing the sizes and modification
+    times of its files every interval seconds
+    """
+
+    def __init__(self, root, interval=10.0):
+        self.root = root
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+        self.last_poll = time.time()
+
+    def take_snapshot(self):
+        """
+        Return a dictionary mapping each file's path to its size and
+        modification time
+        """
+        snapshot = dict()
+        for path in files_in_tree(self.root):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for the next poll, returning WatchEvents
+        """
+        remaining = self.last_poll + self.interval - time.time()
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            if remaining > timeout:
+                return WatchEvents(set(), False)
+        snapshot = self.take_snapshot()
+        paths = set(
+            path for path, attrs in snapshot.items()
+            if self.snapshot.get(path) != attrs)
+        self.snapshot = snapshot
+        self.last_poll = time.time()
+        return WatchEvents(paths, False)
+
+    def close(self):
+        """
+        Stop watching
+        """
+
+
+def get_watcher(root, polling=False, poll_interval=10.0):
+    """
+    Return an InotifyWatcher for root on Linux (unless polling is True),
+    falling back to a PollingWatcher
+    """
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as err:
+            logger.warning(
+                "Couldn't use inotify (%s), so polling for changes instead."
+                % str(err))
+    return PollingWatcher(root, poll_interval)
@@ -0,0 +1,349 @@
+"""
+Timers and counters for each stage of a MyData run, e.g. scanning folders,
+looking up files, calculating checksums and transferring files
+
+If the MYDATA_RUN_REPORT environment variable is set (to a file, or to a
+directory for .MyData_run_report.json), a JSON run report is written when
+MyData exits, with each stage's count, errors, total time, latency
+percentiles (p50, p95 and p99), bytes and bytes/s, and the number of
+MyTardis API requests made to each endpoint, with their latencies.  API
+requests are timed by the sessions from mydata.utils.sessions.
+
+Latencies are counted in logarithmic histogram buckets, rather than being
+kept individually, so memory usage doesn't grow with the number of files.
+Percentiles are reported as their bucket's upper bound, so they may
+overestimate latencies by up to 9%.
+"""
+import atexit
+import collections
+import copy
+import functools
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from ..logs import logger
+
+HISTOGRAM_MIN_SECONDS = 1e-6
+
+# Each bucket's upper bound is 2 ** (1 / 8), i.e. about 9% larger than
+# its lower bound:
+HISTOGRAM_BUCKETS_PER_DOUBLING = 8
+
+PERCENTILES = (50, 95, 99)
+
+RUN_REPORT_FILENAME = ".MyData_run_report.json"
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in logarithmic buckets
+    """
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @staticmethod
+    def get_bucket(seconds):
+        """
+        Return the bucket index for a latency
+        """
+        if seconds <= HISTOGRAM_MIN_SECONDS:
+            return 0
+        return int(
+            math.log2(seconds / HISTOGRAM_MIN_SECONDS)
+            * HISTOGRAM_BUCKETS_PER_DOUBLING)
+
+    @staticmethod
+    def get_upper_bound(bucket):
+        """
+        Return the largest latency counted in a bucket
+        """
+        return HISTOGRAM_MIN_SECONDS * 2 ** (
+            (bucket + 1) / HISTOGRAM_BUCKETS_PER_DOUBLING)
+
+    def record(self, seconds):
+        """
+        Count a latency
+        """
+        self.buckets[self.get_bucket(seconds)] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def merge(self, other):
+        """
+        Add the latencies counted by another histogram, e.g. one from
+        a worker process
+        """
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total_seconds += other.total_seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+    def percentile(self, percent):
+        """
+        Return the latency which percent% of latencies are less than
+        or equal to, or None if no latencies have been counted
+        """
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * percent / 100.0)
+        cumulative = 0
+        for bucket in sorted(self.buckets):
+            cumulative += self.buckets[bucket]
+            if cumulative >= rank:
+                return min(self.get_upper_bound(bucket), self.max_seconds)
+        return self.max_seconds
+
+    def cumulative_counts(self, doublings):
+        """
+        Return the number of latencies less than or equal to
+        HISTOGRAM_MIN_SECONDS * 2 ** doubling, for each of doublings
+        (which are bucket boundaries, so the counts are exact)
+        """
+        counts = []
+        for doubling in doublings:
+            last_bucket = doubling * HISTOGRAM_BUCKETS_PER_DOUBLING - 1
+            counts.append(sum(
+                count for bucket, count in self.buckets.items()
+                if bucket <= last_bucket))
+        return counts
+
+
+class StageStats:
+    """
+    Timings and totals for one stage
+    """
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.num_bytes = 0
+
+    @property
+    def total_seconds(self):
+        """
+        The total time spent in the stage
+        """
+        return self.histogram.total_seconds
+
+    def merge(self, other):
+        """
+        Add another StageStats instance's timings and totals
+        """
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+        self.num_bytes += other.num_bytes
+
+    def to_dict(self):
+        """
+        Return the stage's statistics for the run report
+        """
+        stats = dict(
+            count=self.histogram.count,
+            errors=self.errors,
+            total_seconds=round(self.total_seconds, 6),
+        )
+        for percent in PERCENTILES:
+            latency = self.histogram.percentile(percent)
+            stats["p%s_seconds" % percent] = \
+                round(latency, 6) if latency is not None else None
+        stats["max_seconds"] = round(self.histogram.max_seconds, 6)
+        if self.num_bytes:
+            stats["bytes"] = self.num_bytes
+            stats["bytes_per_second"] = round(
+                self.num_bytes / self.total_seconds, 1) \
+                if self.total_seconds else None
+        return stats
+
+
+class StageTimer:
+    """
+    Times a block of code as one call of a stage, e.g.
+
+        with INSTRUMENTATION.timer("calculate_md5_sum", file_size):
+            ...
+
+    If an exception is raised, or if the timer's error attribute is set
+    within the block, the call is counted as an error, and its bytes
+    aren't counted.
+    """
+
+    def __init__(self, instrumentation, stage, num_bytes=0):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.num_bytes = num_bytes
+        self.error = False
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        error = self.error or exc_type is not None
+        self.instrumentation.record(
+            self.stage, time.perf_counter() - self.start_time,
+            num_bytes=0 if error else self.num_bytes, error=error)
+
+
+class Instrumentation:
+    """
+    Collects stage timings and API request counts for the run report
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = collections.defaultdict(StageStats)
+        self.api_requests = collections.defaultdict(LatencyHistogram)
+        self.started = datetime.now()
+        self.start_time = time.perf_counter()
+        self.report_registered = False
+
+    def reset(self):
+        """
+        Discard the timings and counts collected so far
+        """
+        with self.lock:
+            self.stages.clear()
+            self.api_requests.clear()
+            self.started = datetime.now()
+            self.start_time = time.perf_counter()
+
+    def record(self, stage, seconds, num_bytes=0, error=False):
+        """
+        Record one call of a stage, registering the run report
+        to be written at exit (if it is enabled), the first time
+        this is called
+        """
+        with self.lock:
+            stats = self.stages[stage]
+            stats.histogram.record(seconds)
+            stats.num_bytes += num_bytes
+            if error:
+                stats.errors += 1
+            if not self.report_registered:
+                self.report_registered = True
+                atexit.register(self.write_report)
+
+    def timer(self, stage, num_bytes=0):
+        """
+        Return a context manager which times a block of code
+        """
+        return StageTimer(self, stage, num_bytes)
+
+    def timed(self, stage):
+        """
+        Decorator which times each call of a function
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_api_request(self, method, url, seconds):
+        """
+        Record a request's latency, e.g. as "GET mydata_dataset_file" for
+        GET /api/v1/mydata_dataset_file/?format=json&...
+        """
+        parts = [part for part in urlparse(url).path.split("/") if part]
+        if parts[:2] == ["api", "v1"]:
+            endpoint = "/".join(
+                part for part in parts[2:] if not part.isdigit())
+        else:
+            endpoint = "other"
+        with self.lock:
+            self.api_requests["%s %s" % (method, endpoint)].record(seconds)
+
+    def snapshot(self):
+        """
+        Return copies of the stage statistics and API request latencies
+        """
+        with self.lock:
+            return copy.deepcopy(dict(self.stages)), \
+                copy.deepcopy(dict(self.api_requests))
+
+    def merge(self, snapshot):
+        """
+        Add the stage statistics and API request latencies from another
+        process's snapshot(), e.g. a worker process's
+        """
+        stages, api_requests = snapshot
+        with self.lock:
+            for stage, stats in stages.items():
+                self.stages[stage].merge(stats)
+            for endpoint, histogram in api_requests.items():
+                self.api_requests[endpoint].merge(histogram)
+
+    def get_report(self):
+        """
+        Return the run report as a dictionary
+        """
+        with self.lock:
+            return dict(
+                command=" ".join(sys.argv),
+                started=self.started.isoformat(),
+                finished=datetime.now().isoformat(),
+                elapsed_seconds=round(time.perf_counter() - self.start_time, 3),
+                stages=dict(
+                    (stage, stats.to_dict())
+                    for stage, stats in sorted(self.stages.items())),
+                api_requests=dict(
+                    total=sum(
+                        histogram.count
+                        for histogram in self.api_requests.values()),
+                    by_endpoint=dict(
+                        (endpoint, histogram.count)
+                        for endpoint, histogram
+                        in sorted(self.api_requests.items())),
+                    latency_by_endpoint=dict(
+                        (endpoint, dict(
+                            ("p%s_seconds" % percent,
+                             round(histogram.percentile(percent), 6))
+                            for percent in PERCENTILES))
+                        for endpoint, histogram
+                        in sorted(self.api_requests.items())),
+                ),
+            )
+
+    @staticmethod
+    def get_report_path():
+        """
+        Return the run report's path from the MYDATA_RUN_REPORT environment
+        variable, or None if it isn't set
+        """
+        report_path = os.environ.get("MYDATA_RUN_REPORT")
+        if report_path and os.path.isdir(report_path):
+            report_path = os.path.join(report_path, RUN_REPORT_FILENAME)
+        return report_path or None
+
+    def write_report(self, report_path=None):
+        """
+        Write the run report as JSON, returning its path, or None if
+        report_path isn't supplied and MYDATA_RUN_REPORT isn't set
+        """
+        report_path = report_path or self.get_report_path()
+        if not report_path:
+            return None
+        try:
+            with open(report_path, "w", encoding="utf-8") as report_file:
+                json.dump(self.get_report(), report_file, indent=2)
+        except OSError as err:
+            logger.warning(
+                "Couldn't write run report to %s: %s" % (report_path, err))
+        return report_path
+
+
+INSTRUMENTATION = Instrumentation()
@@ -0,0 +1,55 @@
+"""
+List a dataset's DataFile records a page at a time, so that many files in
+one dataset can be looked up with a few API requests, instead of one
+request per file.
+
+This is used both by "mydata index", which uses the dataset_file endpoint,
+and by "mydata upload --plan", which uses the mydata_dataset_file endpoint.
+"""
+import functools
+
+
+def get_datafile_listing_page(
+        endpoint_url, headers, get_session, dataset_id, offset, limit):
+    """Get one page of a dataset's DataFile records from endpoint_url,
+    e.g. "https://mytardis.example.com/api/v1/dataset_file/", using the
+    session returned by get_session.  Records are ordered by ID, so that
+    successive pages don't overlap or skip records.
+
+    :raises requests.exceptions.HTTPError:
+    """
+    url = "%s?format=json&dataset__id=%s&order_by=id&limit=%s&offset=%s" % (
+        endpoint_url,
+        dataset_id,
+        limit,
+        offset,
+    )
+    response = get_session().get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_datafile_records(
+        endpoint_url, headers, get_session, dataset_id, limit, executor=None):
+    """Yield a dataset's DataFile records (as dictionaries), listed from
+    endpoint_url in pages of limit records.  After the first page, the
+    remaining pages are requested concurrently by the executor's threads
+    (if an executor is supplied), so get_session should return a session
+    which can be used by the calling thread.
+
+    :raises requests.exceptions.RequestException:
+    :raises ValueError: if a page isn't valid JSON
+    :raises KeyError: if a page isn't a valid listing
+    """
+    get_page = functools.partial(
+        get_datafile_listing_page, endpoint_url, headers, get_session,
+        dataset_id)
+    first_page = get_page(0, limit)
+    yield from first_page["objects"]
+    # The server may return fewer records per page than requested:
+    page_size = len(first_page["objects"]) or limit
+    offsets = range(page_size, first_page["meta"]["total_count"], page_size)
+    get_page = functools.partial(get_page, limit=page_size)
+    pages = executor.map(get_page, offsets) if executor else map(get_page, offsets)
+    for page in pages:
+        yield from page["objects"]
@@ -0,0 +1,283 @@
+"""
+Upload data by copying it into a staging area which is mounted locally
+(e.g. over NFS or SMB), rather than sending it over SSH
+
+Files are copied with os.copy_file_range or os.sendfile where possible,
+so that the data isn't copied through user space, falling back to reading
+and writing chunks where neither is supported for a pair of files (e.g.
+on Windows, or between some filesystems).  If the local_copy_verify
+setting is enabled, files are always copied in chunks, so that their MD5
+checksums can be calculated during the copy.
+"""
+import errno
+import hashlib
+import os
+import posixpath
+import threading
+from datetime import datetime
+
+from tqdm import tqdm
+
+from ..conf import settings
+from ..logs import logger
+from .exceptions import LocalCopyException
+from .throttle import BANDWIDTH_LIMITER
+from .upload import get_upload_chunk_size
+
+FSYNC_POLICIES = ("none", "file", "directory")
+
+DEFAULT_FILE_MODE = 0o660
+
+# Errors meaning that a zero-copy function can't be used for a pair of files,
+# so the next one (or a chunked copy) should be tried instead:
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+}
+
+# Each upload thread reuses its own chunk buffer for chunked copies:
+THREAD_LOCAL = threading.local()
+
+
+def get_zero_copy_functions():
+    """
+    Return the zero-copy functions available on this platform, each
+    copying up to count bytes from the current position of the source
+    file descriptor to the current position of the destination
+    """
+    functions = []
+    if hasattr(os, "copy_file_range"):
+        functions.append(os.copy_file_range)
+    if hasattr(os, "sendfile"):
+        functions.append(
+            lambda src_fd, dst_fd, count: os.sendfile(
+                dst_fd, src_fd, None, count))
+    return functions
+
+
+def get_fsync_policy():
+    """
+    Return the local_copy_fsync setting, or "file" if it isn't valid
+    """
+    policy = settings.miscellaneous.local_copy_fsync
+    if policy not in FSYNC_POLICIES:
+        logger.warning("Invalid local_copy_fsync: %s" % policy)
+        return "file"
+    return policy
+
+
+def get_file_mode():
+    """
+    Return the permissions to set on copied files, from the
+    local_copy_file_mode setting, or None to leave them unchanged
+    """
+    file_mode = settings.miscellaneous.local_copy_file_mode
+    if not file_mode:
+        return None
+    try:
+        return int(file_mode, 8)
+    except ValueError:
+        logger.warning("Invalid local_copy_file_mode: %s" % file_mode)
+        return DEFAULT_FILE_MODE
+
+
+def get_local_path(location, remote_file_path):
+    """
+    Return the local path of a file on staging, whose path on the staging
+    server is remote_file_path, within the storage box's location
+
+    :raises LocalCopyException: if remote_file_path isn't within location
+    """
+    mount = settings.miscellaneous.local_copy_mount
+    if not mount:
+        return remote_file_path
+    rel_path = posixpath.relpath(remote_file_path, location)
+    if rel_path == ".." or rel_path.startswith("../"):
+        raise LocalCopyException(
+            "%s isn't within the storage box location %s."
+            % (remote_file_path, location))
+    return os.path.join(mount, *rel_path.split("/"))
+
+
+def get_chunk_buffer(chunk_size):
+    """
+    Get this thread's reusable chunk buffer, allocating it if necessary
+    """
+    buffer = getattr(THREAD_LOCAL, "chunk_buffer", None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = bytearray(chunk_size)
+        THREAD_LOCAL.chunk_buffer = buffer
+    return buffer
+
+
+def read_file_chunks_into_buffer(file_object, chunk_size):
+    """
+    Read data file chunks into this thread's reusable buffer, rather
+    than allocating a new bytes object for each chunk.
+
+    Full chunks are yielded as the buffer itself, so each chunk must be
+    written before the next one is read.  A short final chunk is yielded
+    as a copy.
+    """
+    buffer = get_chunk_buffer(chunk_size)
+    with memoryview(buffer) as view:
+        while True:
+            num_bytes = file_object.readinto(view)
+            if not num_bytes:
+                break
+            if num_bytes == chunk_size:
+                yield buffer
+            else:
+                yield bytes(view[:num_bytes])
+
+
+def write_all(dst_file, chunk):
+    """
+    Write a whole chunk to an unbuffered file, continuing after any
+    short writes
+    """
+    with memoryview(chunk) as view:
+        offset = 0
+        while offset < len(view):
+            offset += dst_file.write(view[offset:])
+    return offset
+
+
+def copy_chunks(src_file, dst_file, upload, progress_cb, md5=None):
+    """
+    Copy the rest of src_file to dst_file by reading and writing chunks,
+    updating md5 (if supplied) with each chunk
+    """
+    for chunk in read_file_chunks_into_buffer(
+            src_file, get_upload_chunk_size()):
+        BANDWIDTH_LIMITER.consume(len(chunk))
+        if md5:
+            md5.update(chunk)
+        progress_cb(write_all(dst_file, chunk))
+        if upload.canceled:
+            break
+
+
+def copy_chunks_zero_copy(send, src_file, dst_file, upload, progress_cb):
+    """
+    Copy the rest of src_file to dst_file with a zero-copy function,
+    one chunk at a time, so that progress can be reported, bandwidth
+    limits applied, and the upload canceled
+
+    :raises OSError: if send fails, e.g. because it isn't supported
+    """
+    src_fd = src_file.fileno()
+    dst_fd = dst_file.fileno()
+    while not upload.canceled:
+        num_bytes = send(src_fd, dst_fd, get_upload_chunk_size())
+        if not num_bytes:
+            break
+        BANDWIDTH_LIMITER.consume(num_bytes)
+        progress_cb(num_bytes)
+
+
+def copy_file_data(src_file, dst_file, upload, progress_cb, md5=None):
+    """
+    Copy src_file to dst_file (both unbuffered), with a zero-copy function
+    if possible, unless md5 is supplied, in which case it is updated with
+    the data as it's copied in chunks
+    """
+    if md5 is None:
+        for send in get_zero_copy_functions():
+            try:
+                copy_chunks_zero_copy(
+                    send, src_file, dst_file, upload, progress_cb)
+                return
+            except OSError as err:
+                if err.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                # Any bytes which were copied have advanced both files'
+                # positions, so the next method continues from there:
+                logger.debug("Zero-copy transfer unavailable: %s" % err)
+    copy_chunks(src_file, dst_file, upload, progress_cb, md5)
+
+
+def fsync_directory(path):
+    """
+    Flush a directory's entries to disk (not supported on Windows)
+    """
+    if os.name == "nt":
+        return
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def copy_file_local(file_path, location, remote_file_path, md5sum, upload,
+                    progress, thread_num):
+    """
+    Copy file into the locally mounted staging area, update progress
+    status, cancel copy if requested
+
+    Any partial copy from a previous attempt is overwritten.  The copied
+    file's permissions are set from the local_copy_file_mode setting, and
+    it is flushed to disk according to the local_copy_fsync setting, before
+    MyTardis is asked to verify it.
+
+    :raises LocalCopyException:
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    filename = os.path.relpath(file_path, settings.general.data_directory)
+    local_path = get_local_path(location, remote_file_path)
+    fsync_policy = get_fsync_policy()
+    md5 = hashlib.md5() if settings.miscellaneous.local_copy_verify else None
+
+    progress_bar = None
+    if progress:
+        progress_bar = tqdm(
+            position=thread_num,
+            total=upload.file_size,
+            desc=filename,
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024
+        )
+
+    def progress_cb(num_bytes):
+        upload.bytes_uploaded += num_bytes
+        if progress_bar:
+            progress_bar.update(num_bytes)
+
+    upload.bytes_uploaded = 0
+    upload.bytes_resumed = 0
+    upload.start_time = datetime.now()
+
+    try:
+        os.makedirs(os.path.dirname(local_path), mode=0o770, exist_ok=True)
+        with open(file_path, "rb", buffering=0) as src_file, \
+                open(local_path, "wb", buffering=0) as dst_file:
+            copy_file_data(src_file, dst_file, upload, progress_cb, md5)
+            if upload.canceled:
+                return
+            if fsync_policy != "none":
+                os.fsync(dst_file.fileno())
+        file_mode = get_file_mode()
+        if file_mode is not None:
+            os.chmod(local_path, file_mode)
+        if fsync_policy == "directory":
+            fsync_directory(os.path.dirname(local_path))
+    except OSError as err:
+        raise LocalCopyException(
+            "Copy of %s to staging failed. %s" % (filename, str(err))) from err
+    finally:
+        if progress_bar:
+            progress_bar.close()
+
+    upload.set_latest_time(datetime.now())
+
+    if md5 and md5.hexdigest() != md5sum:
+        raise LocalCopyException(
+            "MD5 checksum of %s copied to staging (%s) doesn't match the "
+            "checksum in its DataFile record (%s).  Has it been modified?"
+            % (filename, md5.hexdigest(), md5sum))
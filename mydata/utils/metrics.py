@@ -0,0 +1,373 @@
+"""
+Live metrics for monitoring MyData's uploads with Prometheus
+
+Metrics are fed by the scan, lookup and upload callbacks, and by the upload
+workers, and include the files scanned, lookups by LookupStatus, uploads by
+UploadStatus, bytes uploaded, in-flight workers, queue depths, upload
+retries, MyTardis API latency histograms and the latencies of each stage
+timed by mydata.utils.instrumentation.
+
+They are exported in the Prometheus text format, over HTTP and/or to a file
+for node_exporter's textfile collector, as configured by these environment
+variables:
+
+MYDATA_METRICS_PORT: Serve metrics at http://<host>:<port>/metrics
+MYDATA_METRICS_ADDRESS: The address to serve metrics on
+    (default: all interfaces)
+MYDATA_METRICS_TEXTFILE: Write metrics to this file, e.g.
+    /var/lib/node_exporter/textfile_collector/mydata.prom
+MYDATA_METRICS_INTERVAL: Seconds between writes to the metrics file
+    (default: 15)
+
+If neither MYDATA_METRICS_PORT nor MYDATA_METRICS_TEXTFILE is set,
+metrics are still collected, but not exported.
+"""
+import atexit
+import collections
+import contextlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..logs import logger
+from ..models.lookup import LookupStatus
+from ..models.upload import UploadStatus
+from .instrumentation import HISTOGRAM_MIN_SECONDS, INSTRUMENTATION, PERCENTILES
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# API latency histogram buckets, as powers of two of HISTOGRAM_MIN_SECONDS,
+# i.e. from 1ms (2 ** 10 microseconds) to 67s (2 ** 26 microseconds):
+API_LATENCY_DOUBLINGS = range(10, 27, 2)
+
+RETRY_COUNTERS = [
+    ("retries", "Upload retries attempted"),
+    ("transient_failures", "Transient upload failures"),
+    ("permanent_failures", "Permanent upload failures, which weren't retried"),
+    ("circuit_breaker_trips", "Times uploads were paused after repeated failures"),
+]
+
+
+def get_status_names(status_class):
+    """
+    Return a dictionary of status names (e.g. "found_verified"),
+    keyed by the values of an enumerated status class
+    """
+    return dict(
+        (value, name.lower()) for name, value in vars(status_class).items()
+        if name.isupper() and isinstance(value, int))
+
+
+LOOKUP_STATUS_NAMES = get_status_names(LookupStatus)
+UPLOAD_STATUS_NAMES = get_status_names(UploadStatus)
+
+
+def escape_label_value(value):
+    """
+    Escape a label value for the Prometheus text format
+    """
+    return str(value).replace("\\", r"\\").replace('"', r"\"") \
+        .replace("\n", r"\n")
+
+
+def format_sample(name, value, labels=None):
+    """
+    Format one sample, e.g. mydata_uploads_total{status="completed"} 12
+    """
+    if labels:
+        name += "{%s}" % ",".join(
+            '%s="%s"' % (key, escape_label_value(label_value))
+            for key, label_value in labels.items())
+    if isinstance(value, float):
+        value = repr(value)
+    return "%s %s" % (name, value)
+
+
+def format_metric(name, metric_type, help_text, samples):
+    """
+    Return the lines for a metric, where samples is a list of
+    (suffix, value, labels) tuples, and suffix is appended to the
+    metric's name, e.g. "_bucket" for a histogram's buckets
+    """
+    lines = [
+        "# HELP %s %s" % (name, help_text),
+        "# TYPE %s %s" % (name, metric_type),
+    ]
+    for suffix, value, labels in samples:
+        lines.append(format_sample(name + suffix, value, labels))
+    return lines
+
+
+def format_api_latencies(api_requests):
+    """
+    Return the lines for the API latency histograms, from a dictionary of
+    LatencyHistogram instances keyed by e.g. "GET mydata_dataset_file"
+    """
+    samples = []
+    for endpoint, histogram in sorted(api_requests.items()):
+        method, _, resource = endpoint.partition(" ")
+        labels = dict(method=method, endpoint=resource)
+        counts = histogram.cumulative_counts(API_LATENCY_DOUBLINGS)
+        for doubling, count in zip(API_LATENCY_DOUBLINGS, counts):
+            samples.append(("_bucket", count, dict(
+                labels, le=repr(HISTOGRAM_MIN_SECONDS * 2 ** doubling))))
+        samples.append(("_bucket", histogram.count, dict(labels, le="+Inf")))
+        samples.append(("_sum", float(histogram.total_seconds), labels))
+        samples.append(("_count", histogram.count, labels))
+    return format_metric(
+        "mydata_api_request_duration_seconds", "histogram",
+        "MyTardis API request latencies", samples)
+
+
+def format_stage_latencies(stages):
+    """
+    Return the lines for the stage latency summaries, from a dictionary
+    of mydata.utils.instrumentation.StageStats instances
+    """
+    samples = []
+    for stage, stats in sorted(stages.items()):
+        for percent in PERCENTILES:
+            samples.append((
+                "", float(stats.histogram.percentile(percent)),
+                dict(stage=stage, quantile=repr(percent / 100.0))))
+        samples.append(("_sum", float(stats.total_seconds), dict(stage=stage)))
+        samples.append(("_count", stats.histogram.count, dict(stage=stage)))
+    return format_metric(
+        "mydata_stage_duration_seconds", "summary",
+        "Latencies of each stage, e.g. lookups and transfers", samples)
+
+
+class UploadMetrics:
+    """
+    Counters and gauges for the current MyData process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders_scanned = 0
+        self.files_scanned = 0
+        self.lookups = collections.Counter()
+        self.uploads = collections.Counter()
+        self.bytes_uploaded = 0
+        self.in_flight_workers = collections.Counter()
+        self.queues = dict()
+        self.retry_stats = None
+
+    def record_folder(self, folder):
+        """
+        Count a scanned dataset folder and its files
+        """
+        with self.lock:
+            self.folders_scanned += 1
+            self.files_scanned += folder.num_files
+
+    def record_lookup(self, lookup):
+        """
+        Count a completed lookup by its status
+        """
+        with self.lock:
+            self.lookups[lookup.status] += 1
+
+    def record_upload(self, upload):
+        """
+        Count a finished upload by its status, and the bytes sent if it
+        completed (excluding any bytes already on the server from an
+        interrupted upload which was resumed)
+        """
+        with self.lock:
+            self.uploads[upload.status] += 1
+            if upload.status == UploadStatus.COMPLETED:
+                self.bytes_uploaded += max(
+                    (upload.bytes_uploaded or 0) - (upload.bytes_resumed or 0),
+                    0)
+
+    @contextlib.contextmanager
+    def in_flight(self, stage):
+        """
+        Count a worker as busy in a stage (e.g. "hash" or "upload")
+        until the block exits
+        """
+        with self.lock:
+            self.in_flight_workers[stage] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight_workers[stage] -= 1
+
+    def track_queue(self, name, queue):
+        """
+        Report the depth of a queue (anything with a qsize method),
+        or stop reporting it if queue is None
+        """
+        with self.lock:
+            if queue is None:
+                self.queues.pop(name, None)
+            else:
+                self.queues[name] = queue
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text format
+        """
+        stages, api_requests = INSTRUMENTATION.snapshot()
+        lines = self.format_counters()
+        lines.extend(format_api_latencies(api_requests))
+        lines.extend(format_stage_latencies(stages))
+        return "\n".join(lines) + "\n"
+
+    def format_counters(self):
+        """
+        Return the lines for the counters and gauges
+        """
+        with self.lock:
+            lines = format_metric(
+                "mydata_dataset_folders_scanned_total", "counter",
+                "Dataset folders scanned", [("", self.folders_scanned, None)])
+            lines += format_metric(
+                "mydata_files_scanned_total", "counter",
+                "Files found in scanned dataset folders",
+                [("", self.files_scanned, None)])
+            lines += format_metric(
+                "mydata_lookups_total", "counter",
+                "File lookups on MyTardis, by status",
+                [("", self.lookups[status], dict(status=name))
+                 for status, name in sorted(LOOKUP_STATUS_NAMES.items())])
+            lines += format_metric(
+                "mydata_uploads_total", "counter",
+                "Finished uploads, by status",
+                [("", self.uploads[status], dict(status=name))
+                 for status, name in sorted(UPLOAD_STATUS_NAMES.items())])
+            lines += format_metric(
+                "mydata_uploaded_bytes_total", "counter",
+                "Bytes sent by completed uploads",
+                [("", self.bytes_uploaded, None)])
+            lines += format_metric(
+                "mydata_in_flight_workers", "gauge",
+                "Workers currently hashing or uploading files",
+                [("", self.in_flight_workers[stage], dict(stage=stage))
+                 for stage in ("hash", "upload")])
+            lines += format_metric(
+                "mydata_queue_depth", "gauge",
+                "Files waiting in each queue",
+                [("", queue.qsize(), dict(queue=name))
+                 for name, queue in sorted(self.queues.items())])
+            if self.retry_stats:
+                for counter, help_text in RETRY_COUNTERS:
+                    lines += format_metric(
+                        "mydata_upload_%s_total" % counter, "counter",
+                        help_text, [("", getattr(self.retry_stats, counter), None)])
+                lines += format_metric(
+                    "mydata_upload_backoff_seconds_total", "counter",
+                    "Seconds spent backing off before retrying uploads",
+                    [("", float(self.retry_stats.backoff_seconds), None)])
+        return lines
+
+    def write_textfile(self, path):
+        """
+        Write the metrics to path, replacing it atomically, so that
+        node_exporter never reads a partly-written file
+        """
+        temp_path = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            with open(temp_path, "w", encoding="utf-8") as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(temp_path, path)
+        except OSError as err:
+            logger.warning("Couldn't write metrics to %s: %s" % (path, err))
+
+
+METRICS = UploadMetrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics at /metrics
+    """
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        """
+        Log requests at the debug level, instead of to stderr
+        """
+        logger.debug("Metrics request: %s" % (format % args))
+
+    def do_GET(self):
+        # pylint: disable=invalid-name
+        """
+        Handle GET requests
+        """
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def write_textfile_periodically(path, interval, stopping):
+    """
+    Write the metrics file every interval seconds, until stopping is set
+    """
+    while not stopping.wait(interval):
+        METRICS.write_textfile(path)
+
+
+def get_metrics_setting(name, converter, default=None, is_valid=None):
+    """
+    Return the value of the named environment variable, converted by
+    converter, or None (disabling the exporter which uses it) if it is
+    unset, or if it is invalid, in which case a warning is logged
+    """
+    value = os.environ.get(name, default)
+    if not value:
+        return None
+    try:
+        value = converter(value)
+        if is_valid is None or is_valid(value):
+            return value
+    except ValueError:
+        pass
+    logger.warning("Invalid %s: %s" % (name, os.environ[name]))
+    return None
+
+
+def start_metrics_exporter():
+    """
+    Start serving and/or writing metrics in background threads, as configured
+    by the MYDATA_METRICS_* environment variables, returning the HTTP server
+    (or None)
+    """
+    server = None
+    port = get_metrics_setting(
+        "MYDATA_METRICS_PORT", int, is_valid=lambda port: 0 <= port < 65536)
+    if port is not None:
+        server = ThreadingHTTPServer(
+            (os.environ.get("MYDATA_METRICS_ADDRESS", ""), port),
+            MetricsRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="metrics_server",
+            daemon=True).start()
+        logger.info("Serving metrics on port %s" % server.server_address[1])
+
+    path = os.environ.get("MYDATA_METRICS_TEXTFILE")
+    interval = get_metrics_setting(
+        "MYDATA_METRICS_INTERVAL", float, "15",
+        is_valid=lambda interval: interval > 0)
+    if path and interval is not None:
+        stopping = threading.Event()
+        threading.Thread(
+            target=write_textfile_periodically,
+            args=(path, interval, stopping),
+            name="metrics_textfile", daemon=True).start()
+
+        def write_final_metrics():
+            stopping.set()
+            METRICS.write_textfile(path)
+
+        atexit.register(write_final_metrics)
+    return server
@@ -19,6 +19,7 @@ from ..logs import logger
 from ..utils.exceptions import SshException
 from ..utils.exceptions import ScpException
 from ..utils.exceptions import PrivateKeyDoesNotExist
+from ..utils.throttle import BANDWIDTH_LIMITER
 
 from ..subprocesses import DEFAULT_STARTUP_INFO
 from ..subprocesses import DEFAULT_CREATION_FLAGS
@@ -328,6 +329,9 @@ def upload_with_scp(
     Ignore bytes uploaded previously, because MyData is no longer
     chunking files, so with SCP, we will always upload the whole
     file.
+
+    If uploads are bandwidth-limited, each scp process is limited
+    to an equal share of the current limit, using scp's -l option.
     """
     if sys.platform.startswith("win"):
         file_path = get_cygwin_path(file_path)
@@ -353,6 +357,11 @@ def upload_with_scp(
     scp_command_list[2:2] = OpenSSH.default_ssh_options(
         settings.miscellaneous.connection_timeout
     )
+    limit_kbits = BANDWIDTH_LIMITER.scp_limit_kbits(
+        settings.advanced.max_upload_threads
+    )
+    if limit_kbits:
+        scp_command_list[2:2] = ["-l", str(limit_kbits)]
 
     scp_upload(upload, scp_command_list)
 
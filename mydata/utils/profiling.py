@@ -0,0 +1,267 @@
+"""
+Profiling for diagnosing slow MyData runs, e.g.
+
+    mydata --profile=sample --profile-output=upload.folded upload
+
+There are three modes:
+
+cpu: Profiles the main thread with cProfile, writing pstats data,
+    which can be read with python -m pstats or snakeviz.
+sample: Samples the stacks of all threads (including lookup, hashing and
+    upload workers) every SAMPLE_INTERVAL seconds, writing the sampled
+    stacks in the "folded" format read by flamegraph.pl and speedscope.
+    The samples are of wall-clock time, so they include time spent
+    waiting, e.g. for network responses.
+mem: Traces memory allocations with tracemalloc, taking snapshots at
+    stage boundaries (after scanning and after uploading), and writing
+    the largest allocations, and their growth since the previous snapshot.
+
+When the profiler stops, a summary of the top hot spots is printed
+to stderr.
+"""
+import collections
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+from datetime import datetime
+
+import click
+
+PROFILE_MODES = ["cpu", "sample", "mem"]
+
+OUTPUT_EXTENSIONS = dict(cpu="pstats", sample="folded", mem="txt")
+
+SAMPLE_INTERVAL = 0.005
+
+TRACEMALLOC_FRAMES = 10
+
+TOP_N = 15
+
+# The profiler started by the --profile option, if any:
+ACTIVE_PROFILER = None
+
+
+def get_default_output_path(mode):
+    """
+    Return a file name for a profile, e.g. mydata-sample-20200101-120000.folded
+    """
+    return "mydata-%s-%s.%s" % (
+        mode, datetime.now().strftime("%Y%m%d-%H%M%S"), OUTPUT_EXTENSIONS[mode])
+
+
+class CpuProfiler:
+    """
+    Profiles the main thread with cProfile
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """
+        Start profiling
+        """
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling, write the pstats data and
+        return a summary of the top functions
+        """
+        self.profile.disable()
+        self.profile.dump_stats(self.output_path)
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(TOP_N)
+        return stream.getvalue()
+
+
+class StackSampler:
+    """
+    Periodically samples the stacks of all threads
+    """
+
+    def __init__(self, output_path, interval=SAMPLE_INTERVAL):
+        self.output_path = output_path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.labels = dict()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="profile_sampler", daemon=True)
+
+    def get_label(self, code):
+        """
+        Return a label for a function, e.g. "lookup_datafile (lookups.py:66)"
+        """
+        label = self.labels.get(code)
+        if label is None:
+            label = "%s (%s:%s)" % (
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno)
+            self.labels[code] = label
+        return label
+
+    def sample(self):
+        """
+        Count each thread's current stack, rooted at its thread name,
+        with worker numbers removed, e.g. "upload_3" becomes "upload"
+        """
+        own_ident = threading.get_ident()
+        thread_names = dict(
+            (thread.ident, re.sub(r"[_-]\d+$", "", thread.name))
+            for thread in threading.enumerate())
+        # pylint: disable=protected-access
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.get_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(thread_names.get(ident, "thread"))
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def run(self):
+        """
+        Sample stacks until stopped
+        """
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """
+        Start sampling in a background thread
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling, write the folded stacks and return a summary of the
+        functions most often found running ("self") or on the stack ("total")
+        """
+        self.stopping.set()
+        self.thread.join()
+        with open(self.output_path, "w", encoding="utf-8") as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write("%s %s\n" % (stack, count))
+
+        num_samples = sum(self.stacks.values())
+        self_counts = collections.Counter()
+        total_counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                self_counts[frames[-1]] += count
+            for label in set(frames):
+                total_counts[label] += count
+
+        lines = ["%s stack samples" % num_samples]
+        if not num_samples:
+            return lines[0] + "\n"
+        for heading, counts in (("Self", self_counts), ("Total", total_counts)):
+            lines.append("\n%6s  Function" % heading)
+            for label, count in counts.most_common(TOP_N):
+                lines.append("%5.1f%%  %s" % (100.0 * count / num_samples, label))
+        return "\n".join(lines) + "\n"
+
+
+class MemoryProfiler:
+    """
+    Traces memory allocations with tracemalloc, reporting the largest
+    allocations at each snapshot, and their growth since the previous one
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.previous = None
+        self.report = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start tracing memory allocations
+        """
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def snapshot(self, label):
+        """
+        Take a snapshot, and add its largest allocations to the report,
+        returning the lines added
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            "Snapshot: %s" % label,
+            "Traced memory: %.1f MiB (peak %.1f MiB)"
+            % (current / 1024 ** 2, peak / 1024 ** 2),
+            "",
+            "Largest allocations:",
+        ]
+        lines.extend(
+            str(stat) for stat in snapshot.statistics("lineno")[:TOP_N])
+        with self.lock:
+            if self.previous:
+                lines.append("")
+                lines.append("Growth since %s:" % self.previous[0])
+                lines.extend(
+                    str(stat) for stat in snapshot.compare_to(
+                        self.previous[1], "lineno")[:TOP_N])
+            lines.append("")
+            self.report.extend(lines)
+            self.previous = (label, snapshot)
+        return lines
+
+    def stop(self):
+        """
+        Take a final snapshot, stop tracing, write the report and
+        return the final snapshot's summary
+        """
+        lines = self.snapshot("exit")
+        tracemalloc.stop()
+        with open(self.output_path, "w", encoding="utf-8") as output:
+            output.write("\n".join(self.report))
+        return "\n".join(lines)
+
+
+PROFILERS = dict(cpu=CpuProfiler, sample=StackSampler, mem=MemoryProfiler)
+
+
+def start_profiler(mode, output_path=None):
+    """
+    Start profiling in one of PROFILE_MODES, returning a function
+    which stops profiling and prints a summary to stderr
+    """
+    global ACTIVE_PROFILER  # pylint: disable=global-statement
+    output_path = output_path or get_default_output_path(mode)
+    profiler = PROFILERS[mode](output_path)
+    profiler.start()
+    ACTIVE_PROFILER = profiler
+
+    def stop_profiler():
+        global ACTIVE_PROFILER  # pylint: disable=global-statement
+        ACTIVE_PROFILER = None
+        summary = profiler.stop()
+        click.echo("\n%s" % summary, err=True)
+        click.echo(
+            "Wrote %s profile to: %s" % (mode, os.path.abspath(output_path)),
+            err=True)
+
+    return stop_profiler
+
+
+def snapshot_memory(label):
+    """
+    Mark a stage boundary, taking a memory snapshot if profiling memory
+    """
+    if isinstance(ACTIVE_PROFILER, MemoryProfiler):
+        ACTIVE_PROFILER.snapshot(label)
@@ -0,0 +1,53 @@
+"""
+Cache the MyTardis records (users, groups, experiments, datasets and
+uploader registration requests) resolved for local folders, so that
+long-running commands ("mydata daemon" and "mydata watch") don't look
+them up again for each upload cycle.
+
+The cache is disabled by default, so that "mydata upload" always uses
+up-to-date records.
+"""
+import threading
+
+
+class ResolutionCache:
+    """
+    A cache of records resolved from the MyTardis API, keyed by the kind
+    of record and a key describing the local folder it was resolved for
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = dict()
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get_or_resolve(self, kind, key, resolve):
+        """
+        Return the cached record of this kind for key, calling resolve()
+        to look it up if it isn't cached (or the cache is disabled).
+
+        Records which couldn't be resolved (None) aren't cached, so that
+        they will be looked up again, e.g. after a user account is created.
+        """
+        if not self.enabled:
+            return resolve()
+        with self.lock:
+            if (kind, key) in self.records:
+                self.hits += 1
+                return self.records[(kind, key)]
+        record = resolve()
+        if record is not None:
+            with self.lock:
+                self.records[(kind, key)] = record
+        return record
+
+    def clear(self):
+        """
+        Forget all cached records
+        """
+        with self.lock:
+            self.records.clear()
+
+
+RESOLUTION_CACHE = ResolutionCache()
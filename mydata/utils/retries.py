@@ -1,10 +1,16 @@
 """
-Automatically retry API requests after a server error
+Automatically retry API requests after a server error,
+and retry file transfers after transient failures
 """
-import requests
+import random
+import threading
+import time
+
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry  # pylint: disable=import-error
 
+from .sessions import create_session
+
 
 def requests_retry_session(
     retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None,
@@ -15,7 +21,7 @@ def requests_retry_session(
 
     Thanks to https://www.peterbe.com/plog/best-practice-with-retries-with-requests
     """
-    session = session or requests.Session()
+    session = session or create_session()
     retry = Retry(
         total=retries,
         read=retries,
@@ -27,3 +33,242 @@ def requests_retry_session(
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
+
+
+class FailureType:
+    """
+    Enumerated data type for classifying transfer failures
+    """
+
+    # pylint: disable=invalid-name
+
+    # Worth retrying, e.g. a timeout or a reset connection:
+    TRANSIENT = 0
+
+    # Retrying won't help, e.g. permission denied or a missing key:
+    PERMANENT = 1
+
+
+PERMANENT_ERROR_PATTERNS = [
+    "permission denied",
+    "no such file or directory",
+    "can't open ssh key file",
+    "authentication failed",
+    "host key verification failed",
+    "not a regular file",
+    "disk quota exceeded",
+    "no space left on device",
+    "read-only file system",
+]
+
+PERMANENT_ERROR_TYPES = (
+    PermissionError,
+    FileNotFoundError,
+    IsADirectoryError,
+)
+
+
+def classify_failure(err):
+    """
+    Classify a transfer failure as FailureType.TRANSIENT or
+    FailureType.PERMANENT, using the exception (and its cause)
+    type and message
+    """
+    while err is not None:
+        if isinstance(err, PERMANENT_ERROR_TYPES):
+            return FailureType.PERMANENT
+        if type(err).__name__ in ("AuthenticationError", "PublicKeyError"):
+            return FailureType.PERMANENT
+        message = str(err).lower()
+        for pattern in PERMANENT_ERROR_PATTERNS:
+            if pattern in message:
+                return FailureType.PERMANENT
+        err = err.__cause__
+    return FailureType.TRANSIENT
+
+
+class CircuitBreaker:
+    """
+    Stops all upload workers from hammering a staging host after
+    several consecutive failures.
+
+    After `threshold` consecutive failures, the circuit is opened
+    for `timeout` seconds, during which new attempts must wait.
+    After that, attempts are allowed again, but a further failure
+    re-opens the circuit immediately.  A success closes it.
+
+    The threshold and timeout are passed to record_failure, rather
+    than stored, so that the current settings are always used.
+    """
+
+    def __init__(self):
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def record_success(self):
+        """
+        Close the circuit
+        """
+        with self.lock:
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self, threshold, timeout):
+        """
+        Record a failure, returning True if the circuit has just opened
+        (a threshold of 0 disables the circuit breaker)
+        """
+        with self.lock:
+            self.consecutive_failures += 1
+            if threshold and self.consecutive_failures >= threshold:
+                self.open_until = time.time() + timeout
+                return True
+            return False
+
+    @property
+    def seconds_until_closed(self):
+        """
+        Seconds until attempts are allowed again (0 if they are allowed now)
+        """
+        return max(0.0, self.open_until - time.time())
+
+
+class RetryStats:
+    """
+    Counts of transfer retries and failures, for the upload summary
+    """
+
+    COUNTERS = (
+        "retries",
+        "transient_failures",
+        "permanent_failures",
+        "circuit_breaker_trips",
+        "backoff_seconds",
+    )
+
+    def __init__(self):
+        self.retries = 0
+        self.transient_failures = 0
+        self.permanent_failures = 0
+        self.circuit_breaker_trips = 0
+        self.backoff_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def increment(self, counter, amount=1):
+        """
+        Thread-safe increment of one of the counters
+        """
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def counts(self):
+        """
+        Return a dictionary of the current counts
+        """
+        with self.lock:
+            return dict(
+                (counter, getattr(self, counter)) for counter in self.COUNTERS)
+
+    def since(self, counts):
+        """
+        Return a new RetryStats instance, counting the retries and failures
+        since counts were returned by counts(), e.g. for one daemon cycle
+        """
+        stats = RetryStats()
+        for counter, value in self.counts().items():
+            setattr(stats, counter, value - counts[counter])
+        return stats
+
+
+class TransferRetryPolicy:
+    """
+    Retry policy for file transfers (uploads to staging)
+
+    Retries transient failures with exponential backoff and "full
+    jitter", so that worker threads which failed together don't retry
+    together.  Permanent failures are not retried.  A circuit breaker
+    is kept for each staging host.
+
+    The settings argument is the global settings singleton, which is
+    read each time, so that changes to MyData.cfg values are respected.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.stats = RetryStats()
+        self.circuit_breakers = dict()
+        self.lock = threading.Lock()
+
+    def circuit_breaker(self, host):
+        """
+        Get the circuit breaker for a host, creating it if necessary
+        """
+        with self.lock:
+            if host not in self.circuit_breakers:
+                self.circuit_breakers[host] = CircuitBreaker()
+            return self.circuit_breakers[host]
+
+    def backoff_delay(self, attempt):
+        """
+        Return a random delay (in seconds) before retry number `attempt`
+        """
+        base = self.settings.miscellaneous.retry_backoff_base
+        cap = self.settings.miscellaneous.retry_backoff_max
+        return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+    def record_success(self, host):
+        """
+        Record a successful transfer to host
+        """
+        self.circuit_breaker(host).record_success()
+
+    def record_failure(self, host, err):
+        """
+        Record a failed transfer to host, returning the FailureType
+        """
+        failure_type = classify_failure(err)
+        if failure_type == FailureType.PERMANENT:
+            self.stats.increment("permanent_failures")
+        else:
+            self.stats.increment("transient_failures")
+            if self.circuit_breaker(host).record_failure(
+                    self.settings.miscellaneous.circuit_breaker_threshold,
+                    self.settings.miscellaneous.circuit_breaker_timeout):
+                self.stats.increment("circuit_breaker_trips")
+        return failure_type
+
+    def wait_before_retry(self, host, attempt, canceled_cb=None):
+        """
+        Sleep before retry number `attempt`, for the backoff delay or
+        until the host's circuit breaker allows attempts, whichever is
+        longer.  Returns early if canceled_cb returns True.
+        """
+        self.stats.increment("retries")
+        delay = max(
+            self.backoff_delay(attempt),
+            self.circuit_breaker(host).seconds_until_closed,
+        )
+        self.stats.increment("backoff_seconds", delay)
+        sleep_unless_canceled(delay, canceled_cb)
+
+    def wait_for_circuit(self, host, canceled_cb=None):
+        """
+        Wait until the host's circuit breaker allows attempts
+        """
+        delay = self.circuit_breaker(host).seconds_until_closed
+        if delay:
+            self.stats.increment("backoff_seconds", delay)
+            sleep_unless_canceled(delay, canceled_cb)
+
+
+def sleep_unless_canceled(delay, canceled_cb=None, interval=0.1):
+    """
+    Sleep for delay seconds, checking canceled_cb every interval seconds
+    """
+    deadline = time.time() + delay
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0 or (canceled_cb and canceled_cb()):
+            return
+        time.sleep(min(interval, remaining))
@@ -0,0 +1,116 @@
+"""
+Pooled HTTP sessions, so that worker threads, and long-running commands,
+can reuse their connections to the MyTardis server, instead of opening
+a new connection for each request.
+
+All of MyData's sessions for MyTardis API requests are created by
+create_session, so that each request's latency is recorded for the run
+report and metrics.
+"""
+import threading
+import time
+
+import requests
+
+from .instrumentation import INSTRUMENTATION
+
+
+class InstrumentedSession(requests.Session):
+    """
+    requests.Session which records the latency of each request by
+    MyTardis API endpoint, see Instrumentation.record_api_request
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        # pylint: disable=arguments-differ
+        start_time = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        finally:
+            INSTRUMENTATION.record_api_request(
+                method.upper(), url, time.perf_counter() - start_time)
+
+
+def create_session():
+    """
+    Create a session for MyTardis API requests
+    """
+    return InstrumentedSession()
+
+
+class ApiSessionPool:
+    """
+    Idle requests sessions for MyTardis API requests, including POST
+    uploads, so that later requests (from any thread, and in later upload
+    cycles of long-running commands like "mydata daemon") reuse open
+    connections instead of connecting (and negotiating TLS) again.
+
+    requests.Session isn't guaranteed to be thread-safe, so each session
+    is only used by one request at a time.  If pooling is disabled, each
+    request uses a new session, like requests.get etc.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Return an idle session, or a new one
+        """
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return create_session()
+
+    def release(self, session):
+        """
+        Return a session to the pool, or close it if pooling is disabled
+        """
+        if not self.enabled:
+            session.close()
+            return
+        with self.lock:
+            self.idle.append(session)
+
+    def close(self):
+        """
+        Close all idle sessions, e.g. when the MyTardis URL may have changed
+        """
+        with self.lock:
+            sessions = self.idle
+            self.idle = []
+        for session in sessions:
+            session.close()
+
+    def request(self, method, url, **kwargs):
+        """
+        Make a request with a pooled session, like requests.request
+        """
+        session = self.acquire()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            self.release(session)
+
+    def get(self, url, **kwargs):
+        """
+        Make a GET request with a pooled session, like requests.get
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Make a POST request with a pooled session, like requests.post
+        """
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """
+        Make a PUT request with a pooled session, like requests.put
+        """
+        return self.request("PUT", url, **kwargs)
+
+
+API_SESSION_POOL = ApiSessionPool()
@@ -0,0 +1,150 @@
+"""
+Bandwidth limiting for uploads, shared by all upload workers
+
+The limit (in MB/s, where 1 MB = 1000000 bytes) comes from the
+bandwidth_limit setting in MyData.cfg, or from the bandwidth_schedule
+setting for the current time of day, e.g.
+
+  bandwidth_limit = 0
+  bandwidth_schedule = 08:00-18:00=20, 18:00-08:00=0
+
+uploads at 20 MB/s during the day and at full speed overnight.
+A limit of 0 means unlimited.
+"""
+import re
+import threading
+import time
+from datetime import datetime
+
+from ..conf import settings
+from ..logs import logger
+
+SCHEDULE_ENTRY_REGEX = re.compile(
+    r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*([\d.]+)\s*$"
+)
+
+
+def parse_bandwidth_schedule(schedule):
+    """
+    Parse a bandwidth schedule string, e.g. "08:00-18:00=20, 18:00-08:00=0"
+    into a list of (start_minute, end_minute, limit_mbs) tuples, where
+    the minutes are counted from midnight.  A time range ending before
+    it starts wraps around midnight.
+
+    :raises ValueError: if the schedule can't be parsed
+    """
+    entries = []
+    for entry in schedule.split(","):
+        if not entry.strip():
+            continue
+        match = SCHEDULE_ENTRY_REGEX.match(entry)
+        if not match:
+            raise ValueError("Invalid bandwidth schedule entry: %s" % entry)
+        start_hour, start_min, end_hour, end_min, limit_mbs = match.groups()
+        entries.append(
+            (
+                int(start_hour) * 60 + int(start_min),
+                int(end_hour) * 60 + int(end_min),
+                float(limit_mbs),
+            )
+        )
+    return entries
+
+
+def scheduled_limit(entries, now):
+    """
+    Return the bandwidth limit (in MB/s) from the first schedule entry
+    containing the time now, or None if there isn't one
+    """
+    minute = now.hour * 60 + now.minute
+    for start, end, limit_mbs in entries:
+        if start <= end:
+            if start <= minute < end:
+                return limit_mbs
+        elif minute >= start or minute < end:
+            return limit_mbs
+    return None
+
+
+class BandwidthLimiter:
+    """
+    Token bucket limiting the combined upload rate of all upload workers
+
+    Workers call consume(num_bytes) before sending each chunk.  Tokens
+    (bytes) accumulate at the current rate, up to one second's worth.
+    A worker may overdraw the bucket, but then sleeps until the debt
+    has been repaid, so later workers wait their turn.
+    """
+
+    def __init__(self):
+        self.tokens = 0.0
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+        self._schedule_string = None
+        self._schedule = []
+
+    @property
+    def schedule(self):
+        """
+        The parsed bandwidth_schedule setting, or an empty list if it
+        can't be parsed
+        """
+        schedule_string = settings.miscellaneous.bandwidth_schedule
+        if schedule_string != self._schedule_string:
+            try:
+                self._schedule = parse_bandwidth_schedule(schedule_string)
+            except ValueError as err:
+                logger.warning(str(err))
+                self._schedule = []
+            self._schedule_string = schedule_string
+        return self._schedule
+
+    def current_rate(self, now=None):
+        """
+        The current bandwidth limit in bytes per second, or 0 for unlimited
+        """
+        limit_mbs = scheduled_limit(self.schedule, now or datetime.now())
+        if limit_mbs is None:
+            limit_mbs = settings.miscellaneous.bandwidth_limit
+        return int(limit_mbs * 1000000)
+
+    def chunk_size(self, default_chunk_size):
+        """
+        A chunk size small enough to keep throttled uploads smooth
+        """
+        rate = self.current_rate()
+        if not rate:
+            return default_chunk_size
+        return max(64 * 1024, min(default_chunk_size, rate // 10))
+
+    def consume(self, num_bytes):
+        """
+        Wait until num_bytes can be sent without exceeding the limit
+        """
+        rate = self.current_rate()
+        if not rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.tokens = min(
+                float(rate), self.tokens + (now - self.last_refill) * rate)
+            self.last_refill = now
+            self.tokens -= num_bytes
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def scp_limit_kbits(self, num_threads):
+        """
+        Bandwidth limit for each OpenSSH scp process (for scp's -l option)
+        in Kbit/s, sharing the current limit between num_threads workers,
+        or 0 for unlimited.  The limit is fixed for the lifetime of the
+        scp process.
+        """
+        rate = self.current_rate()
+        if not rate:
+            return 0
+        return max(1, int(rate * 8 / 1000 / max(1, num_threads)))
+
+
+BANDWIDTH_LIMITER = BandwidthLimiter()
@@ -1,26 +1,67 @@
 """
 Upload data using SSH2 protocol library
 """
+import hashlib
 import os
+import shlex
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from tqdm import tqdm
 from ssh2 import session, sftp
+from ssh2.exceptions import SSH2Error
 
 from ..conf import settings
+from ..logs import logger
+from .exceptions import SshException
+from .throttle import BANDWIDTH_LIMITER
 
-
-def read_file_chunks(file_object, chunk_size):
+def read_file_chunks(file_object, chunk_size, max_bytes=None):
     """
     Read data file chunk
+
+    If max_bytes is specified, no more than max_bytes are read.
     """
-    while True:
-        data = file_object.read(chunk_size)
+    remaining = max_bytes
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        data = file_object.read(size)
         if not data:
             break
+        if remaining is not None:
+            remaining -= len(data)
         yield data
 
 
+def write_chunk(write, chunk):
+    """
+    Write a whole chunk using an SSH2 channel or SFTP handle's write
+    method, continuing after any short writes
+
+    ssh2-python's write methods only accept bytes (not memoryviews or
+    bytearrays), so the rest of a chunk is copied after a short write.
+
+    :raises OSError: if nothing could be written
+    """
+    offset = 0
+    while offset < len(chunk):
+        _, bytes_written = write(chunk[offset:] if offset else chunk)
+        if bytes_written <= 0:
+            raise OSError("Wrote %s of %s bytes." % (offset, len(chunk)))
+        offset += bytes_written
+    return offset
+
+
+def get_upload_chunk_size():
+    """
+    Chunk size for SSH2 uploads, reduced if uploads are bandwidth-limited
+    """
+    return BANDWIDTH_LIMITER.chunk_size(
+        settings.miscellaneous.upload_chunk_size)
+
+
 def get_file_mode():
     """
     Remote file attributes
@@ -50,6 +91,26 @@ def execute_command_over_ssh(ssh_session, command):
         raise Exception(" ".join(message))
 
 
+def get_command_output_over_ssh(ssh_session, command):
+    """
+    Execute command over existing SSH session and return its output,
+    or None if the command failed
+    """
+    channel = ssh_session.open_session()
+    channel.execute(command)
+    output = []
+    while True:
+        size, data = channel.read()
+        if size <= 0:
+            break
+        output.append(data)
+    channel.close()
+    channel.wait_closed()
+    if channel.get_exit_status() != 0:
+        return None
+    return b"".join(output).decode("utf-8", "replace")
+
+
 def get_ssh_session(server, auth):
     """
     Open connection and return SSH session
@@ -68,33 +129,389 @@ def get_ssh_session(server, auth):
     return ssh_session
 
 
-def upload_file_ssh(server, auth, file_path, remote_file_path, upload,
-                    progress, thread_num):
+class SshSessionPool:
     """
-    Upload file using SSH, update progress status, cancel upload if requested
+    Idle SSH sessions, which long-running commands (e.g. "mydata daemon")
+    can keep open, so that later uploads to the same staging host don't
+    have to connect and authenticate again.
+
+    ssh2 sessions aren't thread-safe, so each session is only used by one
+    upload at a time.  Sessions which have been idle for longer than
+    max_idle_seconds are closed rather than reused, because the server
+    may have dropped them.  Pooling is disabled by default.
+    """
+
+    def __init__(self, max_idle_seconds=60):
+        self.enabled = False
+        self.max_idle_seconds = max_idle_seconds
+        self.idle = dict()
+        self.lock = threading.Lock()
+
+    def acquire(self, server, auth):
+        """
+        Return an idle session for this server and auth, or a new one,
+        and whether the session was reused
+        """
+        stale = []
+        now = time.time()
+        with self.lock:
+            sessions = self.idle.get((server, tuple(auth)), [])
+            while sessions:
+                sess, released = sessions.pop()
+                if now - released < self.max_idle_seconds:
+                    return sess, True
+                stale.append(sess)
+        for sess in stale:
+            self.discard(sess)
+        return get_ssh_session(server, auth), False
+
+    def release(self, server, auth, sess):
+        """
+        Return a session to the pool after a successful upload
+        """
+        if not self.enabled:
+            self.discard(sess)
+            return
+        with self.lock:
+            self.idle.setdefault((server, tuple(auth)), []).append(
+                (sess, time.time()))
+
+    @staticmethod
+    def discard(sess):
+        """
+        Disconnect a session, ignoring errors from sessions which have
+        already been dropped
+        """
+        try:
+            sess.disconnect()
+        except (SSH2Error, OSError):
+            pass
+
+    def close(self):
+        """
+        Disconnect all idle sessions
+        """
+        with self.lock:
+            sessions = [
+                sess for idle in self.idle.values() for sess, _ in idle]
+            self.idle.clear()
+        for sess in sessions:
+            self.discard(sess)
+
+
+SSH_SESSION_POOL = SshSessionPool()
+
+
+def get_remote_file_size(sftp_session, remote_file_path):
+    """
+    Return the size of a remote file, or 0 if it doesn't exist
     """
-    # pylint: disable=too-many-locals, too-many-statements
-    sess = get_ssh_session(server, auth)
+    try:
+        attrs = sftp_session.stat(remote_file_path)
+    except SSH2Error:
+        return 0
+    return attrs.filesize
+
 
+def remote_tail_matches(sftp_session, file_path, remote_file_path, offset,
+                        num_bytes):
+    """
+    Compare the MD5 checksum of the num_bytes preceding offset in the
+    remote (partially uploaded) file with the same byte range of the
+    local file
+    """
+    start = max(0, offset - num_bytes)
+    with open(file_path, "rb") as local_file:
+        local_file.seek(start)
+        local_md5 = hashlib.md5(local_file.read(offset - start))
+    remote_md5 = hashlib.md5()
+    with sftp_session.open(remote_file_path, sftp.LIBSSH2_FXF_READ,
+                           sftp.LIBSSH2_SFTP_S_IRUSR) as remote_file:
+        remote_file.seek64(start)
+        remaining = offset - start
+        while remaining > 0:
+            size, data = remote_file.read(min(remaining, 1024 * 1024))
+            if size <= 0:
+                break
+            remote_md5.update(data[:remaining])
+            remaining -= size
+    return local_md5.digest() == remote_md5.digest()
+
+
+def get_resume_offset(sess, file_path, remote_file_path, file_size):
+    """
+    Return the number of bytes which can be skipped because they have
+    already been uploaded to staging, or 0 if the upload can't be resumed
+    """
+    if not settings.miscellaneous.resume_uploads:
+        return 0
     try:
-        execute_command_over_ssh(
-            sess,
-            "mkdir -m 2770 -p %s" % os.path.dirname(remote_file_path)
-        )
-    except Exception as err:
-        raise Exception("Can't create remote folder. %s" % str(err)) from err
+        sftp_session = sess.sftp_init()
+    except SSH2Error:
+        logger.debug("SFTP is not available, so uploads can't be resumed.")
+        return 0
+    remote_size = get_remote_file_size(sftp_session, remote_file_path)
+    if remote_size <= 0 or remote_size >= file_size:
+        return 0
+    num_bytes = settings.miscellaneous.resume_verify_bytes
+    if num_bytes and not remote_tail_matches(
+            sftp_session, file_path, remote_file_path, remote_size, num_bytes):
+        logger.warning(
+            "Partial upload of %s doesn't match local file, "
+            "so it won't be resumed." % file_path)
+        return 0
+    logger.debug("Resuming upload of %s from byte %s."
+                 % (file_path, remote_size))
+    return remote_size
 
+
+def send_file_scp(sess, file_path, remote_file_path, upload, progress_bar):
+    """
+    Send the whole file using SCP over an existing SSH session
+    """
     file_info = os.stat(file_path)
     channel = sess.scp_send64(remote_file_path, get_file_mode(),
                               file_info.st_size, file_info.st_mtime,
                               file_info.st_atime)
 
+    with open(file_path, "rb") as local_file:
+        for chunk in read_file_chunks(local_file, get_upload_chunk_size()):
+            BANDWIDTH_LIMITER.consume(len(chunk))
+            bytes_written = write_chunk(channel.write, chunk)
+            if progress_bar:
+                progress_bar.update(bytes_written)
+            if upload.canceled:
+                break
+
+    channel.send_eof()
+    channel.wait_eof()
+
+    channel.close()
+    channel.wait_closed()
+
+
+def send_file_sftp(sess, file_path, remote_file_path, offset, upload,
+                   progress_bar):
+    """
+    Append the local file's content from offset onwards to the
+    (partially uploaded) remote file using SFTP
+    """
+    sftp_session = sess.sftp_init()
+    with sftp_session.open(remote_file_path, sftp.LIBSSH2_FXF_WRITE,
+                           get_file_mode()) as remote_file:
+        remote_file.seek64(offset)
+        with open(file_path, "rb") as local_file:
+            local_file.seek(offset)
+            for chunk in read_file_chunks(
+                    local_file, get_upload_chunk_size()):
+                BANDWIDTH_LIMITER.consume(len(chunk))
+                bytes_written = write_chunk(remote_file.write, chunk)
+                if progress_bar:
+                    progress_bar.update(bytes_written)
+                if upload.canceled:
+                    break
+
+
+def get_byte_ranges(file_size, num_ranges):
+    """
+    Split a file into num_ranges contiguous (start, end) byte ranges
+    """
+    range_size = -(-file_size // num_ranges)
+    return [(start, min(start + range_size, file_size))
+            for start in range(0, file_size, range_size)]
+
+
+def send_byte_range_sftp(server, auth, file_path, remote_file_path,
+                         byte_range, upload, progress_bar):
+    """
+    Send one byte range of the local file to the same offset in the
+    remote file, using SFTP over a new SSH session
+    """
+    # pylint: disable=too-many-locals
+    start, end = byte_range
+    try:
+        sess = get_ssh_session(server, auth)
+    except Exception as err:
+        raise SshException("Can't connect to %s:%s. %s"
+                           % (server[0], server[1], str(err))) from err
+    try:
+        sftp_session = sess.sftp_init()
+        with sftp_session.open(remote_file_path, sftp.LIBSSH2_FXF_WRITE,
+                               get_file_mode()) as remote_file:
+            remote_file.seek64(start)
+            with open(file_path, "rb") as local_file:
+                local_file.seek(start)
+                for chunk in read_file_chunks(
+                        local_file, get_upload_chunk_size(), end - start):
+                    BANDWIDTH_LIMITER.consume(len(chunk))
+                    bytes_written = write_chunk(remote_file.write, chunk)
+                    if progress_bar:
+                        progress_bar.update(bytes_written)
+                    if upload.canceled:
+                        break
+    finally:
+        sess.disconnect()
+
+
+def get_local_md5(file_path):
+    """
+    Calculate the MD5 checksum of a local file
+    """
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as local_file:
+        for data in read_file_chunks(local_file, 1024*1024):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def send_file_parallel(sess, server, auth, file_path, remote_file_path,
+                       file_size, upload, progress_bar):
+    """
+    Send a large file in several byte ranges in parallel, each over its
+    own SSH session, then compare the remote file's MD5 checksum with
+    the local file's (calculated while the ranges are being sent).
+
+    A single SSH stream is limited by one TCP window and one cipher
+    thread, so this can make much better use of a high-latency link.
+
+    :raises SshException: if the checksums don't match
+    """
+    # pylint: disable=too-many-locals
+    sftp_session = sess.sftp_init()
+    # Create (or truncate) the remote file, before the ranges are written:
+    with sftp_session.open(
+            remote_file_path,
+            sftp.LIBSSH2_FXF_WRITE | sftp.LIBSSH2_FXF_CREAT |
+            sftp.LIBSSH2_FXF_TRUNC,
+            get_file_mode()):
+        pass
+
+    byte_ranges = get_byte_ranges(
+        file_size, settings.miscellaneous.parallel_transfer_streams)
+    with ThreadPoolExecutor(max_workers=len(byte_ranges) + 1) as executor:
+        local_md5_future = executor.submit(get_local_md5, file_path)
+        futures = [
+            executor.submit(
+                send_byte_range_sftp, server, auth, file_path,
+                remote_file_path, byte_range, upload, progress_bar)
+            for byte_range in byte_ranges]
+        for future in futures:
+            future.result()
+        local_md5 = local_md5_future.result()
+
+    if upload.canceled:
+        return
+
+    output = get_command_output_over_ssh(
+        sess, "md5sum %s" % shlex.quote(remote_file_path))
+    if output is None:
+        logger.warning(
+            "Couldn't calculate MD5 checksum of %s on staging, so it "
+            "will only be verified by MyTardis." % remote_file_path)
+        return
+    remote_md5 = output.split()[0] if output.strip() else ""
+    if remote_md5 != local_md5:
+        raise SshException(
+            "MD5 checksum of %s on staging (%s) doesn't match local "
+            "checksum (%s)." % (remote_file_path, remote_md5, local_md5))
+
+
+def use_parallel_transfer(file_size):
+    """
+    Return True if a file of size file_size should be sent in several
+    byte ranges in parallel
+    """
+    threshold = settings.miscellaneous.parallel_transfer_threshold
+    return bool(threshold) and file_size >= threshold and \
+        settings.miscellaneous.parallel_transfer_streams > 1
+
+
+def upload_file_ssh(server, auth, file_path, remote_file_path, upload,
+                    progress, thread_num, resume=False):
+    """
+    Upload file using SSH, update progress status, cancel upload if requested
+
+    If resume is True (because the file may have been partially uploaded
+    to staging, e.g. by a previous attempt which failed), and a partial
+    upload of the file is found on staging, only the missing bytes are
+    sent.  Otherwise, staging isn't checked for a partial upload, which
+    would require an SFTP session.
+
+    Files larger than the parallel_transfer_threshold setting are sent
+    in several byte ranges in parallel, each over its own SSH session.
+    A partial upload from a failed parallel transfer can't be resumed
+    (because the ranges may have holes in them), so parallel transfers
+    always start from scratch.
+
+    :raises SshException:
+    """
+    sess = acquire_ssh_session(
+        server, auth, os.path.dirname(remote_file_path))
+    try:
+        send_file_ssh(sess, server, auth, file_path, remote_file_path,
+                      upload, progress, thread_num, resume)
+    except Exception:
+        # The session may have been left part way through a transfer,
+        # so it can't be reused:
+        SSH_SESSION_POOL.discard(sess)
+        raise
+    SSH_SESSION_POOL.release(server, auth, sess)
+
+
+def acquire_ssh_session(server, auth, remote_dir):
+    """
+    Return an SSH session (from SSH_SESSION_POOL) to upload to remote_dir,
+    after creating remote_dir if necessary
+
+    :raises SshException:
+    """
+    sess = None
+    while not sess:
+        try:
+            sess, reused = SSH_SESSION_POOL.acquire(server, auth)
+        except (SSH2Error, OSError) as err:
+            raise SshException("Can't connect to %s:%s. %s"
+                               % (server[0], server[1], str(err))) from err
+
+        try:
+            execute_command_over_ssh(sess, "mkdir -m 2770 -p %s" % remote_dir)
+        except Exception as err:
+            SSH_SESSION_POOL.discard(sess)
+            sess = None
+            # An idle session may have been dropped by the server,
+            # in which case we try again with another session:
+            if not reused:
+                raise SshException("Can't create remote folder. %s"
+                                   % str(err)) from err
+    return sess
+
+
+def send_file_ssh(sess, server, auth, file_path, remote_file_path, upload,
+                  progress, thread_num, resume):
+    """
+    Send a file to staging over an SSH session from acquire_ssh_session,
+    for upload_file_ssh
+
+    :raises SshException:
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    file_size = os.stat(file_path).st_size
+    parallel = use_parallel_transfer(file_size)
+    if parallel or not resume:
+        offset = 0
+    else:
+        offset = get_resume_offset(
+            sess, file_path, remote_file_path, file_size)
+    upload.bytes_resumed = offset
+
     filename = os.path.relpath(file_path, settings.general.data_directory)
 
+    progress_bar = None
     if progress:
         progress_bar = tqdm(
             position=thread_num,
-            total=file_info.st_size,
+            total=file_size,
+            initial=offset,
             desc=filename,
             unit="B",
             unit_scale=True,
@@ -103,32 +520,29 @@ def upload_file_ssh(server, auth, file_path, remote_file_path, upload,
 
     upload.start_time = datetime.now()
 
-    with open(file_path, "rb") as local_file:
-        for data in read_file_chunks(local_file, 32*1024*1024):
-            _, bytes_written = channel.write(data)
-            if progress:
-                progress_bar.update(bytes_written)
-            if upload.canceled:
-                if progress:
-                    progress_bar.close()
-                break
+    try:
+        if parallel:
+            send_file_parallel(sess, server, auth, file_path,
+                               remote_file_path, file_size, upload,
+                               progress_bar)
+        elif offset:
+            send_file_sftp(sess, file_path, remote_file_path, offset, upload,
+                           progress_bar)
+        else:
+            send_file_scp(sess, file_path, remote_file_path, upload,
+                          progress_bar)
+    except (SSH2Error, OSError) as err:
+        raise SshException("Upload of %s failed. %s"
+                           % (filename, str(err))) from err
+    finally:
+        if progress_bar:
+            progress_bar.close()
 
     upload.set_latest_time(datetime.now())
-    upload.bytes_uploaded = file_info.st_size
-
-    if progress:
-        progress_bar.close()
-
-    channel.send_eof()
-    channel.wait_eof()
-
-    channel.close()
-    channel.wait_closed()
+    upload.bytes_uploaded = file_size
 
     try:
         execute_command_over_ssh(sess, "chmod 660 %s" % remote_file_path)
     except Exception as err:
-        raise Exception("Can't set remote file permissions. %s" % str(err)) \
-            from err
-
-    sess.disconnect()
+        raise SshException("Can't set remote file permissions. %s"
+                           % str(err)) from err
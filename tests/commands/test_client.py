@@ -1,6 +1,7 @@
 """
 tests/commands/test_client.py
 """
+import subprocess
 import sys
 
 from unittest.mock import patch
@@ -21,3 +22,54 @@ def test_run_command(capsys):
     assert sys_exit_raised
     captured = capsys.readouterr()
     assert "A command-line tool for uploading data to MyTardis" in captured.out
+
+
+# Modules which are slow to import, and only needed for uploading:
+UPLOAD_MODULES = [
+    "inflect",
+    "netifaces",
+    "psutil",
+    "requests",
+    "requests_toolbelt",
+    "ssh2",
+    "tqdm",
+]
+
+# Runs the CLI, then lists the imported modules on stderr:
+CLI_SCRIPT = """
+import atexit, sys
+atexit.register(lambda: print("modules:", *sys.modules, file=sys.stderr))
+from mydata.client import run
+run()
+"""
+
+
+def run_cli_and_list_modules(*args):
+    """Run the CLI, and return the names of the imported modules
+    (including those imported with importlib)
+    """
+    process = subprocess.run(
+        [sys.executable, "-c", CLI_SCRIPT] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    for line in process.stderr.splitlines():
+        if line.startswith("modules:"):
+            return set(line.split()[1:])
+    return set()
+
+
+def test_lazy_imports():
+    """Test that subcommands, settings and upload modules are only
+    imported when needed, keeping the CLI's startup time down
+    """
+    modules = run_cli_and_list_modules("version")
+    assert "mydata.commands.version" in modules
+    assert "mydata.commands.upload" not in modules
+    assert "mydata.models.settings" not in modules
+    for module in UPLOAD_MODULES:
+        assert module not in modules
+
+    modules = run_cli_and_list_modules("config", "discover")
+    assert "mydata.models.settings" in modules
+    for module in UPLOAD_MODULES:
+        assert module not in modules
@@ -0,0 +1,65 @@
+"""
+tests/commands/test_profile_option.py
+"""
+import pytest
+from click.testing import CliRunner
+
+from mydata.client import entry_point
+from mydata.commands.version import version_cmd
+
+
+@pytest.mark.parametrize("mode", ["cpu", "sample", "mem"])
+def test_profile_option(mode, tmp_path):
+    """Test profiling a command with each profiling mode
+    """
+    import pstats
+
+    entry_point.add_command(version_cmd)
+    output_path = tmp_path / ("profile.%s" % mode)
+    runner = CliRunner()
+    result = runner.invoke(
+        entry_point,
+        ["--profile", mode, "--profile-output", str(output_path), "version"])
+    assert result.exit_code == 0
+    assert result.output.startswith("MyData Command-Line Client")
+    assert "Wrote %s profile to: %s" % (mode, output_path) in result.output
+    assert output_path.exists()
+    if mode == "cpu":
+        stats = pstats.Stats(str(output_path))
+        assert any(
+            function_name == "version_cmd"
+            for _, _, function_name in stats.stats)
+    elif mode == "sample":
+        assert "stack samples" in result.output
+    else:
+        assert "Snapshot: exit" in output_path.read_text()
+        assert "Largest allocations:" in result.output
+
+
+def test_stack_sampler(tmp_path):
+    """Test sampling the stacks of other threads
+    """
+    import threading
+
+    from mydata.utils.profiling import StackSampler
+
+    def busy_function(stopping):
+        while not stopping.is_set():
+            sum(range(1000))
+
+    stopping = threading.Event()
+    thread = threading.Thread(
+        target=busy_function, args=(stopping,), name="upload_1")
+    thread.start()
+    sampler = StackSampler(str(tmp_path / "profile.folded"))
+    for _ in range(5):
+        sampler.sample()
+    stopping.set()
+    thread.join()
+    sampler.stopping.set()
+
+    upload_stacks = [
+        stack for stack in sampler.stacks if stack.startswith("upload;")]
+    assert upload_stacks
+    assert all("busy_function (test_profile_option.py:" in stack
+               for stack in upload_stacks)
@@ -0,0 +1,13 @@
+"""
+tests/conftest.py
+"""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolate_validation_cache(monkeypatch, tmp_path):
+    """Use a separate settings validation cache for each test, so that
+    results cached by one test (or by running MyData) can't affect another
+    """
+    monkeypatch.setenv(
+        "MYDATA_VALIDATION_CACHE", str(tmp_path / "validation-cache.json"))
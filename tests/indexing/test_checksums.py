@@ -0,0 +1,105 @@
+"""
+Test calculating and caching checksums for indexing
+"""
+import hashlib
+import os
+
+
+def test_calculate_checksums(tmp_path):
+    """
+    Test calculating several digests while reading a file once
+    """
+    from mydata.utils.checksums import calculate_checksums
+
+    content = os.urandom(100000)
+    path = os.path.join(str(tmp_path), "file.bin")
+    with open(path, "wb") as file_object:
+        file_object.write(content)
+
+    assert calculate_checksums(path, ("md5", "blake2b")) == dict(
+        md5=hashlib.md5(content).hexdigest(),
+        blake2b=hashlib.blake2b(content).hexdigest(),
+    )
+
+
+def test_checksum_cache(tmp_path, monkeypatch):
+    """
+    Test that unchanged files aren't hashed again, even by a new process
+    """
+    from mydata.utils import checksums
+    from mydata.utils.checksums import ChecksumCache, ChecksumService
+
+    paths = []
+    for index in range(2):
+        paths.append(os.path.join(str(tmp_path), "file%d.txt" % index))
+        with open(paths[-1], "w") as file_object:
+            file_object.write("same content")
+
+    calculated = []
+    calculate_checksums = checksums.calculate_checksums
+
+    def counting_calculate_checksums(path, algorithms):
+        calculated.append(path)
+        return calculate_checksums(path, algorithms)
+
+    monkeypatch.setattr(
+        checksums, "calculate_checksums", counting_calculate_checksums)
+
+    cache_path = os.path.join(str(tmp_path), "cache", "checksums.sqlite3")
+    service = ChecksumService(ChecksumCache(cache_path), ("md5", "sha1"))
+    md5sum = hashlib.md5(b"same content").hexdigest()
+    assert service.md5sum(paths[0]) == md5sum
+    assert service.md5sum(paths[0]) == md5sum
+    assert calculated == [paths[0]]
+    service.md5sum(paths[1])
+    assert service.cache.duplicates("sha1", str(tmp_path)) == [paths]
+    assert service.cache.duplicates("sha1", str(tmp_path / "cache")) == []
+    service.cache.close()
+
+    service = ChecksumService(ChecksumCache(cache_path), ("md5", "sha1"))
+    assert service.md5sum(paths[0]) == md5sum
+    assert len(calculated) == 2
+
+    # Modified files are hashed again:
+    with open(paths[0], "w") as file_object:
+        file_object.write("new content")
+    assert service.cache.duplicates("sha1", str(tmp_path)) == []
+    assert service.md5sum(paths[0]) == hashlib.md5(b"new content").hexdigest()
+    assert len(calculated) == 3
+
+    # Extra digests which weren't cached are calculated:
+    service = ChecksumService(service.cache, ("md5", "blake2b"))
+    service.md5sum(paths[1])
+    assert len(calculated) == 4
+    service.cache.close()
+
+
+def test_report_duplicates(tmp_path, capsys):
+    """
+    Test reporting duplicate files found using an extra digest
+    """
+    from mydata.tasks.indexing import report_duplicates
+    from mydata.utils.checksums import ChecksumCache, ChecksumService
+
+    paths = []
+    for filename in ("a.txt", "b.txt", "c.txt"):
+        paths.append(os.path.join(str(tmp_path), "dataset", filename))
+        os.makedirs(os.path.dirname(paths[-1]), exist_ok=True)
+        with open(paths[-1], "w") as file_object:
+            file_object.write("c" if filename == "c.txt" else "same content")
+
+    cache = ChecksumCache(os.path.join(str(tmp_path), "checksums.sqlite3"))
+    service = ChecksumService(cache, ("md5", "blake2b"))
+    for path in paths:
+        service.md5sum(path)
+
+    report_duplicates(cache, ("md5",), os.path.dirname(paths[0]))
+    assert capsys.readouterr().out == ""
+    report_duplicates(cache, service.algorithms, os.path.dirname(paths[0]))
+    assert capsys.readouterr().out.splitlines() == [
+        "Duplicate files (same size and blake2b digest):",
+        "    %s" % paths[0],
+        "    %s" % paths[1],
+        "",
+    ]
+    cache.close()
@@ -15,6 +15,7 @@ from click.testing import CliRunner
 from tests.mocks import (
     mock_testfacility_user_response,
     mock_birds_flowers_datafile_lookups,
+    mock_birds_flowers_datafile_listings,
     created_dataset_response,
     EMPTY_LIST_RESPONSE,
     FLOWERS_DATASET_ID,
@@ -22,10 +23,11 @@ from tests.mocks import (
 )
 
 
-def test_indexing():
+def test_indexing(tmp_path):
     """
     Test indexing of already-uploaded data
     """
+    # pylint: disable=too-many-locals
     from mydata.commands.index import index_cmd
 
     env = dict(
@@ -40,6 +42,7 @@ def test_indexing():
             os.path.join(".", "tests", "testdata", "testdata-dataset")
         ),
         MYTARDIS_EXP_ID="123",
+        MYTARDIS_CHECKSUM_CACHE=os.path.join(str(tmp_path), "checksums.sqlite3"),
     )
 
     runner = CliRunner()
@@ -49,6 +52,7 @@ def test_indexing():
     with requests_mock.Mocker() as mocker:
         mock_testfacility_user_response(mocker, env["MYTARDIS_URL"])
         mock_birds_flowers_datafile_lookups(mocker)
+        mock_birds_flowers_datafile_listings(mocker)
         for folder_name in ("Birds", "Flowers"):
             folder_path = os.path.join(env["MYTARDIS_STORAGE_BOX_PATH"], folder_name)
 
@@ -95,6 +99,8 @@ def test_indexing():
                 "Birds": Template(
                     textwrap.dedent(
                         """\
+                    Couldn't list existing DataFile records, so looking up files individually.
+
                     File path: $cwd/tests/testdata/testdata-dataset/Birds/1024px-Australian_Birds_@_Jurong_Bird_Park_(4374195521).jpg
                     size: 116537
                     mimetype: image/jpeg
@@ -185,3 +191,62 @@ def test_indexing_missing_settings():
         Set a data source path with MYTARDIS_SRC_PATH
     """
     )
+
+
+def test_walk_dataset_folder(tmp_path, monkeypatch):
+    """
+    Test listing a dataset folder's files with concurrent walkers,
+    in the same order as os.walk
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from mydata.tasks.indexing import walk_dataset_folder
+
+    dataset_root_dir = os.path.join(str(tmp_path), "Dataset1")
+    for subdir in ("", "a", os.path.join("a", "b"), "c"):
+        os.makedirs(os.path.join(dataset_root_dir, subdir), exist_ok=True)
+        for filename in ("2.txt", "1.txt"):
+            with open(os.path.join(dataset_root_dir, subdir, filename), "w"):
+                pass
+    monkeypatch.setenv("MYTARDIS_STORAGE_BOX_PATH", str(tmp_path))
+    monkeypatch.setenv("MYTARDIS_SRC_PATH", "/src")
+
+    expected = []
+    for dirname, subdirs, files in os.walk(dataset_root_dir):
+        subdirs.sort()
+        for filename in sorted(files):
+            expected.append(os.path.relpath(
+                os.path.join(dirname, filename), str(tmp_path)))
+
+    with ThreadPoolExecutor(4) as executor:
+        tasks = list(walk_dataset_folder(dataset_root_dir, executor))
+    assert [task.uri for task in tasks] == expected
+    assert tasks[0].directory == ""
+    assert tasks[2].directory == "a"
+    assert tasks[4].filepath == "/src/Dataset1/a/b/1.txt"
+
+
+def test_list_dataset_datafiles(monkeypatch):
+    """
+    Test listing a dataset's DataFile records in pages, to look up its files
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from mydata.tasks.indexing import list_dataset_datafiles
+    from mydata.indexing.models.lookup import LookupStatus
+
+    monkeypatch.setenv("MYTARDIS_URL", "https://www.example.com")
+    monkeypatch.setenv("MYTARDIS_INDEX_PAGE_SIZE", "2")
+
+    with requests_mock.Mocker() as mocker:
+        mock_birds_flowers_datafile_listings(mocker, page_size=2)
+        with ThreadPoolExecutor(2) as executor:
+            datafile_index = list_dataset_datafiles(FLOWERS_DATASET_ID, executor)
+        assert list_dataset_datafiles(BIRDS_DATASET_ID) is None
+
+    assert len(datafile_index.statuses) == 3
+    lookup = datafile_index.lookup("1024px-Colourful_flowers.JPG", "")
+    assert lookup.status == LookupStatus.FOUND_VERIFIED
+    assert lookup.dataset_id == FLOWERS_DATASET_ID
+    lookup = datafile_index.lookup("Pond_Water_Hyacinth_Flowers.jpg", "")
+    assert lookup.status == LookupStatus.FOUND_UNVERIFIED_NO_DFOS
+    lookup = datafile_index.lookup("1024px-Colourful_flowers.JPG", "subdir")
+    assert lookup.status == LookupStatus.NOT_FOUND
@@ -0,0 +1,70 @@
+"""
+Test MyData's logger
+"""
+
+
+def log_from_function(logger):
+    """Log messages from a known function
+    """
+    logger.debug("Debug message")
+    try:
+        raise ValueError("Logged exception")
+    except ValueError:
+        logger.exception("Exception message")
+
+
+def test_logger(tmp_path, monkeypatch):
+    """Test logging caller information, and writing the log file
+    from a background thread
+    """
+    monkeypatch.setenv("MYDATA_DEBUG_LOG_PATH", str(tmp_path))
+    monkeypatch.setenv("MYDATA_DEBUG_LOG_LEVEL", "DEBUG")
+    from mydata.logs import Logger
+
+    logger = Logger("MyDataTestLogger")
+    log_from_function(logger)
+
+    log_output = logger.get_value()
+    assert (
+        "tests/logs/test_logger.py - 9 - log_from_function - DEBUG - "
+        "Debug message" in log_output
+    )
+    assert "log_from_function - ERROR - Exception message" in log_output
+    assert "ValueError: Logged exception" in log_output
+
+    logger.flush()
+    with open(str(tmp_path / ".MyData_debug_log.txt")) as log_file:
+        log_file_contents = log_file.read()
+    assert "log_from_function - DEBUG - Debug message" in log_file_contents
+    assert "ValueError: Logged exception" in log_file_contents
+
+
+def test_bounded_logs(tmp_path, monkeypatch):
+    """Test keeping a limited number of recent logs in memory,
+    and rotating and compressing the log file
+    """
+    import gzip
+
+    monkeypatch.setenv("MYDATA_DEBUG_LOG_PATH", str(tmp_path))
+    monkeypatch.setenv("MYDATA_LOG_BUFFER_RECORDS", "10")
+    monkeypatch.setenv("MYDATA_DEBUG_LOG_MAX_BYTES", "1000")
+    monkeypatch.setenv("MYDATA_DEBUG_LOG_BACKUPS", "2")
+    from mydata.logs import Logger
+
+    logger = Logger("MyDataBoundedTestLogger")
+    for message_num in range(100):
+        logger.info("Message %s" % message_num)
+
+    log_lines = logger.get_value().splitlines()
+    assert len(log_lines) == 10
+    assert log_lines[0].endswith("Message 90")
+    assert log_lines[-1].endswith("Message 99")
+
+    logger.flush()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        ".MyData_debug_log.txt",
+        ".MyData_debug_log.txt.1.gz",
+        ".MyData_debug_log.txt.2.gz",
+    ]
+    with gzip.open(str(tmp_path / ".MyData_debug_log.txt.1.gz"), "rt") as log_file:
+        assert "Message" in log_file.read()
@@ -372,6 +372,12 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                             self.modified = match1.group(1)
                             self.accessed = match1.group(2)
                             buf = ""
+                            # Wait for the client to receive the
+                            # acknowledgement and send the next message:
+                            while not self.chan.recv_ready():
+                                if SshRequestHandler.NEED_TO_ABORT:
+                                    return
+                                time.sleep(0.01)
                             while self.chan.recv_ready():
                                 if SshRequestHandler.NEED_TO_ABORT:
                                     return
@@ -439,15 +445,21 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                                 return
                             time.sleep(0.01)
 
+                        # The file content is followed by a null byte.
+                        # A short read doesn't mean the end of the
+                        # content, because the client may send it in
+                        # chunks smaller than chunk_size:
                         chunk_size = 1024
-                        while True:
+                        remaining = self.file_size + 1
+                        while remaining > 0:
                             if SshRequestHandler.NEED_TO_ABORT:
                                 return
-                            chunk = self.chan.recv(chunk_size)
+                            chunk = self.chan.recv(min(chunk_size, remaining))
+                            if not chunk:
+                                break
                             proc.stdin.write(chunk)
                             proc.stdin.flush()
-                            if len(chunk) < chunk_size:
-                                break
+                            remaining -= len(chunk)
                     except Exception:  # pylint: disable=broad-except
                         logger.error("read_file_content error.")
                         logger.error(traceback.format_exc())
@@ -563,6 +575,9 @@ class ThreadedSshServer(ThreadedTCPServer):
 
     def __init__(self, address):
         self.host_key = DEFAULT_HOST_KEY
+        # Don't abort this server's requests after a failed transfer
+        # to a server started by an earlier test:
+        SshRequestHandler.NEED_TO_ABORT = False
         # pylint: disable=non-parent-init-called
         socketserver.TCPServer.__init__(self, address, SshRequestHandler)
 
@@ -466,6 +466,48 @@ def mock_birds_flowers_datafile_lookups(mocker, api_prefix=""):
     mocker.post(post_datafile_url, status_code=201)
 
 
+def flowers_datafile_records():
+    """Return the DataFile records in the Flowers dataset used in tests
+    """
+    records = []
+    for filename in (
+        "1024px-Colourful_flowers.JPG",
+        "Flowers_growing_on_the_campus_of_Cebu_City_National_Science_High_School.jpg",
+    ):
+        record = json.loads(VERIFIED_DATAFILE_RESPONSE)["objects"][0]
+        record["filename"] = filename
+        records.append(record)
+    record = json.loads(UNVERIFIED_DATAFILE_NO_DFOS_RESPONSE)["objects"][0]
+    record["filename"] = "Pond_Water_Hyacinth_Flowers.jpg"
+    records.append(record)
+    return records
+
+
+def mock_birds_flowers_datafile_listings(mocker, page_size=1000, api_prefix=""):
+    """Mock the listings of the Birds and Flowers datasets' DataFile records
+    used in tests.  Listing the Birds dataset's records fails, so its files
+    are looked up individually.
+    """
+    records = flowers_datafile_records()
+    for offset in range(0, len(records), page_size):
+        response_dict = json.loads(
+            build_list_response(records[offset:offset + page_size]))
+        response_dict["meta"]["total_count"] = len(records)
+        mocker.get(
+            "/api/v1/%sdataset_file/?format=json&dataset__id=%s&order_by=id"
+            "&limit=%s&offset=%s"
+            % (api_prefix, FLOWERS_DATASET_ID, page_size, offset),
+            text=json.dumps(response_dict),
+        )
+    mocker.get(
+        "/api/v1/%sdataset_file/?format=json&dataset__id=%s&order_by=id"
+        "&limit=%s&offset=0"
+        % (api_prefix, BIRDS_DATASET_ID, page_size),
+        text=json.dumps({"error_message": "Bad Request"}),
+        status_code=400,
+    )
+
+
 def mock_exp_creation(mocker, settings, title, user_folder_name):
     """Mock the creation of experiments and their ObjectACLs
     """
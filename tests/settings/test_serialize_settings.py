@@ -54,3 +54,37 @@ def test_write_settings(set_exp_dataset_config):
 
     assert settings.general.contact_name == "Joe Bloggs"
     assert settings.general.contact_email == "Joe.Bloggs@example.com"
+
+
+def test_read_miscellaneous_settings(set_exp_dataset_config, tmp_path):
+    """Test reading miscellaneous settings as the types in their table,
+    and saving every one of them
+    """
+    from mydata.models.settings.miscellaneous import FIELDS
+    from mydata.models.settings.serialize import save_settings_to_disk, load_settings
+    from mydata.conf import settings
+
+    config_path = str(tmp_path / "MyData.cfg")
+    with open(config_path, "w", encoding="utf-8") as config_file:
+        config_file.write(
+            "[MyData]\n"
+            "resume_uploads = False\n"
+            "resume_verify_bytes = 4096\n"
+            "upload_chunk_size = 1 MB\n"
+            "bandwidth_limit = 2.5\n"
+            "local_copy_fsync = directory\n"
+        )
+    load_settings(config_path)
+
+    assert settings.miscellaneous.resume_uploads is False
+    assert settings.miscellaneous.resume_verify_bytes == 4096
+    # Malformed values are replaced by their defaults:
+    assert settings.miscellaneous.upload_chunk_size == FIELDS["upload_chunk_size"][1]
+    assert settings.miscellaneous.bandwidth_limit == 2.5
+    assert settings.miscellaneous.local_copy_fsync == "directory"
+
+    save_settings_to_disk(config_path)
+    with open(config_path, encoding="utf-8") as config_file:
+        saved = config_file.read()
+    for field in FIELDS:
+        assert "\n%s = " % field in saved
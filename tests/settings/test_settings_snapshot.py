@@ -0,0 +1,64 @@
+"""
+Test frozen settings snapshots.
+"""
+import pickle
+
+import pytest
+
+from tests.fixtures import set_exp_dataset_config
+
+
+def test_settings_snapshot(set_exp_dataset_config, tmp_path):
+    """Test taking, reading, pickling and applying a settings snapshot
+    """
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.settings.snapshot import SettingsSnapshot
+
+    includes_file_path = tmp_path / "includes.txt"
+    includes_file_path.write_text("# Includes comment\n; Comment\n\n*.jpg\nzero*\n")
+    settings.filters.use_includes_file = True
+    settings.filters.includes_file = str(includes_file_path)
+
+    snapshot = SettingsSnapshot(settings)
+    assert snapshot.instrument_name == settings.general.instrument_name
+    assert snapshot["folder_structure"] == settings.advanced.folder_structure
+    assert snapshot.config_path == settings.config_path
+    assert snapshot.ignore_old_datasets_interval_seconds == \
+        settings.filters.ignore_old_datasets_interval_seconds
+    with pytest.raises(KeyError):
+        _ = snapshot["includes_pattern"]
+
+    # Globs are compiled once, and match like fnmatch:
+    for filename in ("image.jpg", "zero_sized_file.txt", "file.txt", "jpg"):
+        assert snapshot.matches_includes(filename) == \
+            Folder.matches_includes(filename)
+    assert not snapshot.matches_excludes("file.bak")
+
+    with pytest.raises(AttributeError):
+        snapshot.instrument_name = "Changed"
+    with pytest.raises(AttributeError):
+        snapshot.new_attribute = True
+
+    # Changing the settings doesn't change the snapshot:
+    old_instrument_name = settings.general.instrument_name
+    settings.general.instrument_name = "Changed"
+    assert snapshot.instrument_name == old_instrument_name
+
+    unpickled = pickle.loads(pickle.dumps(snapshot))
+    assert unpickled.instrument_name == old_instrument_name
+    assert unpickled.matches_includes("image.jpg")
+
+    # e.g. in a worker process:
+    unpickled.apply(settings)
+    assert settings.general.instrument_name == old_instrument_name
+
+
+def test_settings_snapshot_declarations(set_exp_dataset_config):
+    """Test that the snapshot declares exactly the fields it copies
+    """
+    from mydata.models.settings.snapshot import (
+        DERIVED_FIELDS, FIELDS, SettingsSnapshot)
+
+    declared = list(SettingsSnapshot.__annotations__)
+    assert sorted(declared) == sorted(FIELDS + DERIVED_FIELDS)
@@ -0,0 +1,69 @@
+"""
+Test caching settings validation results.
+"""
+import json
+import os
+
+import requests_mock
+
+from tests.mocks import (
+    mock_testfacility_user_response,
+    MOCK_API_ENDPOINTS_RESPONSE,
+    mock_test_facility_response,
+    mock_test_instrument_response,
+)
+
+from tests.fixtures import set_exp_dataset_config
+
+
+def test_validation_cache(set_exp_dataset_config, monkeypatch, tmp_path):
+    """Test skipping MyTardis validation checks which have been cached for
+    unchanged settings, while still checking the folder structure
+    """
+    from mydata.conf import settings
+    from mydata.models.settings.validation import validate_settings
+
+    with requests_mock.Mocker() as mocker:
+        mocker.get(
+            "%s/api/v1/?format=json" % settings.general.mytardis_url,
+            text=MOCK_API_ENDPOINTS_RESPONSE)
+        mock_testfacility_user_response(mocker, settings.general.mytardis_url)
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+
+        assert validate_settings() == 2
+        num_requests = mocker.call_count
+        assert num_requests > 0
+
+        # Cached results are reused, so no requests are made:
+        assert validate_settings() == 2
+        assert mocker.call_count == num_requests
+
+        # Credentials are hashed, not stored:
+        cache_path = tmp_path / "validation-cache.json"
+        assert settings.general.api_key not in cache_path.read_text()
+        assert len(json.loads(cache_path.read_text())) == 1
+
+        # The folder structure is checked again, so new datasets are counted:
+        new_dataset_path = os.path.join(
+            settings.general.data_directory, "Exp1", "New Dataset")
+        os.makedirs(new_dataset_path)
+        try:
+            assert validate_settings() == 3
+        finally:
+            os.rmdir(new_dataset_path)
+        assert mocker.call_count == num_requests
+
+        # Changing a setting which a check depends on invalidates it:
+        old_value = settings.general.api_key
+        settings.general.api_key = "new_api_key"
+        validate_settings()
+        assert mocker.call_count > num_requests
+        settings.general.api_key = old_value
+
+        # Expired results aren't reused:
+        num_requests = mocker.call_count
+        monkeypatch.setenv("MYDATA_VALIDATION_CACHE_TTL", "0")
+        validate_settings()
+        assert mocker.call_count > num_requests
+        monkeypatch.delenv("MYDATA_VALIDATION_CACHE_TTL")
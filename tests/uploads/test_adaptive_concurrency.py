@@ -0,0 +1,106 @@
+"""
+Test adjusting the number of active upload workers
+"""
+from datetime import datetime, timedelta
+
+
+class FakeUpload:
+    """
+    Stand-in for mydata.models.upload.Upload
+    """
+
+    def __init__(self, status, num_bytes, seconds, transfer_started=True):
+        self.status = status
+        self.transfer_started = transfer_started
+        self.bytes_uploaded = num_bytes
+        self.bytes_resumed = 0
+        self.latest_time = datetime.now()
+        self.start_time = self.latest_time - timedelta(seconds=seconds)
+
+
+def test_adaptive_concurrency():
+    """Test additive increase and multiplicative decrease of active workers
+    """
+    from mydata.models.upload import UploadStatus
+    from mydata.utils.concurrency import AdaptiveConcurrency
+
+    concurrency = AdaptiveConcurrency(2, 8, interval=0)
+    assert concurrency.limit == 2
+    assert concurrency.is_active(1)
+    assert not concurrency.is_active(2)
+
+    # Throughput improving:
+    for num_bytes in (1000, 2000, 3000, 4000):
+        concurrency.interval_start -= 1
+        concurrency.record_upload(
+            FakeUpload(UploadStatus.COMPLETED, num_bytes, 1))
+    assert concurrency.limit == 6
+
+    # Throughput falling:
+    concurrency.interval_start -= 1
+    concurrency.record_upload(FakeUpload(UploadStatus.COMPLETED, 1000, 1))
+    assert concurrency.limit == 3
+
+    # Throughput steady, but each file taking longer:
+    concurrency.interval_start -= 1
+    concurrency.record_upload(FakeUpload(UploadStatus.COMPLETED, 1000, 5))
+    assert concurrency.limit == 2
+
+    # Never fewer than the minimum, even after failures:
+    concurrency.record_upload(FakeUpload(UploadStatus.FAILED, 0, 1))
+    assert concurrency.limit == 2
+
+    # Never more than the maximum:
+    for num_bytes in range(1, 20):
+        concurrency.interval_start -= 1
+        concurrency.record_upload(
+            FakeUpload(UploadStatus.COMPLETED, num_bytes * 1000, 1))
+    assert concurrency.limit == 8
+
+
+def test_skipped_files_are_not_failures():
+    """Test that files which failed before they were transferred, e.g.
+    because they were too new, don't reduce the number of workers
+    """
+    from mydata.models.upload import UploadStatus
+    from mydata.utils.concurrency import AdaptiveConcurrency
+
+    concurrency = AdaptiveConcurrency(2, 8, interval=0)
+    concurrency.interval_start -= 1
+    concurrency.record_upload(FakeUpload(UploadStatus.COMPLETED, 1000, 1))
+    assert concurrency.limit == 3
+
+    concurrency.interval_start -= 1
+    concurrency.record_upload(
+        FakeUpload(UploadStatus.FAILED, 0, 0, transfer_started=False))
+    assert concurrency.limit == 3
+
+    concurrency.interval_start -= 1
+    concurrency.record_upload(FakeUpload(UploadStatus.FAILED, 0, 1))
+    assert concurrency.limit == 2
+
+
+def test_inactive_worker_puts_file_back():
+    """Test that a worker which was already waiting for a file when the
+    limit was lowered puts the file back in the queue, for an active worker
+    """
+    import asyncio
+
+    from mydata.tasks.uploads import upload_file_worker
+    from mydata.utils.concurrency import AdaptiveConcurrency
+
+    concurrency = AdaptiveConcurrency(4, 8)
+
+    async def run_worker():
+        queue = asyncio.Queue()
+        worker = asyncio.create_task(
+            upload_file_worker("worker-3", queue, None,
+                               concurrency=concurrency))
+        await asyncio.sleep(0)
+        concurrency.limit = 2
+        queue.put_nowait(("folder", "lookup", "upload", {}, None))
+        await asyncio.sleep(0.05)
+        worker.cancel()
+        return queue.qsize()
+
+    assert asyncio.run(run_worker()) == 1
@@ -0,0 +1,60 @@
+"""
+Test limiting upload bandwidth
+"""
+import time
+from datetime import datetime
+
+import pytest
+
+from tests.fixtures import set_username_dataset_config
+
+
+def test_bandwidth_schedule(set_username_dataset_config):
+    """Test parsing time-of-day bandwidth schedules
+    """
+    from mydata.utils.throttle import parse_bandwidth_schedule, scheduled_limit
+
+    entries = parse_bandwidth_schedule("08:00-18:00=20, 18:00-08:00=0")
+    assert entries == [(480, 1080, 20.0), (1080, 480, 0.0)]
+    assert scheduled_limit(entries, datetime(2020, 1, 1, 8, 0)) == 20.0
+    assert scheduled_limit(entries, datetime(2020, 1, 1, 17, 59)) == 20.0
+    assert scheduled_limit(entries, datetime(2020, 1, 1, 18, 0)) == 0.0
+    assert scheduled_limit(entries, datetime(2020, 1, 1, 3, 0)) == 0.0
+
+    entries = parse_bandwidth_schedule("09:00-12:30=5.5")
+    assert scheduled_limit(entries, datetime(2020, 1, 1, 12, 29)) == 5.5
+    assert scheduled_limit(entries, datetime(2020, 1, 1, 12, 30)) is None
+
+    assert parse_bandwidth_schedule("") == []
+    with pytest.raises(ValueError):
+        parse_bandwidth_schedule("daytime=20")
+
+
+def test_bandwidth_limiter(set_username_dataset_config):
+    """Test the token bucket bandwidth limiter
+    """
+    from mydata.conf import settings
+    from mydata.utils.throttle import BandwidthLimiter
+
+    limiter = BandwidthLimiter()
+    assert limiter.current_rate() == 0
+    assert limiter.scp_limit_kbits(5) == 0
+    assert limiter.chunk_size(32 * 1024 * 1024) == 32 * 1024 * 1024
+
+    settings.miscellaneous.mydata_config["bandwidth_limit"] = 1.0
+    assert limiter.current_rate() == 1000000
+    assert limiter.scp_limit_kbits(4) == 2000
+    assert limiter.chunk_size(32 * 1024 * 1024) == 100000
+
+    settings.miscellaneous.mydata_config["bandwidth_schedule"] = \
+        "00:00-00:00=0, 00:00-23:59=2"
+    assert limiter.current_rate(datetime(2020, 1, 1, 12, 0)) == 2000000
+
+    # An invalid schedule is ignored:
+    settings.miscellaneous.mydata_config["bandwidth_schedule"] = "invalid"
+    assert limiter.current_rate() == 1000000
+
+    start = time.time()
+    for _ in range(3):
+        limiter.consume(100000)
+    assert time.time() - start >= 0.25
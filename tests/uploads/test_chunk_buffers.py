@@ -0,0 +1,117 @@
+"""
+Test reading and sending upload chunks
+"""
+import io
+import os
+
+import pytest
+
+from tests.fixtures import (
+    set_username_dataset_config,
+    mock_key_pair,
+    mock_scp_server,
+    mock_staging_path,
+)
+
+
+def test_read_file_chunks_into_buffer(set_username_dataset_config):
+    """Test reading chunks into this thread's reusable buffer, for copies
+    to a locally mounted staging area
+    """
+    from mydata.utils.localcopy import read_file_chunks_into_buffer
+
+    content = os.urandom(10000)
+    chunks = []
+    buffers = set()
+    for chunk in read_file_chunks_into_buffer(io.BytesIO(content), 4096):
+        buffers.add(id(chunk))
+        chunks.append(bytes(chunk))
+    assert b"".join(chunks) == content
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 1808]
+    # Both full chunks were read into the same buffer:
+    assert len(buffers) == 2
+
+
+def test_read_file_chunks(set_username_dataset_config):
+    """Test reading chunks of a byte range, for SSH2 uploads
+    """
+    from mydata.utils.upload import read_file_chunks
+
+    content = os.urandom(10000)
+    file_object = io.BytesIO(content)
+    file_object.seek(1000)
+    chunks = list(read_file_chunks(file_object, 4096, max_bytes=5000))
+    assert b"".join(chunks) == content[1000:6000]
+    assert [len(chunk) for chunk in chunks] == [4096, 904]
+
+
+def test_write_chunk(set_username_dataset_config):
+    """Test continuing after short writes
+    """
+    from mydata.utils.upload import write_chunk
+
+    written = []
+
+    def short_write(data):
+        written.append(bytes(data[:1000]))
+        return 0, len(written[-1])
+
+    content = os.urandom(2500)
+    assert write_chunk(short_write, content) == 2500
+    assert b"".join(written) == content
+    assert len(written) == 3
+
+    with pytest.raises(OSError):
+        write_chunk(lambda data: (0, 0), content)
+
+
+def test_send_file_scp(
+        set_username_dataset_config, mock_key_pair, mock_scp_server,
+        mock_staging_path):
+    """Test sending a file in several chunks through a real SSH2 channel
+    (whose write method only accepts bytes)
+    """
+    # pylint: disable=redefined-outer-name
+    from mydata.conf import settings
+    from mydata.utils.upload import get_ssh_session, send_file_scp
+
+    settings.miscellaneous.mydata_config["upload_chunk_size"] = 1000
+    content = os.urandom(2500)
+    file_path = os.path.join(mock_staging_path, "source.bin")
+    with open(file_path, "wb") as source_file:
+        source_file.write(content)
+    remote_file_path = os.path.join(mock_staging_path, "copy.bin")
+
+    class FakeUpload:
+        """
+        Stand-in for mydata.models.upload.Upload
+        """
+
+        canceled = False
+
+    sess = get_ssh_session(
+        mock_scp_server.server_address,
+        ["mydata", mock_key_pair.private_key_path])
+    class FakeProgressBar:
+        """
+        Stand-in for tqdm, recording the size of each chunk sent
+        """
+
+        def __init__(self):
+            self.updates = []
+
+        def update(self, num_bytes):
+            """
+            Record the size of a chunk sent
+            """
+            self.updates.append(num_bytes)
+
+    progress_bar = FakeProgressBar()
+    try:
+        send_file_scp(
+            sess, file_path, remote_file_path, FakeUpload(), progress_bar)
+    finally:
+        sess.disconnect()
+    with open(remote_file_path, "rb") as remote_file:
+        assert remote_file.read() == content
+    assert progress_bar.updates == [1000, 1000, 500]
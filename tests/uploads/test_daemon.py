@@ -0,0 +1,175 @@
+"""
+Test running upload cycles in a long-lived daemon process
+"""
+import threading
+
+from tests.fixtures import set_username_dataset_config
+
+
+def test_resolution_cache(set_username_dataset_config):
+    """Test caching records resolved from the MyTardis API
+    """
+    from mydata.utils.resolution import ResolutionCache
+
+    cache = ResolutionCache()
+    lookups = []
+
+    def resolve():
+        lookups.append(True)
+        return "record"
+
+    # The cache is disabled by default:
+    assert cache.get_or_resolve("user", "testuser1", resolve) == "record"
+    assert cache.get_or_resolve("user", "testuser1", resolve) == "record"
+    assert len(lookups) == 2
+
+    cache.enabled = True
+    assert cache.get_or_resolve("user", "testuser1", resolve) == "record"
+    assert cache.get_or_resolve("user", "testuser1", resolve) == "record"
+    assert len(lookups) == 3
+    assert cache.hits == 1
+
+    # Unresolved records aren't cached:
+    assert cache.get_or_resolve("user", "INVALID_USER", lambda: None) is None
+    assert cache.get_or_resolve("user", "INVALID_USER", resolve) == "record"
+
+    cache.clear()
+    cache.get_or_resolve("user", "testuser1", resolve)
+    assert len(lookups) == 5
+
+
+def test_upload_daemon(set_username_dataset_config):
+    """Test running cycles on an interval, on trigger, and reloading settings
+    """
+    from mydata.conf import settings
+    from mydata.tasks.daemon import UploadDaemon
+    from mydata.utils.resolution import RESOLUTION_CACHE
+    from mydata.utils.sessions import API_SESSION_POOL
+
+    cycles = []
+
+    def run_cycle():
+        cycles.append(settings.general.instrument_name)
+        if len(cycles) == 1:
+            raise RuntimeError("Errors don't stop the daemon.")
+
+    daemon = UploadDaemon(run_cycle, interval=0.01)
+    daemon.run(max_cycles=3)
+    assert len(cycles) == 3
+    assert RESOLUTION_CACHE.enabled
+    assert API_SESSION_POOL.enabled
+
+    # Triggering a cycle interrupts the wait for the next interval:
+    daemon = UploadDaemon(run_cycle, interval=60)
+    threading.Timer(0.1, daemon.trigger).start()
+    threading.Timer(0.2, daemon.stop).start()
+    daemon.run()
+    assert daemon.num_cycles == 2
+
+    instrument_name = settings.general.instrument_name
+    settings.general.instrument_name = "Modified Instrument"
+    RESOLUTION_CACHE.get_or_resolve("user", "testuser1", lambda: "record")
+    daemon = UploadDaemon(run_cycle, interval=60)
+    daemon.reload()
+    daemon.run(max_cycles=1)
+    assert cycles[-1] == instrument_name
+    assert not RESOLUTION_CACHE.records
+    assert not API_SESSION_POOL.idle
+
+
+def test_daemon_reload_callback(set_username_dataset_config):
+    """Test calling on_reload after reloading settings
+    """
+    from mydata.tasks.daemon import UploadDaemon
+
+    reloads = []
+    daemon = UploadDaemon(lambda: None, interval=60,
+                          on_reload=lambda: reloads.append(True))
+    daemon.run(max_cycles=1)
+    assert not reloads
+    daemon.reload()
+    daemon.run(max_cycles=1)
+    assert reloads == [True]
+
+
+def test_api_session_pool():
+    """Test reusing MyTardis API sessions only while the pool is enabled
+    """
+    from mydata.utils.sessions import ApiSessionPool
+
+    pool = ApiSessionPool()
+    session = pool.acquire()
+    pool.release(session)
+    assert pool.acquire() is session
+    pool.release(session)
+    pool.close()
+    assert not pool.idle
+
+    pool.enabled = False
+    session = pool.acquire()
+    pool.release(session)
+    assert not pool.idle
+
+
+def test_retry_stats_since():
+    """Test reporting the retries made since a snapshot of the counters
+    """
+    from mydata.utils.retries import RetryStats
+
+    stats = RetryStats()
+    stats.retries = 2
+    stats.backoff_seconds = 1.5
+    start = stats.counts()
+    stats.retries += 3
+    stats.permanent_failures += 1
+    cycle_stats = stats.since(start)
+    assert cycle_stats.retries == 3
+    assert cycle_stats.permanent_failures == 1
+    assert cycle_stats.backoff_seconds == 0
+
+
+def test_ssh_session_discarded_after_failure(
+        set_username_dataset_config, monkeypatch, tmp_path):
+    """Test that an SSH session isn't returned to the pool after a failed
+    transfer, because it may have been left part way through the transfer
+    """
+    import pytest
+
+    from mydata.utils import upload as ssh_upload
+    from mydata.utils.exceptions import SshException
+
+    discarded = []
+    released = []
+    monkeypatch.setattr(
+        ssh_upload.SSH_SESSION_POOL, "acquire",
+        lambda server, auth: ("session", False))
+    monkeypatch.setattr(
+        ssh_upload.SSH_SESSION_POOL, "discard", discarded.append)
+    monkeypatch.setattr(
+        ssh_upload.SSH_SESSION_POOL, "release",
+        lambda server, auth, sess: released.append(sess))
+    monkeypatch.setattr(
+        ssh_upload, "execute_command_over_ssh", lambda sess, command: None)
+
+    def send_file_scp(*args):
+        raise OSError("Connection reset by peer")
+
+    monkeypatch.setattr(ssh_upload, "send_file_scp", send_file_scp)
+
+    file_path = tmp_path / "file.txt"
+    file_path.write_text("content")
+
+    class FakeUpload:
+        """
+        Stand-in for mydata.models.upload.Upload
+        """
+
+        bytes_resumed = 0
+        start_time = None
+
+    with pytest.raises(SshException):
+        ssh_upload.upload_file_ssh(
+            ("localhost", 22), ["mydata"], str(file_path),
+            "/staging/file.txt", FakeUpload(), False, 0)
+    assert discarded == ["session"]
+    assert not released
@@ -0,0 +1,137 @@
+"""
+Test copying files to a locally mounted staging area
+"""
+import errno
+import hashlib
+import os
+import stat
+
+import pytest
+
+from tests.fixtures import set_username_dataset_config
+
+
+class FakeUpload:
+    """
+    Stand-in for mydata.models.upload.Upload
+    """
+
+    def __init__(self, file_size):
+        self.file_size = file_size
+        self.bytes_uploaded = 0
+        self.bytes_resumed = 0
+        self.start_time = None
+        self.canceled = False
+
+    def set_latest_time(self, latest_time):
+        """
+        Upload speeds aren't tested here
+        """
+
+
+@pytest.fixture
+def local_copy_config(set_username_dataset_config, tmp_path):
+    """
+    Configure the LOCAL_COPY upload method to copy to a temporary directory
+    """
+    from mydata.conf import settings
+
+    settings.miscellaneous.mydata_config["upload_chunk_size"] = 1000
+    settings.miscellaneous.mydata_config["local_copy_mount"] = \
+        str(tmp_path / "staging")
+    settings.miscellaneous.mydata_config["local_copy_file_mode"] = "640"
+    settings.miscellaneous.mydata_config["local_copy_fsync"] = "directory"
+    settings.miscellaneous.mydata_config["local_copy_verify"] = False
+    data = os.urandom(2500)
+    file_path = tmp_path / "data.bin"
+    file_path.write_bytes(data)
+    return str(file_path), data
+
+
+def test_local_path(local_copy_config):
+    """Test mapping paths on the staging server to the local mount
+    """
+    from mydata.conf import settings
+    from mydata.utils.exceptions import LocalCopyException
+    from mydata.utils.localcopy import get_local_path
+
+    mount = settings.miscellaneous.local_copy_mount
+    assert get_local_path("/mnt/staging", "/mnt/staging/ds-1/a.txt") == \
+        os.path.join(mount, "ds-1", "a.txt")
+    with pytest.raises(LocalCopyException):
+        get_local_path("/mnt/staging", "/etc/passwd")
+
+    settings.miscellaneous.mydata_config["local_copy_mount"] = ""
+    assert get_local_path("/mnt/staging", "/mnt/staging/ds-1/a.txt") == \
+        "/mnt/staging/ds-1/a.txt"
+
+
+@pytest.mark.parametrize("verify", [False, True])
+def test_copy_file_local(local_copy_config, verify):
+    """Test copying a file with zero-copy functions, or in chunks while
+    calculating its MD5 checksum
+    """
+    from mydata.conf import settings
+    from mydata.utils.localcopy import copy_file_local
+
+    settings.miscellaneous.mydata_config["local_copy_verify"] = verify
+    file_path, data = local_copy_config
+    upload = FakeUpload(len(data))
+    copy_file_local(
+        file_path, "/mnt/staging", "/mnt/staging/ds-1/data.bin",
+        hashlib.md5(data).hexdigest(), upload, False, 0)
+
+    local_path = os.path.join(
+        settings.miscellaneous.local_copy_mount, "ds-1", "data.bin")
+    with open(local_path, "rb") as copied_file:
+        assert copied_file.read() == data
+    assert stat.S_IMODE(os.stat(local_path).st_mode) == 0o640
+    assert upload.bytes_uploaded == len(data)
+
+
+def test_copy_file_local_fallback(local_copy_config, monkeypatch):
+    """Test falling back to a chunked copy when zero-copy functions
+    aren't supported, after copying part of the file
+    """
+    from mydata.conf import settings
+    from mydata.utils import localcopy
+
+    def unsupported_after_first_chunk(src_fd, dst_fd, count):
+        if os.lseek(src_fd, 0, os.SEEK_CUR):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        return os.write(dst_fd, os.read(src_fd, count))
+
+    monkeypatch.setattr(
+        localcopy, "get_zero_copy_functions",
+        lambda: [unsupported_after_first_chunk])
+    file_path, data = local_copy_config
+    upload = FakeUpload(len(data))
+    localcopy.copy_file_local(
+        file_path, "/mnt/staging", "/mnt/staging/data.bin",
+        hashlib.md5(data).hexdigest(), upload, False, 0)
+
+    local_path = os.path.join(
+        settings.miscellaneous.local_copy_mount, "data.bin")
+    with open(local_path, "rb") as copied_file:
+        assert copied_file.read() == data
+    assert upload.bytes_uploaded == len(data)
+
+
+def test_copy_file_local_checksum_mismatch(local_copy_config):
+    """Test that a file which doesn't match its DataFile record's checksum
+    is reported, and that this failure will be retried
+    """
+    from mydata.conf import settings
+    from mydata.utils.exceptions import LocalCopyException
+    from mydata.utils.localcopy import copy_file_local
+    from mydata.utils.retries import FailureType, classify_failure
+
+    settings.miscellaneous.mydata_config["local_copy_verify"] = True
+    file_path, data = local_copy_config
+    with pytest.raises(LocalCopyException) as excinfo:
+        copy_file_local(
+            file_path, "/mnt/staging", "/mnt/staging/data.bin",
+            hashlib.md5(b"modified").hexdigest(), FakeUpload(len(data)),
+            False, 0)
+    assert "doesn't match" in str(excinfo.value)
+    assert classify_failure(excinfo.value) == FailureType.TRANSIENT
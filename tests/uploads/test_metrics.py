@@ -0,0 +1,114 @@
+"""
+Test exporting metrics for Prometheus
+"""
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from urllib.request import urlopen
+
+from tests.fixtures import set_username_dataset_config
+
+LookupResult = namedtuple("LookupResult", ["status"])
+
+
+def test_metrics(set_username_dataset_config, monkeypatch, tmp_path):
+    """Test collecting metrics, and serving them over HTTP
+    and writing them for node_exporter's textfile collector
+    """
+    monkeypatch.setenv("MYDATA_METRICS_PORT", "0")
+    monkeypatch.setenv("MYDATA_METRICS_ADDRESS", "127.0.0.1")
+    monkeypatch.setenv("MYDATA_METRICS_TEXTFILE", str(tmp_path / "mydata.prom"))
+    from mydata.models.lookup import LookupStatus
+    from mydata.models.upload import UploadStatus
+    from mydata.tasks.processes import UploadResult
+    from mydata.utils.instrumentation import INSTRUMENTATION
+    from mydata.utils.metrics import (
+        METRICS,
+        UploadMetrics,
+        escape_label_value,
+        start_metrics_exporter,
+    )
+
+    assert escape_label_value('Dataset "1"\\2\n') == r'Dataset \"1\"\\2\n'
+
+    INSTRUMENTATION.reset()
+    INSTRUMENTATION.record_api_request(
+        "GET", "http://localhost/api/v1/mydata_dataset_file/?format=json", 0.003)
+    INSTRUMENTATION.record_api_request(
+        "GET", "http://localhost/api/v1/mydata_dataset_file/?format=json", 0.5)
+    INSTRUMENTATION.record("lookup_datafile", 0.01)
+
+    metrics = UploadMetrics()
+    metrics.record_lookup(LookupResult(LookupStatus.NOT_FOUND))
+    # Only the bytes sent after resuming an interrupted upload are counted:
+    for upload in (
+            UploadResult("1.jpg", "", UploadStatus.COMPLETED, 1000, 1000, 0),
+            UploadResult("2.jpg", "", UploadStatus.COMPLETED, 1000, 1000, 600),
+            UploadResult("3.jpg", "", UploadStatus.FAILED, 2000, 500, 0)):
+        metrics.record_upload(upload)
+    queue = asyncio.Queue()
+    queue.put_nowait("file")
+    metrics.track_queue("upload", queue)
+    with metrics.in_flight("upload"):
+        rendered = metrics.render()
+    metrics.track_queue("upload", None)
+
+    lines = rendered.splitlines()
+    assert "# TYPE mydata_lookups_total counter" in lines
+    assert 'mydata_lookups_total{status="not_found"} 1' in lines
+    assert 'mydata_lookups_total{status="found_verified"} 0' in lines
+    assert 'mydata_uploads_total{status="completed"} 2' in lines
+    assert 'mydata_uploads_total{status="failed"} 1' in lines
+    assert "mydata_uploaded_bytes_total 1400" in lines
+    assert 'mydata_in_flight_workers{stage="upload"} 1' in lines
+    assert 'mydata_queue_depth{queue="upload"} 1' in lines
+    assert "# TYPE mydata_api_request_duration_seconds histogram" in lines
+    labels = 'method="GET",endpoint="mydata_dataset_file"'
+    # The bucket boundaries are powers of two microseconds:
+    assert 'mydata_api_request_duration_seconds_bucket{%s,le="0.004096"} 1' \
+        % labels in lines
+    assert 'mydata_api_request_duration_seconds_bucket{%s,le="0.262144"} 1' \
+        % labels in lines
+    assert 'mydata_api_request_duration_seconds_bucket{%s,le="+Inf"} 2' \
+        % labels in lines
+    assert "mydata_api_request_duration_seconds_count{%s} 2" % labels in lines
+    assert 'mydata_stage_duration_seconds_count{stage="lookup_datafile"} 1' \
+        in lines
+
+    server = start_metrics_exporter()
+    try:
+        with urlopen("http://127.0.0.1:%s/metrics" % server.server_address[1]) \
+                as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "# TYPE mydata_uploads_total counter" in \
+                response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    METRICS.write_textfile(str(tmp_path / "mydata.prom"))
+    assert [path.name for path in tmp_path.iterdir()] == ["mydata.prom"]
+    assert "mydata_files_scanned_total" in (tmp_path / "mydata.prom").read_text()
+
+
+def test_invalid_metrics_settings(monkeypatch, tmp_path, caplog):
+    """Test that malformed MYDATA_METRICS_* values disable the exporters
+    which use them, with a warning, instead of raising ValueError
+    """
+    monkeypatch.setenv("MYDATA_METRICS_PORT", "metrics")
+    monkeypatch.setenv("MYDATA_METRICS_TEXTFILE", str(tmp_path / "mydata.prom"))
+    monkeypatch.setenv("MYDATA_METRICS_INTERVAL", "0")
+    from mydata.utils.metrics import start_metrics_exporter
+
+    def count_textfile_threads():
+        return sum(
+            thread.name == "metrics_textfile"
+            for thread in threading.enumerate())
+
+    textfile_threads = count_textfile_threads()
+    with caplog.at_level(logging.WARNING):
+        assert start_metrics_exporter() is None
+    assert count_textfile_threads() == textfile_threads
+    assert "Invalid MYDATA_METRICS_PORT: metrics" in caplog.text
+    assert "Invalid MYDATA_METRICS_INTERVAL: 0" in caplog.text
@@ -0,0 +1,119 @@
+"""
+Test uploading large files in several byte ranges in parallel
+"""
+import hashlib
+import os
+import tempfile
+
+import pytest
+from ssh2 import sftp
+
+from tests.fixtures import set_username_dataset_config
+
+
+class FakeSftpHandle:
+    """
+    Stand-in for ssh2.sftp_handle.SFTPHandle, backed by a local file
+    """
+
+    def __init__(self, path):
+        self.file_object = open(path, "r+b")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file_object.close()
+
+    def seek64(self, offset):
+        self.file_object.seek(offset)
+
+    def write(self, data):
+        return 0, self.file_object.write(data)
+
+
+class FakeSftp:
+    """
+    Stand-in for ssh2.sftp.SFTP, backed by local files
+    """
+
+    def open(self, path, flags, mode):  # pylint: disable=unused-argument
+        if not os.path.exists(path) or flags & sftp.LIBSSH2_FXF_TRUNC:
+            open(path, "wb").close()
+        return FakeSftpHandle(path)
+
+
+class FakeSession:
+    """
+    Stand-in for ssh2.session.Session
+    """
+
+    def sftp_init(self):
+        return FakeSftp()
+
+    def disconnect(self):
+        pass
+
+
+class FakeUpload:
+    """
+    Stand-in for mydata.models.upload.Upload
+    """
+
+    canceled = False
+
+
+def test_byte_ranges(set_username_dataset_config):
+    """Test splitting a file into byte ranges
+    """
+    from mydata.utils.upload import get_byte_ranges
+
+    assert get_byte_ranges(10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert get_byte_ranges(8, 4) == [(0, 2), (2, 4), (4, 6), (6, 8)]
+    assert get_byte_ranges(2, 4) == [(0, 1), (1, 2)]
+
+
+def test_parallel_transfer(set_username_dataset_config, monkeypatch):
+    """Test sending a file in parallel byte ranges and verifying its checksum
+    """
+    from mydata.conf import settings
+    from mydata.utils import upload
+    from mydata.utils.exceptions import SshException
+
+    settings.miscellaneous.mydata_config["parallel_transfer_threshold"] = 1000
+    settings.miscellaneous.mydata_config["parallel_transfer_streams"] = 3
+    assert upload.use_parallel_transfer(1000)
+    assert not upload.use_parallel_transfer(999)
+
+    monkeypatch.setattr(
+        upload, "get_ssh_session", lambda server, auth: FakeSession())
+
+    def get_remote_md5(sess, command):
+        with open(command.split()[1], "rb") as remote_file:
+            return "%s  -\n" % hashlib.md5(remote_file.read()).hexdigest()
+
+    monkeypatch.setattr(upload, "get_command_output_over_ssh", get_remote_md5)
+
+    content = os.urandom(100 * 1024 + 1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_path = os.path.join(temp_dir, "local.dat")
+        remote_path = os.path.join(temp_dir, "remote.dat")
+        with open(local_path, "wb") as local_file:
+            local_file.write(content)
+        # An existing file on staging is overwritten:
+        with open(remote_path, "wb") as remote_file:
+            remote_file.write(b"X" * 200 * 1024)
+
+        upload.send_file_parallel(
+            FakeSession(), ("localhost", 22), ("mydata", "key"), local_path,
+            remote_path, len(content), FakeUpload(), None)
+        with open(remote_path, "rb") as remote_file:
+            assert remote_file.read() == content
+
+        monkeypatch.setattr(
+            upload, "get_command_output_over_ssh",
+            lambda sess, command: "0123456789abcdef  -\n")
+        with pytest.raises(SshException):
+            upload.send_file_parallel(
+                FakeSession(), ("localhost", 22), ("mydata", "key"),
+                local_path, remote_path, len(content), FakeUpload(), None)
@@ -0,0 +1,92 @@
+"""
+Test streaming multipart POST uploads
+"""
+import io
+import os
+import tempfile
+
+import pytest
+import requests_mock
+from requests_toolbelt.multipart import encoder
+
+from tests.fixtures import set_username_dataset_config
+
+
+class FakeUpload:
+    """
+    Stand-in for mydata.models.upload.Upload
+    """
+
+    def __init__(self, file_size):
+        self.filename = "test.dat"
+        self.file_size = file_size
+        self.bytes_uploaded = 0
+        self.canceled = False
+        self.buffered_reader = None
+        self.latest_time = None
+
+    def set_latest_time(self, latest_time):
+        """
+        Set the latest time at which this upload was still progressing
+        """
+        self.latest_time = latest_time
+
+
+def test_post_upload_monitor(set_username_dataset_config):
+    """Test reading a multipart POST body in large blocks, with progress
+    """
+    from mydata.models.datafile import PostUploadMonitor
+    from mydata.utils.exceptions import UserAborted
+
+    content = os.urandom(300000)
+    upload = FakeUpload(len(content))
+    encoded = encoder.MultipartEncoder(
+        fields={
+            "json_data": "{}",
+            "attached_file": (
+                "test.dat", io.BytesIO(content), "application/octet-stream"),
+        }
+    )
+    progress = []
+    monitor = PostUploadMonitor(encoded, upload, 100000, progress.append)
+
+    block_sizes = []
+    while True:
+        # httplib's 8 KB read size is ignored:
+        block = monitor.read(8192)
+        if not block:
+            break
+        block_sizes.append(len(block))
+    assert block_sizes[0] == 100000
+    assert sum(block_sizes) == monitor.len
+    assert upload.bytes_uploaded == len(content)
+    assert sum(progress) == len(content)
+    assert upload.latest_time
+
+    upload.canceled = True
+    with pytest.raises(UserAborted):
+        monitor.read(8192)
+
+
+def test_post_upload_headers(set_username_dataset_config):
+    """Test that POST uploads don't modify the default headers
+    """
+    from mydata.conf import settings
+    from mydata.models.datafile import DataFile
+
+    with tempfile.NamedTemporaryFile() as temp_file:
+        temp_file.write(b"hello")
+        temp_file.flush()
+        upload = FakeUpload(5)
+        with requests_mock.Mocker() as mocker:
+            post_datafile_url = (
+                "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url
+            )
+            mocker.post(post_datafile_url, status_code=201)
+            response = DataFile.upload_datafile_with_post(
+                temp_file.name, dict(filename="hello.txt"), upload)
+            assert response.status_code == 201
+            assert mocker.last_request.headers["Content-Type"].startswith(
+                "multipart/form-data")
+        assert settings.default_headers["Content-Type"] == "application/json"
+        assert upload.buffered_reader.closed
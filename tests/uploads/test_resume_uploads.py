@@ -0,0 +1,142 @@
+"""
+Test resuming partial uploads with the SSH2 upload method
+"""
+import os
+import tempfile
+
+from ssh2.exceptions import SFTPProtocolError
+
+from tests.fixtures import set_username_dataset_config
+
+
+class FakeSftpAttributes:
+    """
+    Stand-in for ssh2.sftp_handle.SFTPAttributes
+    """
+
+    def __init__(self, filesize):
+        self.filesize = filesize
+
+
+class FakeSftpHandle:
+    """
+    Stand-in for ssh2.sftp_handle.SFTPHandle, backed by a local file
+    """
+
+    def __init__(self, path):
+        self.file_object = open(path, "rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file_object.close()
+
+    def seek64(self, offset):
+        self.file_object.seek(offset)
+
+    def read(self, size):
+        data = self.file_object.read(size)
+        return len(data), data
+
+
+class FakeSftp:
+    """
+    Stand-in for ssh2.sftp.SFTP, backed by local files
+    """
+
+    def stat(self, path):
+        if not os.path.exists(path):
+            raise SFTPProtocolError()
+        return FakeSftpAttributes(os.path.getsize(path))
+
+    def open(self, path, flags, mode):
+        return FakeSftpHandle(path)
+
+
+class FakeSession:
+    """
+    Stand-in for ssh2.session.Session
+    """
+
+    def sftp_init(self):
+        return FakeSftp()
+
+
+def test_resume_offset(set_username_dataset_config):
+    """Test calculating the offset to resume a partial upload from
+    """
+    from mydata.conf import settings
+    from mydata.utils.upload import get_resume_offset
+
+    content = os.urandom(256 * 1024)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_path = os.path.join(temp_dir, "local.dat")
+        remote_path = os.path.join(temp_dir, "remote.dat")
+        with open(local_path, "wb") as local_file:
+            local_file.write(content)
+
+        # No partial upload on staging:
+        assert get_resume_offset(
+            FakeSession(), local_path, remote_path, len(content)) == 0
+
+        # Partial upload matching the local file:
+        with open(remote_path, "wb") as remote_file:
+            remote_file.write(content[:100000])
+        assert get_resume_offset(
+            FakeSession(), local_path, remote_path, len(content)) == 100000
+
+        # Partial upload which doesn't match the local file:
+        with open(remote_path, "wb") as remote_file:
+            remote_file.write(content[:99999] + b"X")
+        assert get_resume_offset(
+            FakeSession(), local_path, remote_path, len(content)) == 0
+
+        # Resuming disabled:
+        with open(remote_path, "wb") as remote_file:
+            remote_file.write(content[:100000])
+        settings.miscellaneous.resume_uploads = False
+        assert get_resume_offset(
+            FakeSession(), local_path, remote_path, len(content)) == 0
+
+
+def test_resume_only_partial_uploads(set_username_dataset_config, monkeypatch):
+    """Test only checking staging for a partial upload when the file has
+    an unverified DataFile record on staging, or when retrying
+    """
+    from mydata.conf import settings
+    from mydata.tasks import uploads
+    from mydata.utils.exceptions import SshException
+
+    class FakeKeyPair:
+        private_key_path = "/path/to/MyData"
+
+    class FakeUploader:
+        ssh_key_pair = FakeKeyPair()
+
+    class FakeUpload:
+        canceled = False
+        retries = 0
+        file_size = 1024
+
+    settings.advanced.mydata_config["upload_method"] = "SSH2"
+    settings.miscellaneous.mydata_config["retry_backoff_base"] = 0
+    settings.uploader = FakeUploader()
+    attempts = []
+
+    def upload_file_ssh(*args):
+        attempts.append(args[-1])
+        if len(attempts) == 1:
+            raise SshException("Connection reset")
+
+    monkeypatch.setattr(uploads, "upload_file_ssh", upload_file_ssh)
+    for resume in (False, True):
+        attempts.clear()
+        uploads.upload_via_scp_with_retries(
+            "/data/file.txt", "mydata", "staging.example.com", 22,
+            "/mnt/staging/file.txt", FakeUpload(), None, False, 0, resume)
+        # The partial upload from the failed attempt is resumed:
+        assert attempts == [resume, True]
+
+    settings.miscellaneous.resume_verify_bytes = 0
+    assert settings.miscellaneous.resume_verify_bytes == 0
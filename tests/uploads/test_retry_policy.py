@@ -0,0 +1,76 @@
+"""
+Test the retry policy used for file transfers
+"""
+from ssh2.exceptions import AuthenticationError
+
+from tests.fixtures import set_username_dataset_config
+
+
+def test_classify_failure():
+    """Test classifying transfer failures as transient or permanent
+    """
+    from mydata.utils.exceptions import SshException
+    from mydata.utils.retries import classify_failure, FailureType
+
+    assert classify_failure(
+        SshException("Connection timed out")) == FailureType.TRANSIENT
+    assert classify_failure(
+        SshException("scp: /mnt/staging/file.txt: Permission denied")
+    ) == FailureType.PERMANENT
+    assert classify_failure(PermissionError()) == FailureType.PERMANENT
+
+    # The cause of a wrapped exception is classified too:
+    try:
+        try:
+            raise AuthenticationError()
+        except AuthenticationError as err:
+            raise SshException("Couldn't connect") from err
+    except SshException as err:
+        assert classify_failure(err) == FailureType.PERMANENT
+
+
+def test_retry_policy(set_username_dataset_config):
+    """Test backoff delays and the circuit breaker
+    """
+    from mydata.conf import settings
+    from mydata.utils.exceptions import SshException
+    from mydata.utils.retries import TransferRetryPolicy, FailureType
+
+    settings.miscellaneous.mydata_config["retry_backoff_base"] = 0.5
+    settings.miscellaneous.mydata_config["retry_backoff_max"] = 2.0
+    settings.miscellaneous.mydata_config["circuit_breaker_threshold"] = 3
+    settings.miscellaneous.mydata_config["circuit_breaker_timeout"] = 60.0
+
+    policy = TransferRetryPolicy(settings)
+    for attempt in range(1, 10):
+        delay = policy.backoff_delay(attempt)
+        assert 0 <= delay <= min(2.0, 0.5 * 2 ** (attempt - 1))
+
+    host = "staging.example.com:22"
+    for _ in range(2):
+        assert policy.record_failure(
+            host, SshException("Connection reset")) == FailureType.TRANSIENT
+    assert policy.circuit_breaker(host).seconds_until_closed == 0
+    policy.record_failure(host, SshException("Connection reset"))
+    assert policy.circuit_breaker(host).seconds_until_closed > 0
+    assert policy.stats.circuit_breaker_trips == 1
+
+    # Waiting returns early when canceled:
+    policy.wait_for_circuit(host, lambda: True)
+
+    policy.record_success(host)
+    assert policy.circuit_breaker(host).seconds_until_closed == 0
+
+    assert policy.record_failure(
+        host, SshException("Permission denied")) == FailureType.PERMANENT
+    assert policy.stats.transient_failures == 3
+    assert policy.stats.permanent_failures == 1
+
+    # Changes to the settings apply to existing circuit breakers:
+    settings.miscellaneous.mydata_config["circuit_breaker_threshold"] = 1
+    policy.record_failure(host, SshException("Connection reset"))
+    assert policy.stats.circuit_breaker_trips == 2
+    policy.record_success(host)
+    settings.miscellaneous.mydata_config["circuit_breaker_threshold"] = 0
+    policy.record_failure(host, SshException("Connection reset"))
+    assert policy.circuit_breaker(host).seconds_until_closed == 0
@@ -0,0 +1,84 @@
+"""
+Test per-stage instrumentation and the run report
+"""
+import json
+
+import pytest
+import requests_mock
+
+from tests.fixtures import set_username_dataset_config
+
+from tests.mocks import (
+    mock_testfacility_user_response,
+    mock_testusers_response,
+    mock_invalid_user_response,
+    mock_test_facility_response,
+    mock_test_instrument_response,
+)
+
+
+def test_latency_histogram(set_username_dataset_config):
+    """Test estimating latency percentiles from histogram buckets
+    """
+    from mydata.utils.instrumentation import LatencyHistogram
+
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    for millis in range(1, 101):
+        histogram.record(millis / 1000.0)
+    assert histogram.count == 100
+    assert histogram.max_seconds == 0.1
+    # Percentiles are upper bounds, at most 9% above the true latency:
+    assert 0.050 <= histogram.percentile(50) <= 0.050 * 1.091
+    assert 0.095 <= histogram.percentile(95) <= 0.095 * 1.091
+    assert 0.099 <= histogram.percentile(99) <= 0.1
+    assert histogram.percentile(100) == 0.1
+
+
+def test_run_report(set_username_dataset_config, tmp_path, monkeypatch):
+    """Test timing stages, counting API requests and writing the run report
+    """
+    from mydata.conf import settings
+    from mydata.tasks.folders import scan_folders
+    from mydata.utils.instrumentation import INSTRUMENTATION
+
+    INSTRUMENTATION.reset()
+
+    with INSTRUMENTATION.timer("calculate_md5_sum", 1000):
+        pass
+    with pytest.raises(ValueError):
+        with INSTRUMENTATION.timer("calculate_md5_sum", 1000):
+            raise ValueError("Hashing failed")
+
+    folders = []
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, settings.general.mytardis_url)
+        mock_testusers_response(mocker, settings, ["testuser1", "testuser2"])
+        mock_invalid_user_response(mocker, settings)
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+        scan_folders(lambda user: None, None, None, folders.append)
+
+    # The run report is only written if MYDATA_RUN_REPORT is set:
+    monkeypatch.delenv("MYDATA_RUN_REPORT", raising=False)
+    assert INSTRUMENTATION.write_report() is None
+    monkeypatch.setenv("MYDATA_RUN_REPORT", str(tmp_path))
+    report_path = INSTRUMENTATION.write_report()
+    assert report_path == str(tmp_path / ".MyData_run_report.json")
+    with open(report_path) as report_file:
+        report = json.load(report_file)
+
+    stages = report["stages"]
+    assert stages["scan_folders"]["count"] == 1
+    assert stages["populate_local_files"]["count"] == len(folders) == 4
+    md5_stats = stages["calculate_md5_sum"]
+    assert md5_stats["count"] == 2
+    assert md5_stats["errors"] == 1
+    assert md5_stats["bytes"] == 1000
+    assert md5_stats["p50_seconds"] <= md5_stats["p99_seconds"]
+    assert md5_stats["p99_seconds"] <= md5_stats["max_seconds"]
+
+    api_requests = report["api_requests"]
+    # The facility user, and the users for the three user folders:
+    assert api_requests["by_endpoint"]["GET user"] == 4
+    assert api_requests["total"] == sum(api_requests["by_endpoint"].values())
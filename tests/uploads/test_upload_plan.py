@@ -0,0 +1,163 @@
+"""
+Test planning uploads without transferring any files
+"""
+import csv
+import io
+import json
+
+import requests_mock
+
+from tests.fixtures import set_username_dataset_config
+
+from tests.mocks import (
+    mock_testfacility_user_response,
+    mock_testusers_response,
+    mock_invalid_user_response,
+    mock_test_facility_response,
+    mock_test_instrument_response,
+    mock_exp_creation,
+    mock_birds_flowers_dataset_creation,
+    mock_birds_flowers_datafile_listings,
+    EMPTY_LIST_RESPONSE,
+    EXISTING_EXP_RESPONSE,
+    FLOWERS_DATASET_ID,
+)
+
+
+def test_upload_plan(set_username_dataset_config):
+    """Test planning uploads, and restricting uploads to the planned files
+    """
+    from mydata.conf import settings
+    from mydata.tasks.folders import scan_folders
+    from mydata.tasks.plan import apply_plan, load_plan, plan_upload
+    from mydata.models.upload import UploadMethod
+
+    users = []
+    folders = []
+
+    def found_user(user):
+        users.append(user)
+
+    def found_dataset(folder):
+        folders.append(folder)
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, settings.general.mytardis_url)
+        mock_testusers_response(mocker, settings, ["testuser1", "testuser2"])
+        mock_invalid_user_response(mocker, settings)
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+
+        scan_folders(found_user, None, None, found_dataset)
+
+    with requests_mock.Mocker() as mocker:
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+        mocker.get("/api/v1/mydata_experiment/", text=EXISTING_EXP_RESPONSE)
+        mock_exp_creation(
+            mocker, settings,
+            "Test Instrument - INVALID_USER (USER NOT FOUND IN MYTARDIS)",
+            "INVALID_USER")
+        mocker.get(
+            "/api/v1/dataset/?format=json&experiments__id=1",
+            text=EMPTY_LIST_RESPONSE)
+        mock_birds_flowers_dataset_creation(mocker, settings)
+        mock_birds_flowers_datafile_listings(mocker, api_prefix="mydata_")
+
+        upload_plan = plan_upload(folders, UploadMethod.MULTIPART_POST)
+
+        # No records were created:
+        assert not [
+            request for request in mocker.request_history
+            if request.method == "POST"]
+
+    plan_dict = upload_plan.to_dict()
+    datasets = dict(
+        (dataset["dataset_folder"], dataset) for dataset in plan_dict["datasets"])
+    flowers = datasets["testuser1/Flowers"]
+    assert flowers["dataset_id"] == FLOWERS_DATASET_ID
+    assert flowers["num_files"] == 8
+    # Two of the Flowers files have been verified:
+    assert flowers["num_files_to_upload"] == 6
+    assert "Pond_Water_Hyacinth_Flowers.jpg" in flowers["files"]
+    assert "1024px-Colourful_flowers.JPG" not in flowers["files"]
+    assert not datasets["testuser2/Birds"]["dataset_id"]
+    assert datasets["testuser2/Birds"]["num_files_to_upload"] == 2
+    assert not datasets["INVALID_USER/InvalidUserDataset1"]["experiment_id"]
+
+    totals = plan_dict["totals"]
+    assert totals["num_datasets_to_create"] == 3
+    assert totals["num_experiments_to_create"] == 1
+    assert totals["num_files"] == 12
+    assert totals["num_files_to_upload"] == 10
+    assert totals["num_bytes_to_upload"] == sum(
+        dataset["num_bytes_to_upload"] for dataset in datasets.values())
+
+    upload_plan.throughput = 1000000
+    assert upload_plan.to_dict()["totals"]["estimated_seconds"] == round(
+        totals["num_bytes_to_upload"] / 1000000, 1)
+
+    csv_file = io.StringIO()
+    upload_plan.write_csv(csv_file)
+    csv_file.seek(0)
+    rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 4
+
+    json_file = io.StringIO()
+    upload_plan.write_json(json_file)
+    json_file.seek(0)
+    planned_folders = apply_plan(folders, load_plan(json_file))
+    assert len(planned_folders) == 4
+    assert sum([folder.num_files for folder in planned_folders]) == 10
+
+    json_file = io.StringIO(json.dumps(dict(datasets=[{"files": []}])))
+    try:
+        load_plan(json_file)
+        assert False, "Expected ValueError for invalid plan"
+    except ValueError:
+        pass
+
+
+def test_planned_upload_method(set_username_dataset_config):
+    """Test choosing the upload method to plan with, without checking
+    (and possibly requesting) approval for uploads via staging
+    """
+    from mydata.commands.upload import get_planned_upload_method
+    from mydata.conf import settings
+    from mydata.models.upload import UploadMethod
+
+    with requests_mock.Mocker() as mocker:
+        assert get_planned_upload_method() == UploadMethod.SCP
+        settings.advanced.mydata_config["upload_method"] = "LOCAL_COPY"
+        assert get_planned_upload_method() == UploadMethod.LOCAL_COPY
+        assert not mocker.request_history
+
+
+def test_get_lookup_status(set_username_dataset_config):
+    """Test classifying DataFile records found by lookups and by planning
+    """
+    from types import SimpleNamespace
+
+    from mydata.models.lookup import LookupStatus
+    from mydata.models.upload import UploadMethod
+    from mydata.tasks.lookups import get_lookup_status, UPLOAD_LOOKUP_STATUSES
+
+    verified = SimpleNamespace(replicas=[SimpleNamespace(verified=True)])
+    unverified = SimpleNamespace(replicas=[SimpleNamespace(verified=False)])
+    no_dfos = SimpleNamespace(replicas=[])
+
+    expected = [
+        (None, UploadMethod.SCP, LookupStatus.NOT_FOUND),
+        (verified, UploadMethod.SCP, LookupStatus.FOUND_VERIFIED),
+        (unverified, UploadMethod.SCP, LookupStatus.FOUND_UNVERIFIED_ON_STAGING),
+        (unverified, UploadMethod.MULTIPART_POST,
+         LookupStatus.FOUND_UNVERIFIED_UNSTAGED),
+        (no_dfos, UploadMethod.SCP, LookupStatus.FOUND_UNVERIFIED_NO_DFOS),
+        (no_dfos, UploadMethod.MULTIPART_POST,
+         LookupStatus.FOUND_UNVERIFIED_NO_DFOS),
+    ]
+    for datafile, upload_method, status in expected:
+        assert get_lookup_status(datafile, upload_method) == status
+
+    # Unverified files uploaded via POST just need to be verified:
+    assert LookupStatus.FOUND_UNVERIFIED_UNSTAGED not in UPLOAD_LOOKUP_STATUSES
@@ -0,0 +1,151 @@
+"""
+Test uploading folders in worker processes
+"""
+import os
+import pickle
+
+from string import Template
+from urllib.parse import quote
+
+import requests_mock
+
+from tests.fixtures import set_username_dataset_config
+
+from tests.mocks import (
+    mock_testfacility_user_response,
+    mock_testusers_response,
+    mock_invalid_user_response,
+    mock_test_facility_response,
+    mock_test_instrument_response,
+    mock_exp_creation,
+    EMPTY_LIST_RESPONSE,
+    created_dataset_response,
+)
+
+
+class FakeFolder:
+    """
+    Stand-in for mydata.models.folder.Folder
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    @property
+    def num_files(self):
+        """
+        Return total number of files in this folder
+        """
+        return len(self.sizes)
+
+    def get_datafile_size(self, datafile_index):
+        """
+        Return a file's size
+        """
+        return self.sizes[datafile_index]
+
+
+def test_shard_folders(set_username_dataset_config):
+    """Test sharding folders with similar total sizes
+    """
+    from mydata.tasks.processes import shard_folders
+
+    folders = [
+        FakeFolder([100]),
+        FakeFolder([50, 40]),
+        FakeFolder([60]),
+        FakeFolder([10, 10]),
+    ]
+    assert shard_folders(folders, 2) == [[0, 3], [1, 2]]
+    assert shard_folders(folders, 1) == [[0, 1, 2, 3]]
+    assert shard_folders(folders[:1], 3) == [[0]]
+
+
+def test_upload_folders_in_worker(set_username_dataset_config):
+    """Test that a worker's results can be returned to the parent process
+    """
+    # pylint: disable=too-many-locals
+    from mydata.conf import settings
+    from mydata.tasks.folders import scan_folders
+    from mydata.tasks.processes import (
+        upload_folders_in_worker,
+        merge_worker_results,
+    )
+    from mydata.models.upload import UploadStatus, UploadMethod
+    from mydata.models.settings.snapshot import SettingsSnapshot
+    from mydata.utils.instrumentation import INSTRUMENTATION
+
+    folders = []
+
+    def found_dataset(folder):
+        folders.append(folder)
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, settings.general.mytardis_url)
+        mock_testusers_response(mocker, settings, ["testuser1", "testuser2"])
+        mock_invalid_user_response(mocker, settings)
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+
+        scan_folders(lambda user: None, None, None, found_dataset)
+
+    folders = [folder for folder in folders if folder.name == "Flowers"]
+    assert len(folders) == 1
+    # Folders are sent to worker processes:
+    folders = pickle.loads(pickle.dumps(folders))
+
+    with requests_mock.Mocker() as mocker:
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+        mock_exp_creation(
+            mocker, settings, "Test Instrument - Test User1", "testuser1")
+        get_dataset_url = (
+            "%s/api/v1/dataset/?format=json&experiments__id=1"
+            "&description=%s&instrument__id=1"
+        ) % (settings.general.mytardis_url, quote(folders[0].name))
+        mocker.get(get_dataset_url, text=EMPTY_LIST_RESPONSE)
+        get_df_url_template = Template(
+            (
+                "%s/api/v1/mydata_dataset_file/?format=json&dataset__id=1"
+                "&filename=$filename&directory="
+            )
+            % settings.general.mytardis_url
+        )
+        for dfi in range(0, folders[0].num_files):
+            datafile_name = os.path.basename(folders[0].get_datafile_path(dfi))
+            mocker.get(
+                get_df_url_template.substitute(filename=quote(datafile_name)),
+                text=EMPTY_LIST_RESPONSE)
+        mocker.post(
+            "%s/api/v1/dataset/" % settings.general.mytardis_url,
+            text=created_dataset_response(1, folders[0].name))
+        mocker.post(
+            "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url,
+            status_code=201)
+
+        # As are the parent process's settings:
+        settings_snapshot = pickle.loads(pickle.dumps(SettingsSnapshot(settings)))
+        results = upload_folders_in_worker(
+            folders, False, UploadMethod.MULTIPART_POST, settings_snapshot)
+
+    results = pickle.loads(pickle.dumps(results))
+    # The worker's timings are added to the parent process's:
+    INSTRUMENTATION.reset()
+
+    num_files = folders[0].num_files
+    folders[0].local_files = pickle.loads(pickle.dumps(folders[0].local_files))
+    for local_file in folders[0].local_files:
+        local_file.uploaded = False
+    folders[0].set_datafile_uploaded(0, False)
+    assert folders[0].num_files_uploaded == 0
+
+    lookups = []
+    uploads = []
+    merge_worker_results(folders, results, lookups.append, uploads.append)
+    assert len(lookups) == num_files
+    assert len(uploads) == num_files
+    assert all(upload.status == UploadStatus.COMPLETED for upload in uploads)
+    assert folders[0].num_files_uploaded == num_files
+    stages, api_requests = INSTRUMENTATION.snapshot()
+    assert stages["calculate_md5_sum"].histogram.count == num_files
+    assert api_requests["POST mydata_dataset_file"].count == num_files
@@ -0,0 +1,200 @@
+"""
+Test watching the data directory for new files
+"""
+import os
+
+from tests.fixtures import set_username_dataset_config
+
+
+def test_watchers(set_username_dataset_config, tmp_path):
+    """Test finding new files with inotify and by polling
+    """
+    from mydata.utils.fswatch import InotifyWatcher, PollingWatcher
+
+    root = str(tmp_path)
+    inotify_watcher = InotifyWatcher(root)
+    polling_watcher = PollingWatcher(root, interval=0)
+
+    dataset_dir = os.path.join(root, "testuser1", "Dataset1")
+    os.makedirs(dataset_dir)
+    new_file = os.path.join(dataset_dir, "new_file.txt")
+    with open(new_file, "w") as file_handle:
+        file_handle.write("new file")
+
+    # The new directory is watched, and files created in it
+    # before its watch was added are found:
+    paths = set()
+    for _ in range(3):
+        paths.update(inotify_watcher.read_events(timeout=0.1).paths)
+    assert paths == {new_file}
+    another_file = os.path.join(dataset_dir, "another_file.txt")
+    with open(another_file, "w") as file_handle:
+        file_handle.write("another file")
+    assert inotify_watcher.read_events(timeout=1).paths == {another_file}
+    inotify_watcher.close()
+
+    assert polling_watcher.read_events(timeout=1).paths == \
+        {new_file, another_file}
+    assert not polling_watcher.read_events(timeout=1).paths
+
+
+
+def test_inotify_directory_moves(set_username_dataset_config, tmp_path):
+    """Test updating inotify watches when watched directories are moved
+    """
+    from mydata.utils.fswatch import InotifyWatcher
+
+    root = str(tmp_path / "data")
+    user_dir = os.path.join(root, "testuser1")
+    os.makedirs(os.path.join(user_dir, "Dataset1", "subdir"))
+    inotify_watcher = InotifyWatcher(root)
+
+    def read_paths():
+        paths = set()
+        for _ in range(3):
+            paths.update(inotify_watcher.read_events(timeout=0.1).paths)
+        return paths
+
+    # Renaming a dataset folder:
+    os.rename(os.path.join(user_dir, "Dataset1"),
+              os.path.join(user_dir, "Dataset2"))
+    assert not read_paths()
+    new_file = os.path.join(user_dir, "Dataset2", "subdir", "new_file.txt")
+    with open(new_file, "w") as file_handle:
+        file_handle.write("new file")
+    assert read_paths() == {new_file}
+
+    # Moving a dataset folder out of the data directory:
+    outside_dir = str(tmp_path / "Dataset2")
+    os.rename(os.path.join(user_dir, "Dataset2"), outside_dir)
+    assert not read_paths()
+    with open(os.path.join(outside_dir, "subdir", "another_file.txt"),
+              "w") as file_handle:
+        file_handle.write("another file")
+    assert not read_paths()
+    assert sorted(inotify_watcher.watch_paths.values()) == [root, user_dir]
+    inotify_watcher.close()
+
+
+def test_pending_files(set_username_dataset_config, tmp_path):
+    """Test waiting for files to stop changing before uploading them
+    """
+    from mydata.tasks.watch import PendingFiles
+
+    path = os.path.join(str(tmp_path), "file.txt")
+    with open(path, "w") as file_handle:
+        file_handle.write("data")
+    os.utime(path, (1000, 1000))
+
+    pending = PendingFiles(quiet_period=60)
+    pending.add([path, os.path.join(str(tmp_path), "deleted.txt")], now=1000)
+    assert not pending.pop_ready(now=1059)
+    assert len(pending) == 1
+    pending.add([path], now=1030)
+    assert not pending.pop_ready(now=1060)
+    assert pending.pop_ready(now=1090) == [path]
+    assert len(pending) == 0
+
+
+
+def test_retry_failed_uploads(set_username_dataset_config, monkeypatch):
+    """Test uploading a file again after its upload failed, without it
+    being modified again, and leaving a supplied watcher open
+    """
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.upload import UploadStatus
+    from mydata.tasks import watch
+    from mydata.utils.fswatch import WatchEvents
+
+    user_dir = os.path.join(settings.general.data_directory, "testuser1")
+    flowers = Folder("Flowers", user_dir, "testuser1", None, None)
+    flowers_file = flowers.get_datafile_path(0)
+
+    class FakeWatcher:
+        """
+        Stand-in for InotifyWatcher, reporting one changed file
+        """
+
+        def __init__(self):
+            self.events = [WatchEvents({flowers_file}, False)]
+            self.closed = False
+
+        def read_events(self, timeout):
+            """
+            Return the next events, if any
+            """
+            if self.events:
+                return self.events.pop()
+            return WatchEvents(set(), False)
+
+        def close(self):
+            """
+            Stop watching
+            """
+            self.closed = True
+
+    class FakeUpload:
+        """
+        Stand-in for mydata.models.upload.Upload
+        """
+
+        def __init__(self, status):
+            self.datafile_index = 0
+            self.status = status
+
+    statuses = [UploadStatus.FAILED, UploadStatus.COMPLETED]
+    uploaded = []
+
+    async def upload_folder(folder, lookup_callback, upload_callback, *args):
+        uploaded.append(folder.get_datafile_path(0))
+        upload_callback(FakeUpload(statuses.pop(0)))
+
+    monkeypatch.setattr(watch, "upload_folder", upload_folder)
+    monkeypatch.setattr(watch, "get_quiet_period", lambda: 0)
+    monkeypatch.setattr(watch, "FAILED_RETRY_SECONDS", 0)
+    watcher = FakeWatcher()
+    completed = []
+    watch.watch_data_directory(
+        [flowers], lambda lookup: None,
+        lambda upload: completed.append(upload.status),
+        should_stop=lambda: len(uploaded) == 2, watcher=watcher)
+    assert uploaded == [flowers_file, flowers_file]
+    assert completed == [UploadStatus.FAILED, UploadStatus.COMPLETED]
+    assert not watcher.closed
+
+
+def test_get_batches(set_username_dataset_config):
+    """Test mapping changed files to the dataset folders containing them
+    """
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.tasks.watch import DatasetFolderMap, get_batches
+
+    user_dir = os.path.join(settings.general.data_directory, "testuser1")
+    flowers = Folder("Flowers", user_dir, "testuser1", None, None)
+    folder_map = DatasetFolderMap([flowers])
+
+    flowers_file = flowers.get_datafile_path(0)
+    hello_file = os.path.join(user_dir, "Dataset with spaces", "hello.txt")
+    assert folder_map.find(flowers_file) is flowers
+    assert folder_map.find(hello_file) is None
+
+    spaces = Folder("Dataset with spaces", user_dir, "testuser1", None, None)
+    rescans = []
+
+    def rescan():
+        rescans.append(True)
+        return DatasetFolderMap([flowers, spaces])
+
+    folder_map, batches = get_batches(
+        folder_map, [flowers_file, hello_file], rescan)
+    assert len(rescans) == 1
+    assert folder_map.find(hello_file) is spaces
+    assert sorted(batch.name for batch in batches) == \
+        ["Dataset with spaces", "Flowers"]
+    for batch in batches:
+        assert batch.num_files == 1
+        assert batch.local_files[0].directory == ""
+    # The scanned folders' files are unchanged:
+    assert flowers.num_files > 1
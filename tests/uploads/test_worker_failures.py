@@ -0,0 +1,127 @@
+"""
+Test reporting unexpected errors in the hashing and upload workers
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fixtures import set_username_dataset_config
+
+
+class FakeFolder:
+    """
+    Stand-in for mydata.models.folder.Folder
+    """
+
+    def __init__(self):
+        self.uploaded = dict()
+
+    @staticmethod
+    def get_datafile_path(datafile_index):
+        """
+        Return a data file's path
+        """
+        return "/data/file%s.txt" % datafile_index
+
+    def set_datafile_uploaded(self, datafile_index, uploaded):
+        """
+        Record whether a data file was uploaded
+        """
+        self.uploaded[datafile_index] = uploaded
+
+
+class FakeLookup:
+    """
+    Stand-in for mydata.models.lookup.Lookup
+    """
+
+    datafile_index = 3
+
+
+class FakeUpload:
+    """
+    Stand-in for mydata.models.upload.Upload
+    """
+
+    def __init__(self, folder, datafile_index):
+        from mydata.models.upload import UploadStatus
+
+        self.folder = folder
+        self.datafile_index = datafile_index
+        self.status = UploadStatus.NOT_STARTED
+        self.message = ""
+        self.traceback = None
+
+
+def run_worker(worker, queue, item):
+    """
+    Run a worker until it has processed one queued item
+    """
+
+    async def run():
+        queue.put_nowait(item)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            task = asyncio.ensure_future(worker(executor))
+            await queue.join()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_hash_worker_failure(set_username_dataset_config, monkeypatch):
+    """Test that an error while preparing an upload is reported as a
+    failed upload
+    """
+    from mydata.models.upload import UploadStatus
+    from mydata.tasks import uploads
+
+    def prepare_upload(folder, lookup, upload_callback):
+        raise RuntimeError("Disk error")
+
+    monkeypatch.setattr(uploads, "prepare_upload", prepare_upload)
+    monkeypatch.setattr(uploads, "Upload", FakeUpload)
+    folder = FakeFolder()
+    failed = []
+
+    async def worker(executor):
+        await uploads.hash_file_worker(hash_queue, asyncio.Queue(), executor)
+
+    hash_queue = asyncio.Queue()
+    run_worker(worker, hash_queue, (folder, FakeLookup(), failed.append))
+    assert len(failed) == 1
+    assert failed[0].status == UploadStatus.FAILED
+    assert failed[0].datafile_index == 3
+    assert "Disk error" in failed[0].message
+    assert folder.uploaded == {3: False}
+
+
+def test_upload_worker_failure(set_username_dataset_config, monkeypatch):
+    """Test that an unexpected error while transferring a file is reported
+    as a failed upload, unless the upload had already been finalized
+    """
+    from mydata.models.upload import UploadStatus
+    from mydata.tasks import uploads
+
+    def transfer_file(folder, lookup, upload, *args):
+        # pylint: disable=unused-argument
+        if upload.datafile_index == 4:
+            upload.status = UploadStatus.COMPLETED
+        raise RuntimeError("Unexpected error")
+
+    monkeypatch.setattr(uploads, "transfer_file", transfer_file)
+    folder = FakeFolder()
+    failed = []
+
+    async def worker(executor):
+        await uploads.upload_file_worker("worker-0", upload_queue, executor)
+
+    for datafile_index in (3, 4):
+        upload_queue = asyncio.Queue()
+        run_worker(
+            worker, upload_queue,
+            (folder, FakeLookup(), FakeUpload(folder, datafile_index), {},
+             failed.append))
+    assert len(failed) == 1
+    assert failed[0].status == UploadStatus.FAILED
+    assert failed[0].datafile_index == 3
+    assert "Unexpected error" in failed[0].message